@@ -5,6 +5,7 @@ smartly use arbitrarily-formatted date time strings into python datetime objects
 from .timedelta import *
 from .timedeltaRanges import *
 from .dateRanges import *
+from .dateRangesIndex import *
 from .commonDateRanges import *
 from .fuzzytime import *
 from .miscFunctions import *
@@ -4,11 +4,375 @@ Manage and (schedule sets) of alarm timers
 """
 import typing
 import bisect
+import heapq
+import itertools
 import datetime
+import time
 import threading
+import asyncio
+import collections
+import concurrent.futures
+import os
+import json
+import importlib
+import multiprocessing
+import multiprocessing.connection
+import queue
 
 AlarmTimeoutCompatible=typing.Union[datetime.datetime,datetime.timedelta]
 
+# what a PeriodicAlarm does about occourances it missed
+# (eg, because nothing was running, or the callback ran long)
+#   skip - forget them and carry on with the next one
+#   once - fire once right away for all of them
+#   all - fire once right away, passing the callback count=<how many
+#       occourances the call stands for> (only when that is more than one,
+#       so on-time calls are made just as with the other policies)
+CatchUpPolicy=typing.Literal['skip','once','all']
+
+# [fire timestamp,insertion order,alarm (or None if cancelled)]
+AlarmHeapEntry=typing.List[typing.Any]
+
+# how many CallbackTimings an AlarmSet remembers
+CALLBACK_TIMINGS_KEPT=1000
+
+# how many callback exceptions each ShardedAlarmSet worker remembers
+SHARD_ERRORS_KEPT=100
+
+
+class CallbackTiming(typing.NamedTuple):
+    """
+    How long an alarm's callback took
+    """
+    alarm:"Alarm"
+    scheduled:float # unix time the alarm was due
+    dispatched:float # unix time it was called (or handed to the executor)
+    duration:float # seconds the call itself took
+    exception:typing.Optional[BaseException]=None
+
+    @property
+    def lateness(self)->float:
+        """
+        seconds between when the alarm was due and when it was called
+        """
+        return self.dispatched-self.scheduled
+
+
+def _decades(low:int,high:int)->typing.Tuple[float,...]:
+    """
+    1,2,5 steps from 10**low up to 10**high
+    """
+    return tuple(m*10.0**e for e in range(low,high) for m in (1,2,5))+(
+        10.0**high,)
+
+# histogram buckets for times, in seconds (10us to 100s)
+SECONDS_BUCKETS=_decades(-5,2)
+# histogram buckets for counts
+COUNT_BUCKETS=(0.0,)+_decades(0,7)
+
+
+class Histogram:
+    """
+    A fixed-bucket histogram, cheap enough to record into every time
+    an alarm fires
+    """
+
+    def __init__(self,bounds:typing.Sequence[float]=SECONDS_BUCKETS):
+        """
+        :bounds: the upper bound of each bucket, in ascending order.
+            Anything over the last bound goes into one more bucket.
+        """
+        self.bounds:typing.Tuple[float,...]=tuple(bounds)
+        self.clear()
+
+    def clear(self)->None:
+        """
+        forget everything recorded
+        """
+        self.counts:typing.List[int]=[0]*(len(self.bounds)+1)
+        self.count:int=0
+        self.total:float=0.0
+        self.min:float=float('inf')
+        self.max:float=float('-inf')
+
+    def record(self,value:float)->None:
+        """
+        record a value
+        """
+        self.counts[bisect.bisect_left(self.bounds,value)]+=1
+        self.count+=1
+        self.total+=value
+        if value<self.min:
+            self.min=value
+        if value>self.max:
+            self.max=value
+
+    @property
+    def mean(self)->float:
+        """
+        the mean of all recorded values (nan if there are none)
+        """
+        if not self.count:
+            return float('nan')
+        return self.total/self.count
+
+    def percentile(self,fraction:float)->float:
+        """
+        the upper bound of the bucket holding the given fraction
+        of values (eg, .99 for the 99th percentile)
+
+        (nan if there are no values)
+        """
+        if not self.count:
+            return float('nan')
+        target=fraction*self.count
+        seen=0
+        for bound,count in zip(self.bounds,self.counts):
+            seen+=count
+            if seen>=target:
+                return min(bound,self.max)
+        return self.max
+
+    def merge(self,other:"Histogram")->None:
+        """
+        add in everything recorded by another histogram
+        with the same bounds
+        """
+        if other.bounds!=self.bounds:
+            raise Exception('Cannot merge histograms with different bounds')
+        self.counts=[a+b for a,b in zip(self.counts,other.counts)]
+        self.count+=other.count
+        self.total+=other.total
+        self.min=min(self.min,other.min)
+        self.max=max(self.max,other.max)
+
+    def asDict(self)->typing.Dict[str,typing.Any]:
+        """
+        a summary of the histogram
+        """
+        return {
+            'count':self.count,
+            'mean':self.mean,
+            'min':self.min if self.count else float('nan'),
+            'max':self.max if self.count else float('nan'),
+            'p50':self.percentile(.5),
+            'p90':self.percentile(.9),
+            'p99':self.percentile(.99),
+            'buckets':list(zip(self.bounds+(float('inf'),),self.counts))}
+
+    def __repr__(self)->str:
+        return f'{self.count} values, mean={self.mean}, p99={self.percentile(.99)}' # noqa: E501 # pylint: disable=line-too-long
+
+
+class AlarmMetrics:
+    """
+    Measurements of how an AlarmSet is keeping up
+    """
+
+    def __init__(self):
+        self.lateness=Histogram(SECONDS_BUCKETS)
+        self.callbackDuration=Histogram(SECONDS_BUCKETS)
+        self.queueDepth=Histogram(COUNT_BUCKETS)
+        self.wakeups:int=0
+        self.fired:int=0
+        self.failed:int=0 # fired, but the callback raised an exception
+        self.early:int=0 # fired ahead of time (eg, coalesced)
+
+    def clear(self)->None:
+        """
+        start measuring again from scratch
+        """
+        self.lateness.clear()
+        self.callbackDuration.clear()
+        self.queueDepth.clear()
+        self.wakeups=0
+        self.fired=0
+        self.failed=0
+        self.early=0
+
+    def merge(self,other:"AlarmMetrics")->None:
+        """
+        add in everything measured by another AlarmMetrics
+        """
+        self.lateness.merge(other.lateness)
+        self.callbackDuration.merge(other.callbackDuration)
+        self.queueDepth.merge(other.queueDepth)
+        self.wakeups+=other.wakeups
+        self.fired+=other.fired
+        self.failed+=other.failed
+        self.early+=other.early
+
+    def asDict(self)->typing.Dict[str,typing.Any]:
+        """
+        all the measurements
+        """
+        return {
+            'wakeups':self.wakeups,
+            'fired':self.fired,
+            'failed':self.failed,
+            'early':self.early,
+            'lateness':self.lateness.asDict(),
+            'callbackDuration':self.callbackDuration.asDict(),
+            'queueDepth':self.queueDepth.asDict()}
+
+
+def _timedCall(
+    call:typing.Callable[[],typing.Any]
+    )->typing.Tuple[typing.Any,float]:
+    """
+    call something and return (result,seconds it took)
+
+    (module-level so that it can be sent to a process pool)
+    """
+    start=time.perf_counter()
+    result=call()
+    return result,time.perf_counter()-start
+
+
+# name -> callable, for callables that alarms can be saved with
+CALLABLE_REGISTRY:typing.Dict[str,typing.Callable]={}
+_CALLABLE_NAMES:typing.Dict[typing.Callable,str]={}
+
+@typing.overload
+def registerCallable(fn:typing.Callable,name:typing.Optional[str]=None
+    )->typing.Callable:
+    ...
+@typing.overload
+def registerCallable(fn:None=None,name:typing.Optional[str]=None
+    )->typing.Callable[[typing.Callable],typing.Callable]:
+    ...
+def registerCallable(
+    fn:typing.Optional[typing.Callable]=None,
+    name:typing.Optional[str]=None
+    )->typing.Any:
+    """
+    Register a callable under a name, so that alarms that call it
+    can be saved in an AlarmJournal and loaded again later
+
+    Can also be used as a decorator, with or without a name:
+        @registerCallable
+        def fn(): ...
+        @registerCallable(name='thing')
+        def fn(): ...
+
+    (Callables that are not registered are saved by their
+    module and qualified name, when they have one.)
+    """
+    if fn is None:
+        return lambda fn: registerCallable(fn,name)
+    if name is None:
+        name=fn.__qualname__
+    CALLABLE_REGISTRY[name]=fn
+    _CALLABLE_NAMES[fn]=name
+    return fn
+
+def callableName(fn:typing.Callable)->str:
+    """
+    The name a callable can be saved as (see registerCallable())
+    """
+    try:
+        return _CALLABLE_NAMES[fn]
+    except (KeyError,TypeError):
+        pass
+    module=getattr(fn,'__module__',None)
+    qualname=getattr(fn,'__qualname__','<')
+    if module is None or '<' in qualname:
+        raise Exception(f'Callable {fn} needs to be registered to be saved')
+    return f'{module}:{qualname}'
+
+def lookupCallable(name:str)->typing.Callable:
+    """
+    Get a callable by the name from callableName()
+    """
+    fn=CALLABLE_REGISTRY.get(name)
+    if fn is not None:
+        return fn
+    if ':' not in name:
+        raise Exception(f'Unknown callable "{name}"')
+    module,qualname=name.split(':',1)
+    ret:typing.Any=importlib.import_module(module)
+    for attr in qualname.split('.'):
+        ret=getattr(ret,attr)
+    return ret
+
+
+class Clock:
+    """
+    Where alarms get the time from, and how they wait for it
+
+    This one is the real clock.  The current time is the wall clock,
+    but AlarmSet keeps time with time() which is the monotonic clock
+    mapped to the wall clock once when this is created, so later wall
+    clock changes do not upset it.
+    """
+
+    def __init__(self):
+        # unix time = monotonic time + this
+        self._wallOffset:float=time.time()-time.monotonic_ns()*1e-9
+
+    def now(self)->datetime.datetime:
+        """
+        the current time
+        """
+        return datetime.datetime.now()
+
+    def time(self)->float:
+        """
+        the current unix time, according to the monotonic clock
+        """
+        return time.monotonic_ns()*1e-9+self._wallOffset
+
+    def wait(self,event:threading.Event,timeout:typing.Optional[float])->bool:
+        """
+        wait until the event is set, or the timeout runs out
+
+        returns True if the event was set
+        """
+        return event.wait(timeout)
+
+
+class VirtualClock(Clock):
+    """
+    A pretend clock that only moves when it is waited on, and then
+    jumps straight to the end of the wait.
+
+    Running an AlarmSet on one goes from each alarm straight to the
+    next without sleeping, so schedules can be replayed as fast as
+    the callbacks allow (eg, a year of alarms in seconds), in order.
+    """
+
+    def __init__(self,starting:typing.Optional[datetime.datetime]=None):
+        """
+        :starting: the time to start at (default = now)
+        """
+        Clock.__init__(self)
+        if starting is None:
+            starting=datetime.datetime.now()
+        self._time:float=starting.timestamp()
+
+    def now(self)->datetime.datetime:
+        return datetime.datetime.fromtimestamp(self._time)
+
+    def time(self)->float:
+        return self._time
+
+    def advance(self,seconds:float)->None:
+        """
+        move the clock forward
+        """
+        self._time+=max(seconds,0)
+
+    def wait(self,event:threading.Event,timeout:typing.Optional[float])->bool:
+        if event.is_set():
+            return True
+        if timeout is not None:
+            self.advance(timeout)
+        return False
+
+
+# the real clock, used unless something else is given
+SYSTEM_CLOCK=Clock()
+
 
 class FunctionCall:
     """
@@ -33,10 +397,12 @@ class FunctionCall:
         any args will be appended to the original args,
         any kwargs will be added into the original kwargs
         """
+        if not args and not kwargs:
+            return self._fn(*self._args,**self._kwargs)
         callargs=list(self._args)
         callkwargs=dict(self._kwargs)
         if args:
-            callargs.extend(callargs)
+            callargs.extend(args)
         if kwargs:
             callkwargs.update(kwargs)
         return self._fn(*callargs,**callkwargs)
@@ -65,22 +431,42 @@ class Alarm(FunctionCall):
         time:AlarmTimeoutCompatible,
         fn:typing.Callable,
         args:typing.Optional[typing.Iterable[typing.Any]]=None,
-        kwargs:typing.Optional[typing.Dict[str,typing.Any]]=None):
+        kwargs:typing.Optional[typing.Dict[str,typing.Any]]=None,
+        clock:typing.Optional[Clock]=None):
         """
         :time: if the time is an absolute time, use it as-is. relative time
             if it is a relative time, use the offset from now for the alarm
+        :clock: where to get the time from (default is the clock of the
+            AlarmSet it is added to, or else the real clock)
         """
         FunctionCall.__init__(self,fn,args,kwargs)
+        self._clock:typing.Optional[Clock]=clock
         if isinstance(time,datetime.timedelta):
-            time=datetime.datetime.now()+time
+            time=self.clock.now()+time
         self._time:datetime.datetime=time
 
+    @property
+    def clock(self)->Clock:
+        """
+        where this alarm gets the time from
+        """
+        if self._clock is None:
+            return SYSTEM_CLOCK
+        return self._clock
+
+    def _adoptClock(self,clock:Clock)->None:
+        """
+        use the clock of the AlarmSet it was added to
+        (only called if it has no clock of its own)
+        """
+        self._clock=clock
+
     @property
     def elapsed(self)->bool:
         """
         Determine if the alarm has elapsed
         """
-        return self._time<datetime.datetime.now()
+        return self._time<self.clock.now()
 
     @property
     def nextAlarm(self)->typing.Optional["Alarm"]:
@@ -209,20 +595,39 @@ class PeriodicAlarm(Alarm):
         args:typing.Optional[typing.Iterable[typing.Any]]=None,
         kwargs:typing.Optional[typing.Dict[str,typing.Any]]=None,
         starting:typing.Optional[datetime.datetime]=None,
-        ending:typing.Optional[datetime.datetime]=None):
+        ending:typing.Optional[datetime.datetime]=None,
+        catchUp:CatchUpPolicy='skip',
+        clock:typing.Optional[Clock]=None):
         """
         :time: alarm will occour every this much time
-        :starting: timeout periods will always be based on this (default = now)
+        :starting: timeout periods will always be based on this
+            (default = now by the clock, or the real clock if there
+            is none.  If there is no clock, and the alarm is added to
+            an AlarmSet with a clock of its own before anything has
+            asked it when it next fires, starting is taken from that
+            clock instead.)
         :ending: any alarms past this will not be called and the alarm itself
             will be considered expired
-        """
-        Alarm.__init__(self,typing.cast(datetime.datetime,None),fn,args,kwargs)
-        if starting is None:
-            starting=datetime.datetime.now()
+        :catchUp: what to do about occourances that were missed
+            (see CatchUpPolicy)
+        :clock: where to get the time from (see Alarm)
+        """
+        Alarm.__init__(self,typing.cast(datetime.datetime,None),
+            fn,args,kwargs,clock)
+        if timeout<=datetime.timedelta(0):
+            raise Exception(f'PeriodicAlarm timeout must be positive, not {timeout}') # noqa: E501 # pylint: disable=line-too-long
         self._timeout:datetime.timedelta=timeout
+        # whether starting is to be taken from the clock it ends up with
+        self._startingFromClock:bool=starting is None and clock is None
+        if starting is None:
+            starting=self.clock.now()
         self._starting:datetime.datetime=starting
         self._ending:typing.Optional[datetime.datetime]=ending
+        self.catchUp:CatchUpPolicy=catchUp
         self._current:typing.Optional[Alarm]=None
+        # occourance number of _current (starting+index*timeout)
+        self._index:typing.Optional[int]=None
+        self._missed:int=0
 
     @property
     def starting(self)->datetime.datetime:
@@ -230,6 +635,13 @@ class PeriodicAlarm(Alarm):
         the starting timestamp of the alarm
         """
         return self._starting
+
+    def _adoptClock(self,clock:Clock)->None:
+        Alarm._adoptClock(self,clock)
+        if self._startingFromClock and self._index is None \
+            and clock is not SYSTEM_CLOCK:
+            self._starting=clock.now()
+        self._startingFromClock=False
     @property
     def ending(self)->typing.Optional[datetime.datetime]:
         """
@@ -237,6 +649,14 @@ class PeriodicAlarm(Alarm):
         """
         return self._ending
 
+    @property
+    def missed(self)->int:
+        """
+        how many missed occourances the current one is catching up on
+        (0 if it is not catching up)
+        """
+        return self._missed
+
     @property
     def time(self)->typing.Optional[datetime.datetime]:
         if self.current is None:
@@ -248,23 +668,90 @@ class PeriodicAlarm(Alarm):
         """
         The current next Alarm that will fire
         """
-        if self._current is None:
-            now=datetime.datetime.now()
-            if self._ending is None or now+self._timeout<self._ending:
-                nextTime=self._starting+self._timeout
-                while nextTime<now:
-                    nextTime+=self._timeout
-                self._current=Alarm(nextTime,self._fn,self._args,self._kwargs)
+        if self._current is None and self._index is None:
+            self._nextAfter(self.clock.now())
+        return self._current
+
+    def _indexAt(self,when:datetime.datetime)->int:
+        """
+        The number of the last occourance at or before a given time
+        (can be 0 or negative, if that is at or before starting)
+        """
+        return (when-self.starting)//self._timeout
+
+    def _lastIndex(self)->typing.Optional[int]:
+        """
+        The number of the last occourance before the ending
+        (None if there is no ending)
+        """
+        if self._ending is None:
+            return None
+        index=self._indexAt(self._ending)
+        if self.starting+index*self._timeout>=self._ending:
+            index-=1
+        return index
+
+    def _setIndex(self,index:int,missed:int=0)->typing.Optional[Alarm]:
+        """
+        Make a given occourance the current one
+        (None if that is past the ending)
+        """
+        self._index=index
+        lastIndex=self._lastIndex()
+        if lastIndex is not None and index>lastIndex:
+            self._current=None
+            self._missed=0
+        else:
+            self._current=Alarm(self.starting+index*self._timeout,
+                self._fn,self._args,self._kwargs,self._clock)
+            self._missed=missed
         return self._current
 
+    def _nextAfter(self,when:datetime.datetime)->typing.Optional[Alarm]:
+        """
+        The first Alarm after a given time
+        (None if that is past the ending)
+        """
+        return self._setIndex(max(self._indexAt(when)+1,1))
+
+    def resumeFrom(self,nextTime:datetime.datetime)->None:
+        """
+        Carry on as if the next occourance had been nextTime
+        (eg, after a restart), so any occourances since then
+        are caught up on according to the catchUp policy
+        """
+        # the occourance before the first one at or after nextTime
+        self._setIndex(-((self.starting-nextTime)//self._timeout)-1)
+        self._nextOccourance(self.clock.now())
+
+    def _nextOccourance(self,now:datetime.datetime)->typing.Optional[Alarm]:
+        """
+        Move on from the current occourance to the next one to fire
+        """
+        if self._index is None:
+            return self._nextAfter(now)
+        dueIndex=self._indexAt(now)
+        lastIndex=self._lastIndex()
+        if lastIndex is not None:
+            dueIndex=min(dueIndex,lastIndex)
+        if self.catchUp=='skip' or dueIndex<=self._index:
+            return self._setIndex(max(self._index,dueIndex)+1)
+        return self._setIndex(dueIndex,dueIndex-self._index)
+
     @property
     def nextAlarm(self)->typing.Optional[Alarm]:
         """
         Get the next occourance of this alarm
         (Can be None if it will never expire again)
+
+        This always moves past the current occourance, even if
+        it is being fired a little early.
+
+        Occourances that were missed are dealt with according to
+        the catchUp policy.  This is worked out directly, so it
+        does not matter how many were missed.
         """
-        self._current=None
-        return self.current
+        return self._nextOccourance(self.clock.now())
 
     def __call__(self,*args,**kwargs)->typing.Any:
         """
@@ -274,6 +761,8 @@ class PeriodicAlarm(Alarm):
         any kwargs will be added into the original kwargs
         """
         if self._current:
+            if self.catchUp=='all' and self._missed>1:
+                kwargs['count']=self._missed
             return self._current(*args,**kwargs)
 
     def start(self,stopWhenNoAlarmsActive:bool=False)->"AlarmSet":
@@ -297,6 +786,165 @@ class PeriodicAlarm(Alarm):
         return f"every {self._timeout} between {self.starting}-{end} (next={nextOccourance}) "+FunctionCall.__repr__(self) # noqa: E501 # pylint: disable=line-too-long
 
 
+class Schedule(typing.Protocol):
+    """
+    Anything that can say when it next occours
+    (eg, DateRanges, CompiledDateRanges, or Recurrance)
+    """
+    def next(self,
+        fromTime:typing.Optional[datetime.datetime]=None
+        )->typing.Optional[datetime.datetime]:
+        """
+        the next occourance from a time (None if there are no more)
+        """
+
+
+class ScheduledAlarm(Alarm):
+    """
+    an alarm that fires according to a schedule, such as
+    DateRanges("tue-sat 1:00PM"), firing at the start of each range.
+
+    The next time is only worked out when it is needed, and comes
+    straight from the schedule's next() (which for DateRanges is a
+    lookup in its compiled intervals, not a day-by-day search).
+    """
+
+    def __init__(self,
+        schedule:typing.Union[str,Schedule],
+        fn:typing.Callable,
+        args:typing.Optional[typing.Iterable[typing.Any]]=None,
+        kwargs:typing.Optional[typing.Dict[str,typing.Any]]=None,
+        ending:typing.Optional[datetime.datetime]=None,
+        clock:typing.Optional[Clock]=None):
+        """
+        :schedule: when to fire.  A string is turned into DateRanges.
+            For DateRanges (or CompiledDateRanges) the alarm fires when
+            each range starts.  Anything else (eg Recurrance) fires at
+            every time its next() returns.
+        :ending: any alarms past this will not be called and the alarm itself
+            will be considered expired
+        :clock: where to get the time from (see Alarm)
+        """
+        Alarm.__init__(self,typing.cast(datetime.datetime,None),
+            fn,args,kwargs,clock)
+        if isinstance(schedule,str):
+            from dateTools.dateRanges import DateRanges
+            schedule=DateRanges(schedule)
+        self._schedule:Schedule=schedule
+        # ranges of time, rather than individual times
+        self._ranges:typing.Any=getattr(schedule,'compiled',None)
+        if self._ranges is None and hasattr(schedule,'complement') \
+            and hasattr(schedule,'occurrences'):
+            self._ranges=schedule
+        self._gaps:typing.Any=None
+        self._ending:typing.Optional[datetime.datetime]=ending
+        self._current:typing.Optional[Alarm]=None
+
+    @property
+    def schedule(self)->Schedule:
+        """
+        the schedule this alarm follows
+        """
+        return self._schedule
+    @property
+    def ending(self)->typing.Optional[datetime.datetime]:
+        """
+        the ending timestamp of the alarm
+        """
+        return self._ending
+
+    @property
+    def time(self)->typing.Optional[datetime.datetime]:
+        if self.current is None:
+            return None
+        return self.current.time
+
+    @property
+    def current(self)->typing.Optional[Alarm]:
+        """
+        The current next Alarm that will fire
+        """
+        if self._current is None:
+            self._current=self._nextAfter(self.clock.now())
+        return self._current
+
+    def _nextTime(self,
+        when:datetime.datetime
+        )->typing.Optional[datetime.datetime]:
+        """
+        The first time the schedule fires after a given time
+        """
+        if self._ranges is None:
+            nextTime=self._schedule.next(when)
+            if nextTime is not None and nextTime<=when:
+                nextTime=self._schedule.next(
+                    when+datetime.timedelta.resolution)
+            return nextTime
+        nextTime=self._ranges.next(when)
+        if nextTime is not None and nextTime<=when:
+            # inside a range, so it next fires where the range after it starts
+            if self._gaps is None:
+                self._gaps=self._ranges.complement()
+            gap=self._gaps.next(when)
+            if gap is None:
+                return None # the ranges cover all time
+            nextTime=self._ranges.next(gap)
+        return nextTime
+
+    def _nextAfter(self,when:datetime.datetime)->typing.Optional[Alarm]:
+        """
+        The first Alarm after a given time
+        (None if that is past the ending)
+        """
+        nextTime=self._nextTime(when)
+        if nextTime is None or \
+            (self._ending is not None and nextTime>=self._ending):
+            return None
+        return Alarm(nextTime,self._fn,self._args,self._kwargs,self._clock)
+
+    @property
+    def nextAlarm(self)->typing.Optional[Alarm]:
+        """
+        Get the next occourance of this alarm
+        (Can be None if it will never expire again)
+
+        This always moves past the current occourance, even if
+        it is being fired a little early.
+        """
+        after=self.clock.now()
+        if self._current is not None and self._current.time is not None \
+            and self._current.time>after:
+            after=self._current.time
+        self._current=self._nextAfter(after)
+        return self._current
+
+    def __call__(self,*args,**kwargs)->typing.Any:
+        """
+        Call this just like calling fn() passed in!
+
+        any args will be appended to the original args,
+        any kwargs will be added into the original kwargs
+        """
+        if self._current:
+            return self._current(*args,**kwargs)
+
+    def start(self,stopWhenNoAlarmsActive:bool=False)->"AlarmSet":
+        """
+        Exactly the same as AlarmSet(alarm).start()
+        except it also returns the AlarmSet created.
+        """
+        alarmSet=AlarmSet(self)
+        alarmSet.start(stopWhenNoAlarmsActive)
+        return alarmSet
+
+    def __repr__(self):
+        if self.current is None:
+            nextOccourance="Never"
+        else:
+            nextOccourance=str(self.current.time)
+        return f"{self._schedule} (next={nextOccourance}) "+FunctionCall.__repr__(self) # noqa: E501 # pylint: disable=line-too-long
+
+
 class AlarmSet:
     """
     A set of alarms, which will track which are active,
@@ -304,66 +952,386 @@ class AlarmSet:
 
     This does allow for sending in expired times, whic
     can be useful for scheduling, etc.
+
+    Active alarms are kept in a heap ordered by fire time, so adding
+    and firing are O(log n).  Cancelling only marks the alarm's heap
+    entry, which is then thrown away whenever it reaches the top.
+
+    Callbacks are called on the thread that is running the set, unless
+    an executor is given, in which case they are handed off to it so
+    that a slow callback does not hold up the alarms behind it.
+
+    While the set is running, other threads can add alarms at the same
+    time without any locking: they go onto a queue, which the running
+    thread takes everything from in one go before each wait.
+
+    Time is kept with the monotonic clock, which is mapped to the wall
+    clock once, so later wall clock changes (NTP adjustments, the user
+    changing the time, etc) do not upset it.  A different Clock can be
+    given, such as a VirtualClock to replay a schedule without waiting.
     """
 
     def __init__(self,
-        alarms:typing.Union[None,Alarm,typing.Iterable[Alarm]]=None):
-        """ """
-        self._active:typing.List[Alarm]=[]
+        alarms:typing.Union[None,Alarm,typing.Iterable[Alarm]]=None,
+        executor:typing.Optional[concurrent.futures.Executor]=None,
+        maxInFlight:typing.Optional[int]=None,
+        coalesceWindow:float=0.05,
+        clock:typing.Optional[Clock]=None,
+        maxExpired:typing.Optional[int]=None,
+        maxExpiredAge:typing.Optional[datetime.timedelta]=None):
+        """
+        :executor: a thread or process pool to call alarm callbacks in
+            (with a process pool, alarms must be picklable)
+        :maxInFlight: the most callbacks that may be running in the
+            executor at once.  When there are this many, any more wait
+            in line for one to finish (without holding up the set).
+        :coalesceWindow: when waking up for an alarm, also fire any
+            others due within this many seconds of it, rather than
+            waking up again for each of them
+        :clock: where to get the time from, and how to wait for it.
+            Alarms added without a clock of their own use this one.
+        :maxExpired: only remember this many of the latest expired alarms
+        :maxExpiredAge: forget expired alarms from longer ago than this
+            (by default, all expired alarms are remembered)
+        """
+        if clock is None:
+            clock=SYSTEM_CLOCK
+        self.clock:Clock=clock
+        self.coalesceWindow:float=coalesceWindow
+        self._executor=executor
+        self._inFlightLimit:typing.Optional[threading.BoundedSemaphore]=None
+        if maxInFlight is not None:
+            self._inFlightLimit=threading.BoundedSemaphore(maxInFlight)
+        self._inFlight:typing.Set[concurrent.futures.Future]=set()
+        # (call,alarms) waiting for an in-flight slot
+        self._waiting:typing.Deque[typing.Tuple[
+            typing.Callable[[],typing.Any],
+            typing.List[typing.Tuple[Alarm,float]]]]=collections.deque()
+        self._inFlightLock=threading.Lock()
+        self._callbackTimings:typing.Deque[CallbackTiming]=\
+            collections.deque(maxlen=CALLBACK_TIMINGS_KEPT)
+        self._metrics:typing.Optional[AlarmMetrics]=None
+        # (executor callbacks record metrics from their own threads)
+        self._metricsLock=threading.Lock()
+        self._metricsDump:typing.Optional[
+            typing.Callable[[typing.Dict[str,typing.Any]],typing.Any]]=None
+        self._metricsDumpInterval:float=60.0
+        self._nextMetricsDump:float=float('inf')
+        self._journal:typing.Optional[AlarmJournal]=None
+        # fn -> batchFn (see addBatchHandler())
+        self._batchHandlers:typing.Dict[typing.Callable,typing.Callable]={}
+        self._active:typing.List[AlarmHeapEntry]=[]
+        # id(alarm) -> its heap entry, for cancelling
+        self._entries:typing.Dict[int,AlarmHeapEntry]={}
+        self._counter=itertools.count()
+        # expired alarms and the times they expired, in time-order,
+        # as a ring buffer where everything before _expiredStart is gone
         self._expired:typing.List[Alarm]=[]
+        self._expiredTimes:typing.List[float]=[]
+        self._expiredStart:int=0
+        self.maxExpired:typing.Optional[int]=maxExpired
+        self.maxExpiredAge:typing.Optional[datetime.timedelta]=maxExpiredAge
+        # (times,alarms) of the active alarms in time-order, for
+        # bisecting (None when they have changed since it was made)
+        self._activeSorted:typing.Optional[
+            typing.Tuple[typing.List[float],typing.List[Alarm]]]=None
+        # ('add',time added,alarms) or ('cancel',None,alarm) from other
+        # threads while running
+        self._incoming:queue.SimpleQueue=queue.SimpleQueue()
+        # id(alarm) of alarms in _incoming that are not yet added
+        self._pending:typing.Set[int]=set()
+        # the thread in run(), if any
+        self._runThreadId:typing.Optional[int]=None
+        # guards _runThreadId and _pending, so nothing is queued
+        # after run() has taken its last look at _incoming
+        self._runLock=threading.Lock()
+        self._runStarted=threading.Event()
         self._thread:typing.Optional[threading.Thread]=None
         self._threadInterruptEvent:typing.Optional[threading.Event]=None
         self._keepGoing:bool=True
         self._stopWhenNoAlarmsActive:bool=False
+        # the alarm time the run loop is currently waiting for
+        self._wakeTime:float=float('inf')
         self.add(alarms)
 
+    def _now(self)->float:
+        """
+        the current unix time, according to the clock
+        """
+        return self.clock.time()
+
     @property
     def expired(self)->typing.Iterable[Alarm]:
         """
         expired alarms, in time-order
+        (only those still remembered, see maxExpired and maxExpiredAge)
+        """
+        return self._expired[self._expiredStart:]
+
+    def _addExpired(self,alarm:Alarm,t:float)->None:
+        """
+        remember an alarm that expired at a given time,
+        and forget old ones as needed
         """
-        return self._expired
+        times=self._expiredTimes
+        if not times or t>=times[-1]:
+            self._expired.append(alarm)
+            times.append(t)
+        else:
+            i=bisect.bisect_right(times,t,self._expiredStart)
+            self._expired.insert(i,alarm)
+            times.insert(i,t)
+        start=self._expiredStart
+        if self.maxExpired is not None:
+            start=max(start,len(times)-self.maxExpired)
+        if self.maxExpiredAge is not None:
+            cutoff=self._now()-self.maxExpiredAge.total_seconds()
+            while start<len(times) and times[start]<cutoff:
+                start+=1
+        # (so that no more than 2*maxExpired are ever held)
+        limit=1024 if self.maxExpired is None \
+            else min(max(self.maxExpired,1),1024)
+        if start>=limit and start*2>=len(times):
+            # actually let go of the forgotten ones
+            del self._expired[:start]
+            del times[:start]
+            start=0
+        self._expiredStart=start
 
     @property
     def active(self)->typing.Iterable[Alarm]:
         """
         active alarms, in time-order
         """
-        return self._active
+        return [entry[2] for entry in sorted(self._entries.values())]
+
+    def __len__(self)->int:
+        """
+        how many alarms are active
+        """
+        return len(self._entries)
 
     @property
     def all(self)->typing.Iterable[Alarm]:
         """
-        all alarms, in time-order, whether expired or active
+        all alarms, in time-order, whether expired (and still
+        remembered) or active
         """
-        yield from self._expired
-        yield from self._active
+        yield from self.expired
+        yield from self.active
 
     def __iter__(self)->typing.Iterable[Alarm]:
         return self.all
 
-    def nextAlarm(self,
-        fromTime:typing.Optional[datetime.datetime]=None
-        )->typing.Optional[Alarm]:
+    @property
+    def callbackTimings(self)->typing.Iterable[CallbackTiming]:
         """
-        get the next alarm (optionally, on or after a given time)
+        timings of the most recent callbacks, oldest first
         """
-        if fromTime is not None:
-            raise NotImplementedError()
-        if not self._active:
-            return None
-        return self._active[0]
+        return list(self._callbackTimings)
 
-    def previousAlarm(self,
-        fromTime:typing.Optional[datetime.datetime]=None
-        )->typing.Optional[Alarm]:
+    @property
+    def inFlight(self)->int:
         """
-        get the last/previous alarm (optionally, on or after a given time)
+        how many callbacks are currently running in the executor
         """
-        if fromTime is not None:
-            raise NotImplementedError()
-        if not self._expired:
-            return None
+        return len(self._inFlight)
+
+    def enableMetrics(self,
+        dump:typing.Optional[
+            typing.Callable[[typing.Dict[str,typing.Any]],typing.Any]]=None,
+        dumpInterval:float=60.0
+        )->None:
+        """
+        Start keeping metrics on how late alarms fire, how long
+        callbacks take, how many alarms are waiting, and how many
+        times the set wakes up
+
+        Alarms that fire ahead of time (eg, coalesced with an earlier
+        one) count as on time in the lateness, and are counted in 'early'.
+
+        :dump: if given, this is called with stats() every dumpInterval
+            seconds
+        """
+        if self._metrics is None:
+            self._metrics=AlarmMetrics()
+        self._metricsDump=dump
+        self._metricsDumpInterval=dumpInterval
+        if dump is None:
+            self._nextMetricsDump=float('inf')
+        else:
+            self._nextMetricsDump=self._now()+dumpInterval
+        self._interrupt()
+
+    def disableMetrics(self)->None:
+        """
+        Stop keeping metrics
+        """
+        self._metrics=None
+        self._metricsDump=None
+        self._nextMetricsDump=float('inf')
+
+    def stats(self,clear:bool=False)->typing.Dict[str,typing.Any]:
+        """
+        Get the metrics (see enableMetrics())
+
+        Times are in seconds.
+
+        :clear: start measuring again from scratch afterwards
+        """
+        ret:typing.Dict[str,typing.Any]={
+            'active':len(self),
+            'expired':len(self._expired)-self._expiredStart,
+            'inFlight':self.inFlight}
+        metrics=self._metrics
+        if metrics is not None:
+            with self._metricsLock:
+                ret.update(metrics.asDict())
+                if clear:
+                    metrics.clear()
+        return ret
+
+    def _recordTiming(self,timing:CallbackTiming)->None:
+        """
+        keep track of how a callback went
+        """
+        self._callbackTimings.append(timing)
+        metrics=self._metrics
+        if metrics is None:
+            return
+        lateness=timing.lateness
+        with self._metricsLock:
+            metrics.fired+=1
+            if lateness<0:
+                metrics.early+=1
+                lateness=0.0
+            metrics.lateness.record(lateness)
+            if timing.exception is None:
+                metrics.callbackDuration.record(timing.duration)
+            else:
+                metrics.failed+=1
+
+    def _wokeUp(self)->None:
+        """
+        keep track of the set waking up, and dump metrics when it is time
+        """
+        metrics=self._metrics
+        if metrics is None:
+            return
+        with self._metricsLock:
+            metrics.wakeups+=1
+            metrics.queueDepth.record(len(self))
+        if self._metricsDump is not None:
+            now=self._now()
+            if now>=self._nextMetricsDump:
+                self._nextMetricsDump=now+self._metricsDumpInterval
+                self._metricsDump(self.stats())
+
+    def waitForCallbacks(self,timeout:typing.Optional[float]=None)->bool:
+        """
+        wait for all callbacks running in the executor to finish
+        (including any waiting for an in-flight slot)
+
+        returns False if it timed out
+        """
+        deadline=None if timeout is None else time.monotonic()+timeout
+        while True:
+            with self._inFlightLock:
+                pending=set(self._inFlight)
+            if not pending:
+                return True
+            if deadline is not None:
+                timeout=max(deadline-time.monotonic(),0)
+            _,notDone=concurrent.futures.wait(pending,timeout)
+            if notDone:
+                return False
+
+    def nextAlarm(self,
+        fromTime:typing.Optional[datetime.datetime]=None
+        )->typing.Optional[Alarm]:
+        """
+        get the next alarm (optionally, on or after a given time,
+        which can also find expired alarms that are still remembered)
+        """
+        if fromTime is not None:
+            t=fromTime.timestamp()
+            times=self._expiredTimes
+            i=bisect.bisect_left(times,t,self._expiredStart)
+            if i<len(times):
+                return self._expired[i]
+            activeTimes,alarms=self._activeInOrder()
+            i=bisect.bisect_left(activeTimes,t)
+            if i<len(alarms):
+                return alarms[i]
+            return None
+        entry=self._nextEntry()
+        if entry is None:
+            return None
+        return entry[2]
+
+    def _activeInOrder(self
+        )->typing.Tuple[typing.List[float],typing.List[Alarm]]:
+        """
+        (times,alarms) of the active alarms, in time-order
+        """
+        if self._activeSorted is None:
+            entries=sorted(self._entries.values())
+            self._activeSorted=(
+                [entry[0] for entry in entries],
+                [entry[2] for entry in entries])
+        return self._activeSorted
+
+    def alarmsBetween(self,
+        startTime:datetime.datetime,
+        endTime:datetime.datetime
+        )->typing.List[Alarm]:
+        """
+        all the alarms, whether expired (and still remembered) or
+        active, from startTime up to but not including endTime,
+        in time-order
+        """
+        t0=startTime.timestamp()
+        t1=endTime.timestamp()
+        times=self._expiredTimes
+        start=self._expiredStart
+        ret=self._expired[bisect.bisect_left(times,t0,start):
+            bisect.bisect_left(times,t1,start)]
+        activeTimes,alarms=self._activeInOrder()
+        ret.extend(alarms[bisect.bisect_left(activeTimes,t0):
+            bisect.bisect_left(activeTimes,t1)])
+        return ret
+
+    def _nextEntry(self)->typing.Optional[AlarmHeapEntry]:
+        """
+        the heap entry for the next alarm to fire,
+        discarding any cancelled entries in front of it
+        """
+        active=self._active
+        while active:
+            if active[0][2] is not None:
+                return active[0]
+            heapq.heappop(active)
+        return None
+
+    def previousAlarm(self,
+        fromTime:typing.Optional[datetime.datetime]=None
+        )->typing.Optional[Alarm]:
+        """
+        get the last/previous alarm (optionally, the last one at or before
+        a given time, which can also find active alarms)
+        """
+        if fromTime is not None:
+            t=fromTime.timestamp()
+            activeTimes,alarms=self._activeInOrder()
+            i=bisect.bisect_right(activeTimes,t)
+            if i>0:
+                return alarms[i-1]
+            i=bisect.bisect_right(self._expiredTimes,t,self._expiredStart)
+            if i>self._expiredStart:
+                return self._expired[i-1]
+            return None
+        if len(self._expired)<=self._expiredStart:
+            return None
         return self._expired[-1]
 
     @typing.overload
@@ -400,27 +1368,268 @@ class AlarmSet:
 
         Attempting to add an alarm whose time has already elapsed will
         simply add it to the appropriate time in the expired list.
+        (Except for a PeriodicAlarm that is catching up on missed
+        occourances, which will fire right away.)
+
+        While the set is running, this is safe to call from any number
+        of other threads at once.  The alarms are queued for the running
+        thread to pick up before it next waits (so are not in active
+        until then).
         """
         if timeOrAlarm is None:
             return
         if isinstance(timeOrAlarm,Alarm):
             alarms:typing.Iterable[Alarm]=(timeOrAlarm,)
         elif isinstance(timeOrAlarm,(datetime.datetime,datetime.timedelta)):
-            alarms=(Alarm(
-                timeOrAlarm,typing.cast(typing.Callable,fn),args,kwargs),)
+            alarms=(Alarm(timeOrAlarm,
+                typing.cast(typing.Callable,fn),args,kwargs,self.clock),)
         else:
             alarms=timeOrAlarm
-        for alarm in alarms:
-            if alarm<datetime.datetime.now():
-                bisect.insort(self._expired,alarm)
-            else:
-                newFirstAlarm:bool = not self._active or alarm<self._active[0]
-                bisect.insort(self._active,alarm)
-                if newFirstAlarm:
-                    self._interrupt() # interrupt waiting on the current _current and wait on the one that it changed to instead # noqa: E501 # pylint: disable=line-too-long
+        if self._runThreadId is not None:
+            alarms=list(alarms)
+            if self._journal is not None:
+                for alarm in alarms:
+                    self._journal.alarmRecord(alarm) # can it be journaled?
+            with self._runLock:
+                queued=self._queueing()
+                if queued:
+                    self._incoming.put(('add',self._now(),alarms))
+                    self._pending.update(id(alarm) for alarm in alarms)
+            if queued:
+                if alarms and \
+                    min(float(alarm) for alarm in alarms)<self._wakeTime:
+                    self._interrupt()
+                return
+        self._addAlarms([(self._now(),alarms)])
     append=add
     extend=add
 
+    def _addAlarms(self,
+        batches:typing.Iterable[typing.Tuple[float,typing.Iterable[Alarm]]]
+        )->None:
+        """
+        add (time added,alarms) batches on the thread that owns the set
+
+        (Whether an alarm had already expired goes by when it was added,
+        not when it gets here.)
+        """
+        if self._journal is not None:
+            # make sure they can all be journaled before changing anything
+            batches=[(now,list(alarms)) for now,alarms in batches]
+            records={id(alarm):self._journal.alarmRecord(alarm)
+                for _,alarms in batches for alarm in alarms}
+        newEntries:typing.List[AlarmHeapEntry]=[]
+        for now,alarms in batches:
+            for alarm in alarms:
+                if alarm._clock is None: # pylint: disable=protected-access
+                    alarm._adoptClock(self.clock) # noqa: E501 # pylint: disable=protected-access,line-too-long
+                t=float(alarm)
+                missed=isinstance(alarm,PeriodicAlarm) and alarm.missed
+                if t<now and not missed:
+                    self._addExpired(alarm,t)
+                else:
+                    newEntries.append(self._newEntry(t,alarm))
+        if not newEntries:
+            return
+        self._activeSorted=None
+        self._insertEntries(newEntries)
+        if self._journal is not None:
+            for entry in newEntries:
+                self._journal.recordAdd(entry[2],records[id(entry[2])])
+        if min(entry[0] for entry in newEntries)<self._wakeTime:
+            self._interrupt() # interrupt waiting on the current _current and wait on the one that it changed to instead # noqa: E501 # pylint: disable=line-too-long
+
+    def _queueing(self)->bool:
+        """
+        whether changes from this thread need to be queued for run()
+        (call with _runLock held)
+        """
+        runThreadId=self._runThreadId
+        return runThreadId is not None and runThreadId!=threading.get_ident()
+
+    def _drainIncoming(self)->None:
+        """
+        take everything other threads have queued up, and add it all
+        at once (with any cancels done in the order they were made)
+        """
+        incoming=self._incoming
+        if incoming.empty():
+            return
+        batches:typing.List[typing.Tuple[float,typing.List[Alarm]]]=[]
+        added:typing.List[int]=[]
+        try:
+            while True:
+                op,now,payload=incoming.get_nowait()
+                if op=='add':
+                    batches.append((now,payload))
+                    added.extend(id(alarm) for alarm in payload)
+                else:
+                    if batches:
+                        self._addAlarms(batches)
+                        batches=[]
+                    self._cancel(payload)
+        except queue.Empty:
+            pass
+        if batches:
+            self._addAlarms(batches)
+        with self._runLock:
+            self._pending.difference_update(added)
+
+    def _newEntry(self,t:float,alarm:Alarm)->AlarmHeapEntry:
+        """
+        create the heap entry for an alarm
+        (replacing any entry it already had)
+        """
+        old=self._entries.get(id(alarm))
+        if old is not None:
+            old[2]=None
+            self._discardEntry(old)
+        entry=[t,next(self._counter),alarm]
+        self._entries[id(alarm)]=entry
+        return entry
+
+    def _insertEntries(self,entries:typing.List[AlarmHeapEntry])->None:
+        """
+        put new entries into the heap
+        """
+        if len(entries)>len(self._active):
+            # cheaper to rebuild the heap all at once
+            self._active.extend(entries)
+            heapq.heapify(self._active)
+        else:
+            for entry in entries:
+                heapq.heappush(self._active,entry)
+
+    def _discardEntry(self,entry:AlarmHeapEntry)->None:
+        """
+        called when an entry is cancelled
+
+        (the heap simply leaves it in place to be skipped over later)
+        """
+
+    def _popDue(self,now:float)->typing.List[AlarmHeapEntry]:
+        """
+        remove and return the next entries due at or before now
+        (an empty list if there are none)
+        """
+        entry=self._nextEntry()
+        if entry is None or entry[0]>now:
+            return []
+        return [heapq.heappop(self._active)]
+
+    def cancel(self,alarm:Alarm)->bool:
+        """
+        Cancel an active alarm
+
+        returns False if the alarm was not active
+
+        While the set is running, this is safe to call from other
+        threads.  The cancel is queued behind any adds from that
+        thread, so add() then cancel() always cancels.
+        """
+        if self._runThreadId is not None:
+            with self._runLock:
+                queued=self._queueing()
+                if queued:
+                    known=id(alarm) in self._entries \
+                        or id(alarm) in self._pending
+                    self._incoming.put(('cancel',None,alarm))
+            if queued:
+                self._interrupt()
+                return known
+        return self._cancel(alarm)
+    remove=cancel
+
+    def _cancel(self,alarm:Alarm)->bool:
+        """
+        cancel an alarm on the thread that owns the set
+        """
+        entry=self._entries.pop(id(alarm),None)
+        if entry is None:
+            return False
+        entry[2]=None
+        self._activeSorted=None
+        self._discardEntry(entry)
+        if self._journal is not None:
+            self._journal.recordCancel(alarm)
+        return True
+
+    def attachJournal(self,
+        journal:typing.Union[str,"AlarmJournal"],
+        recover:bool=True,
+        fireMissed:bool=False
+        )->None:
+        """
+        Keep a journal of alarms being added, cancelled, and fired,
+        so that they can be recovered after a restart
+
+        Only Alarms, PeriodicAlarms, and ScheduledAlarms whose schedule
+        has text (eg DateRanges) can be journaled.  Adding anything else
+        raises an exception, without adding any of the alarms.
+
+        :journal: an AlarmJournal or the filename for one
+        :recover: first load any alarms still pending in the journal
+            (in one go, rather than adding them one at a time)
+        :fireMissed: recovered one-off alarms whose time passed while
+            nothing was running fire right away, rather than going
+            straight to expired.  (PeriodicAlarms catch up according
+            to their catchUp policy either way.)
+
+        The journal is then compacted down to the active alarms.
+        """
+        if isinstance(journal,str):
+            journal=AlarmJournal(journal)
+        active=list(self.active)
+        for alarm in active:
+            journal.alarmRecord(alarm) # can it be journaled?
+        self._journal=None
+        if recover:
+            recovered=journal.recover()
+            if fireMissed:
+                now=self._now()
+                missed:typing.List[Alarm]=[]
+                later:typing.List[Alarm]=[]
+                for alarm in recovered:
+                    if type(alarm) is Alarm and float(alarm)<now: # noqa: E501 # pylint: disable=unidiomatic-typecheck,line-too-long
+                        missed.append(alarm)
+                    else:
+                        later.append(alarm)
+                # added as if before they were due, so they are not expired
+                self._addAlarms([(float('-inf'),missed)])
+                recovered=later
+            self.add(recovered)
+        self._journal=journal
+        journal.compact(self.active)
+
+    @property
+    def journal(self)->typing.Optional["AlarmJournal"]:
+        """
+        the journal attached with attachJournal() (if any)
+        """
+        return self._journal
+
+    def addBatchHandler(self,
+        fn:typing.Callable,
+        batchFn:typing.Callable[
+            [typing.List[typing.Tuple[typing.Any,...]]],typing.Any]
+        )->None:
+        """
+        When several alarms that call fn are due together, call
+        batchFn once with a list of their args tuples instead
+        (eg, to do one bulk write rather than many single ones)
+
+        Alarms with kwargs, and PeriodicAlarms with catchUp='all'
+        that are catching up, are still called one at a time.
+        (Only applies to AlarmSet's own run loop, not AsyncAlarmSet.)
+        """
+        self._batchHandlers[fn]=batchFn
+
+    def removeBatchHandler(self,fn:typing.Callable)->None:
+        """
+        Go back to calling fn once per alarm
+        """
+        self._batchHandlers.pop(fn,None)
+
     def __repr__(self)->str:
         ret=[str(alarm) for alarm in self.__iter__()]
         ret.insert(0,"alarms:")
@@ -432,8 +1641,12 @@ class AlarmSet:
         """
         self._stopWhenNoAlarmsActive=stopWhenNoAlarmsActive
         if self._thread is None:
+            self._runStarted.clear()
             self._thread=threading.Thread(
                 target=self.run,args=[stopWhenNoAlarmsActive])
+            self._thread.start()
+            # so that adds from here on are queued for it
+            self._runStarted.wait()
     def _interrupt(self):
         """
         cause the thread to interrupt any waits
@@ -464,58 +1677,1238 @@ class AlarmSet:
             self._threadInterruptEvent=threading.Event()
         else:
             self._threadInterruptEvent.clear()
-        while self._keepGoing:
-            if not self._active:
-                if self._stopWhenNoAlarmsActive:
-                    #print("all alarms finished")
-                    break
-                self._threadInterruptEvent.wait(1)
-                continue
-            if self._active[0].time:
-                t:float=(self._active[0].time-datetime.datetime.now()).total_seconds() # noqa: E501 # pylint: disable=line-too-long
-            else:
-                t=0.05
-            #print('sleeping for',t)
-            if t<0:
-                raise Exception(f"Unexpected sleep time {t}")
-            if self._threadInterruptEvent.wait(t):
-                self._threadInterruptEvent.clear()
-            else:
-                self._fireCurrentAlarms()
-        self._thread=None
+        with self._runLock:
+            self._runThreadId=threading.get_ident()
+        self._runStarted.set()
+        try:
+            while self._keepGoing:
+                self._drainIncoming()
+                entry=self._nextEntry()
+                if entry is None:
+                    if self._stopWhenNoAlarmsActive:
+                        #print("all alarms finished")
+                        break
+                    self._wakeTime=float('inf')
+                    # wait for alarms, or until it is time to dump metrics
+                    t=max(self._nextMetricsDump-self._now(),0)
+                    if self.clock.wait(self._threadInterruptEvent,
+                        None if t==float('inf') else t):
+                        self._threadInterruptEvent.clear()
+                    self._wokeUp()
+                    continue
+                self._wakeTime=entry[0]
+                if entry[2].time:
+                    t:float=entry[0]-self._now()
+                else:
+                    t=0.05
+                #print('sleeping for',t)
+                if t<=0:
+                    # already due (eg, a callback ran long)
+                    self._wokeUp()
+                    self._fireCurrentAlarms()
+                    continue
+                # also wake up in time to dump metrics
+                t=min(t,max(self._nextMetricsDump-self._now(),0))
+                interrupted=self.clock.wait(self._threadInterruptEvent,t)
+                self._wokeUp()
+                if interrupted:
+                    self._threadInterruptEvent.clear()
+                else:
+                    self._fireCurrentAlarms()
+        finally:
+            # (even if a callback raised)
+            self._wakeTime=float('inf')
+            with self._runLock:
+                # nothing more can be queued after this
+                self._runThreadId=None
+            self._drainIncoming()
+            self._thread=None
         #print('ended',self._keepGoing)
 
-    def _fireCurrentAlarms(self,lookahead:float=0.05):
+    def _fireCurrentAlarms(self,lookahead:typing.Optional[float]=None):
         """
         For each active alarm that has expired, we
             Will call it as a function then move it
             to expired as necessary.
         :lookahead: if the alarm will expiew in this many seconds, just
-            call it expired now
+            call it expired now (default is the coalesceWindow)
         """
-        for alarm in self._active:
+        if lookahead is None:
+            lookahead=self.coalesceWindow
+        while True:
+            # pick up anything other threads added that is due too
+            self._drainIncoming()
             # reset now in every loop in case the alarm's fn takes some time
-            now=datetime.datetime.now().timestamp()+lookahead
-            if alarm>now:
+            now=self._now()+lookahead
+            due=self._popDue(now)
+            if not due:
                 break
-            alarm() # call it!
-            del self._active[0]
-            if hasattr(alarm,'nextAlarm'):
-                nextOccourance=alarm.nextAlarm
-                if nextOccourance:
-                    # we already removed and so now re-add periodic
-                    # alarm to keep it in sorted order
-                    self._active.append(alarm)
+            if self._batchHandlers:
+                # take everything that is due, so that alarms sharing
+                # a callable can be delivered together
+                more=self._popDue(now)
+                while more:
+                    due.extend(more)
+                    more=self._popDue(now)
+                self._fireBatched(due)
+                continue
+            for entry in due:
+                alarm=entry[2]
+                if alarm is None:
+                    # cancelled by an earlier callback
+                    continue
+                del self._entries[id(alarm)]
+                try:
+                    self._dispatch(alarm,entry[0]) # call it!
+                except BaseException:
+                    self._putBack(due)
+                    raise
+                finally:
+                    # even if it raised, it still needs rescheduling
+                    self._fired(entry,alarm)
+
+    def _putBack(self,due:typing.List[AlarmHeapEntry])->None:
+        """
+        return popped entries that were never fired to the set
+        (eg, when a callback before them raised)
+        """
+        unfired=[entry for entry in due
+            if self._entries.get(id(entry[2])) is entry]
+        if unfired:
+            self._insertEntries(unfired)
+
+    def _fireBatched(self,due:typing.List[AlarmHeapEntry])->None:
+        """
+        fire due entries, delivering those whose callable has a
+        batch handler in one call per callable
+        """
+        # each item is an entry, or a (batchFn,entries) group
+        items:typing.List[typing.Any]=[]
+        # alarm's callable -> its group
+        groups:typing.Dict[typing.Callable,typing.Tuple[typing.Any,...]]={}
+        for entry in due:
+            alarm=entry[2]
+            if alarm is None:
+                continue
+            batchFn=None
+            fn=alarm._fn # pylint: disable=protected-access
+            # alarms with kwargs (including the count passed when catching
+            # up with catchUp='all') are called one at a time
+            batchable=not alarm._kwargs # pylint: disable=protected-access
+            if isinstance(alarm,PeriodicAlarm) and alarm.catchUp=='all':
+                batchable=batchable and alarm.missed<=1
+            if batchable:
+                try:
+                    batchFn=self._batchHandlers.get(fn)
+                except TypeError:
+                    pass # not hashable
+            if batchFn is None:
+                items.append(entry)
+                continue
+            group=groups.get(fn)
+            if group is None:
+                group=(batchFn,[])
+                groups[fn]=group
+                items.append(group)
+            group[1].append(entry)
+        for item in items:
+            if isinstance(item,tuple):
+                entries=item[1]
+            else:
+                entries=[item]
+            entries=[entry for entry in entries if entry[2] is not None]
+            if not entries:
+                # cancelled by an earlier callback
+                continue
+            for entry in entries:
+                del self._entries[id(entry[2])]
+            try:
+                if len(entries)==1:
+                    self._dispatch(entries[0][2],entries[0][0])
                 else:
-                    # periodic alarm is done
-                    self._expired.append(alarm)
+                    argsList=[tuple(entry[2]._args) # noqa: E501 # pylint: disable=protected-access,line-too-long
+                        for entry in entries]
+                    self._dispatchCall(FunctionCall(item[0],(argsList,)),
+                        [(entry[2],entry[0]) for entry in entries])
+            except BaseException:
+                self._putBack(due)
+                raise
+            finally:
+                for entry in entries:
+                    self._fired(entry,entry[2])
+
+    def _fired(self,entry:AlarmHeapEntry,alarm:Alarm)->None:
+        """
+        after an alarm is fired, either re-add it for its next
+        time, or move it to expired
+        """
+        self._activeSorted=None
+        if self._entries.get(id(alarm)) is not None:
+            # the callback re-added it itself
+            return
+        done=alarm.nextAlarm is None or float(alarm)<=entry[0]
+        if done:
+            self._addExpired(alarm,entry[0])
+        else:
+            # re-add periodic alarm in its new place
+            self._insertEntries([self._newEntry(float(alarm),alarm)])
+        if self._journal is not None:
+            self._journal.recordFire(alarm,entry[0],done)
+
+    def _dispatch(self,alarm:Alarm,scheduled:float)->None:
+        """
+        call an alarm, either right here or in the executor,
+        and keep track of how long it takes
+        """
+        self._dispatchCall(alarm,[(alarm,scheduled)])
+
+    def _dispatchCall(self,
+        call:typing.Callable[[],typing.Any],
+        alarms:typing.List[typing.Tuple[Alarm,float]]
+        )->None:
+        """
+        make a call for one or more (alarm,scheduled time), either
+        right here or in the executor, and keep track of how long it takes
+
+        (When there are several, each is timed as an equal share.)
+        """
+        if self._executor is None:
+            dispatched=self._now()
+            start=time.perf_counter()
+            exception:typing.Optional[BaseException]=None
+            try:
+                call()
+            except BaseException as e:
+                exception=e
+                raise
+            finally:
+                duration=(time.perf_counter()-start)/len(alarms)
+                for alarm,scheduled in alarms:
+                    self._recordTiming(CallbackTiming(
+                        alarm,scheduled,dispatched,duration,exception))
+            return
+        if self._inFlightLimit is not None:
+            with self._inFlightLock:
+                if not self._inFlightLimit.acquire(blocking=False): # noqa: E501 # pylint: disable=consider-using-with,line-too-long
+                    # no free slot, so it waits its turn rather than
+                    # holding up the alarms behind it
+                    self._waiting.append((call,alarms))
+                    return
+        self._submit(call,alarms)
+
+    def _submit(self,
+        call:typing.Callable[[],typing.Any],
+        alarms:typing.List[typing.Tuple[Alarm,float]]
+        )->None:
+        """
+        hand a call to the executor (once it has an in-flight slot)
+        """
+        executor=typing.cast(concurrent.futures.Executor,self._executor)
+        dispatched=self._now()
+        future=executor.submit(_timedCall,call)
+        with self._inFlightLock:
+            self._inFlight.add(future)
+        def done(future:concurrent.futures.Future)->None:
+            nextCall=None
+            with self._inFlightLock:
+                if self._waiting:
+                    # hand this slot straight on to the next waiting call
+                    nextCall=self._waiting.popleft()
+                else:
+                    self._inFlight.discard(future)
+                    if self._inFlightLimit is not None:
+                        self._inFlightLimit.release()
+            if nextCall is not None:
+                self._submit(*nextCall)
+                with self._inFlightLock:
+                    self._inFlight.discard(future)
+            exception=future.exception()
+            if exception:
+                duration=float('nan')
             else:
-                self._expired.append(alarm)
+                duration=future.result()[1]/len(alarms)
+            for alarm,scheduled in alarms:
+                self._recordTiming(CallbackTiming(
+                    alarm,scheduled,dispatched,duration,exception))
+        future.add_done_callback(done)
+
+
+class TimingWheelAlarmSet(AlarmSet):
+    """
+    An AlarmSet that keeps its active alarms in hierarchical timing wheels
+    rather than a heap, so adding, cancelling, and each tick are all O(1).
+
+    This is for when there are huge numbers of alarms, most of which
+    are cancelled before they ever fire (eg, connection timeouts).
+
+    Time is cut into ticks of tickResolution seconds.  The first wheel
+    has a slot for each of the next slotsPerWheel ticks, and each
+    following wheel has slots that are slotsPerWheel times as long as
+    the one before it.  As time reaches the start of a coarse slot,
+    its alarms are moved down into finer wheels.  Anything further out
+    than the last wheel can hold waits in an overflow slot, which is
+    looked at again each time the last wheel moves on by a slot.
+
+    Alarms due within the same tick fire in time order, but are
+    only as precise as the tick resolution.
+    """
+
+    def __init__(self,
+        alarms:typing.Union[None,Alarm,typing.Iterable[Alarm]]=None,
+        tickResolution:float=0.01,
+        slotsPerWheel:int=256,
+        wheels:int=4,
+        executor:typing.Optional[concurrent.futures.Executor]=None,
+        maxInFlight:typing.Optional[int]=None,
+        coalesceWindow:float=0.05,
+        clock:typing.Optional[Clock]=None,
+        maxExpired:typing.Optional[int]=None,
+        maxExpiredAge:typing.Optional[datetime.timedelta]=None):
+        """
+        :tickResolution: how many seconds each tick covers
+        :slotsPerWheel: how many slots each wheel has
+        :wheels: how many wheels (the last one covers
+            tickResolution*slotsPerWheel**wheels seconds)
+
+        The rest are the same as for AlarmSet.
+        """
+        self._resolution=tickResolution
+        self._slots=slotsPerWheel
+        # how many ticks each slot of each wheel covers
+        self._slotTicks=[slotsPerWheel**level for level in range(wheels)]
+        # wheel -> slot -> {sequence:entry}
+        self._wheels:typing.List[typing.List[
+            typing.Dict[int,AlarmHeapEntry]]]=[
+                [{} for _ in range(slotsPerWheel)] for _ in range(wheels)]
+        self._overflow:typing.Dict[int,AlarmHeapEntry]={}
+        # how many entries are in each wheel (plus overflow on the end)
+        self._counts:typing.List[int]=[0]*(wheels+1)
+        # entries that are already due
+        self._due:typing.List[AlarmHeapEntry]=[]
+        AlarmSet.__init__(self,None,executor,maxInFlight,coalesceWindow,
+            clock,maxExpired,maxExpiredAge)
+        self._tick=self._tickOf(self._now())
+        self.add(alarms)
+
+    def _tickOf(self,t:float)->int:
+        """
+        which tick a timestamp falls within
+        """
+        return int(t//self._resolution)
+
+    def _place(self,entry:AlarmHeapEntry,arriving:bool=False)->None:
+        """
+        put an entry into the finest wheel that can hold it
+
+        Entries are [time,sequence,alarm,wheel,slot], where wheel is
+        -1 for the due list
+
+        :arriving: the current tick has not been fired yet
+        """
+        tick=self._tickOf(entry[0])
+        if tick<self._tick or (tick==self._tick and not arriving):
+            entry[3:]=(-1,None)
+            self._due.append(entry)
+            return
+        slots=self._slots
+        for level,slotTicks in enumerate(self._slotTicks):
+            if tick<(self._tick//slotTicks+slots)*slotTicks:
+                slot=self._wheels[level][(tick//slotTicks)%slots]
+                break
+        else:
+            level=len(self._slotTicks)
+            slot=self._overflow
+        entry[3:]=(level,slot)
+        slot[entry[1]]=entry
+        self._counts[level]+=1
+
+    def _insertEntries(self,entries:typing.List[AlarmHeapEntry])->None:
+        for entry in entries:
+            self._place(entry)
+
+    def _discardEntry(self,entry:AlarmHeapEntry)->None:
+        if len(entry)>3 and entry[3]>=0:
+            del entry[4][entry[1]]
+            self._counts[entry[3]]-=1
+            entry[4]=None
+
+    def _cascade(self,slot:typing.Dict[int,AlarmHeapEntry],level:int)->None:
+        """
+        move all entries in a coarse slot down into finer wheels
+        """
+        entries=list(slot.values())
+        slot.clear()
+        self._counts[level]-=len(entries)
+        for entry in entries:
+            self._place(entry,True)
+
+    def _popDue(self,now:float)->typing.List[AlarmHeapEntry]:
+        """
+        remove and return the entries of the next tick at or before now
+        (an empty list if there are none)
+        """
+        if self._due:
+            due=sorted(entry for entry in self._due if entry[2] is not None)
+            self._due=[]
+            if due:
+                return due
+        target=self._tickOf(now)
+        counts=self._counts
+        slots=self._slots
+        slotTicks=self._slotTicks
+        while self._tick<target:
+            # skip straight to the next place something could happen
+            for level,count in enumerate(counts):
+                if count:
+                    break
+            else:
+                self._tick=target
+                break
+            if level==0:
+                tick=self._tick+1
+            else:
+                # (overflow is checked each time the last wheel moves on)
+                step=slotTicks[min(level,len(slotTicks)-1)]
+                tick=(self._tick//step+1)*step
+            self._tick=tick=min(tick,target)
+            if counts[-1] and tick%slotTicks[-1]==0:
+                self._cascade(self._overflow,len(slotTicks))
+            for level in range(len(slotTicks)-1,0,-1):
+                if tick%slotTicks[level]==0 and counts[level]:
+                    self._cascade(self._wheels[level][
+                        (tick//slotTicks[level])%slots],level)
+            slot=self._wheels[0][tick%slots]
+            if slot:
+                due=sorted(slot.values())
+                slot.clear()
+                counts[0]-=len(due)
+                return due
+        return []
+
+    def _nextEntry(self)->typing.Optional[AlarmHeapEntry]:
+        """
+        the entry for the next alarm to fire
+
+        This looks at the first occupied slot of each wheel, so it
+        is not as cheap as with a heap, but it does not depend on how
+        many alarms there are.
+        """
+        candidates=[entry for entry in self._due if entry[2] is not None]
+        if not candidates:
+            self._due=[]
+        slots=self._slots
+        for level,slotTicks in enumerate(self._slotTicks):
+            if not self._counts[level]:
+                continue
+            wheel=self._wheels[level]
+            first=self._tick//slotTicks
+            for i in range(slots):
+                slot=wheel[(first+i)%slots]
+                if slot:
+                    candidates.append(min(slot.values()))
+                    break
+        if self._overflow:
+            candidates.append(min(self._overflow.values()))
+        if not candidates:
+            return None
+        return min(candidates)
+
+
+class AsyncAlarmSet(AlarmSet):
+    """
+    An AlarmSet that runs on an asyncio event loop rather than in
+    its own thread.
+
+    Each active alarm is scheduled with loop.call_at() on the loop's
+    monotonic clock, so thousands of alarms can share the loop without
+    any extra threads.  Adding and cancelling are still O(log n).
+
+    Callbacks may be coroutine functions, in which case each call is
+    run as a task on the loop.  Other callbacks are called on the loop,
+    or in the executor if one is given.
+    """
+
+    def __init__(self,
+        alarms:typing.Union[None,Alarm,typing.Iterable[Alarm]]=None,
+        loop:typing.Optional[asyncio.AbstractEventLoop]=None,
+        executor:typing.Optional[concurrent.futures.Executor]=None,
+        maxInFlight:typing.Optional[int]=None,
+        coalesceWindow:float=0.05,
+        clock:typing.Optional[Clock]=None,
+        maxExpired:typing.Optional[int]=None,
+        maxExpiredAge:typing.Optional[datetime.timedelta]=None):
+        """
+        :loop: the loop to run on (default is the running loop
+            when alarms are added or start() is called)
+
+        The rest are the same as for AlarmSet, except that the waiting
+        is always done by the loop, so a clock only decides what the
+        time is now.
+        """
+        self._loop:typing.Optional[asyncio.AbstractEventLoop]=loop
+        # entry sequence -> its scheduled call
+        self._handles:typing.Dict[int,asyncio.TimerHandle]={}
+        self._tasks:typing.Set[asyncio.Task]=set()
+        self._done:typing.Optional[asyncio.Future]=None
+        AlarmSet.__init__(self,alarms,executor,maxInFlight,coalesceWindow,
+            clock,maxExpired,maxExpiredAge)
+
+    def _getLoop(self)->typing.Optional[asyncio.AbstractEventLoop]:
+        """
+        the loop to schedule on (None if there is not one yet)
+        """
+        if self._loop is None:
+            try:
+                self._loop=asyncio.get_running_loop()
+            except RuntimeError:
+                return None
+        return self._loop
+
+    def _schedule(self,entries:typing.Iterable[AlarmHeapEntry])->None:
+        """
+        schedule entries to be fired by the loop
+        """
+        loop=self._getLoop()
+        if loop is None:
+            # will happen when start() is called
+            return
+        # wall clock -> loop clock
+        offset=loop.time()-self._now()
+        for entry in entries:
+            if entry[2] is not None and entry[1] not in self._handles:
+                self._handles[entry[1]]=loop.call_at(
+                    entry[0]+offset,self._fire,entry)
+
+    def _insertEntries(self,entries:typing.List[AlarmHeapEntry])->None:
+        AlarmSet._insertEntries(self,entries)
+        self._schedule(entries)
+
+    def _discardEntry(self,entry:AlarmHeapEntry)->None:
+        handle=self._handles.pop(entry[1],None)
+        if handle is not None:
+            handle.cancel()
+
+    def cancel(self,alarm:Alarm)->bool:
+        ret=AlarmSet.cancel(self,alarm)
+        self._checkDone()
+        return ret
+    remove=cancel
+
+    def _fire(self,entry:AlarmHeapEntry)->None:
+        """
+        called by the loop when an entry is due
+        """
+        self._wokeUp()
+        self._fireEntry(entry)
+        # also fire anything else due within the coalesce window
+        horizon=self._now()+self.coalesceWindow
+        while True:
+            entry=self._nextEntry()
+            if entry is None or entry[0]>horizon:
+                break
+            handle=self._handles.get(entry[1])
+            if handle is not None:
+                handle.cancel()
+            self._fireEntry(entry)
+
+    def _fireEntry(self,entry:AlarmHeapEntry)->None:
+        """
+        fire one entry
+        """
+        self._handles.pop(entry[1],None)
+        alarm=entry[2]
+        if alarm is None:
+            return
+        del self._entries[id(alarm)]
+        entry[2]=None
+        self._nextEntry() # throw away fired entries from the heap
+        fn=alarm._fn # pylint: disable=protected-access
+        if self._executor is not None and not asyncio.iscoroutinefunction(fn):
+            try:
+                self._dispatch(alarm,entry[0])
+            finally:
+                self._fired(entry,alarm)
+                self._checkDone()
+            return
+        dispatched=self._now()
+        start=time.perf_counter()
+        try:
+            try:
+                result=alarm() # call it!
+            except BaseException as e:
+                self._recordTiming(CallbackTiming(alarm,entry[0],
+                    dispatched,time.perf_counter()-start,e))
+                raise
+            if asyncio.iscoroutine(result):
+                task=typing.cast(asyncio.AbstractEventLoop,
+                    self._loop).create_task(result)
+                self._tasks.add(task)
+                def done(task:asyncio.Task)->None:
+                    exception=None if task.cancelled() else task.exception()
+                    self._recordTiming(CallbackTiming(alarm,entry[0],
+                        dispatched,time.perf_counter()-start,exception))
+                    self._taskDone(task)
+                task.add_done_callback(done)
+            else:
+                self._recordTiming(CallbackTiming(
+                    alarm,entry[0],dispatched,time.perf_counter()-start))
+        finally:
+            # even if the callback raised, a periodic alarm
+            # still needs its next occourance scheduled
+            self._fired(entry,alarm)
+            self._checkDone()
+
+    def _taskDone(self,task:asyncio.Task)->None:
+        """
+        called when a coroutine callback finishes
+        """
+        self._tasks.discard(task)
+        self._checkDone()
+
+    def _checkDone(self)->None:
+        """
+        finish run() if there is nothing left to do
+        """
+        if self._done is not None and not self._done.done() \
+            and self._stopWhenNoAlarmsActive \
+            and not self._entries and not self._tasks:
+            self._done.set_result(None)
+
+    def start(self,stopWhenNoAlarmsActive:bool=False)->None:
+        """
+        start firing alarms on the running loop
+        """
+        self._stopWhenNoAlarmsActive=stopWhenNoAlarmsActive
+        self._schedule(list(self._entries.values()))
+
+    def end(self)->None:
+        """
+        stop firing alarms (they remain active and will be
+        fired again after the next start())
+        """
+        for handle in self._handles.values():
+            handle.cancel()
+        self._handles.clear()
+        if self._done is not None and not self._done.done():
+            self._done.set_result(None)
+
+    async def run(self, # type: ignore # noqa: E501 # pylint: disable=invalid-overridden-method,line-too-long
+        stopWhenNoAlarmsActive:bool=True)->None:
+        """
+        Fire alarms until end() is called, or, if
+        stopWhenNoAlarmsActive, until there are no more alarms
+        and all coroutine callbacks have finished
+        (as have any callbacks in the executor)
+        """
+        loop=typing.cast(asyncio.AbstractEventLoop,self._getLoop())
+        self._done=loop.create_future()
+        self.start(stopWhenNoAlarmsActive)
+        self._checkDone()
+        await self._done
+        self._done=None
+        if self._executor is not None:
+            await loop.run_in_executor(None,self.waitForCallbacks)
+
+
+class AlarmJournal:
+    """
+    An append-only journal of alarms being added, cancelled, and fired,
+    so that pending alarms can be recovered after a restart.
+
+    Each line is one json event.  Alarm callables are saved by name
+    (see registerCallable()) and their args and kwargs must be
+    json-compatible.
+
+    Use AlarmSet.attachJournal() to use one.
+    """
+
+    def __init__(self,filename:str,sync:bool=False):
+        """
+        :sync: fsync after every event, rather than leaving it to the os
+        """
+        self.filename=filename
+        self.sync=sync
+        # id(alarm) -> its id in the journal
+        self._ids:typing.Dict[int,int]={}
+        self._nextId:int=0
+        self._file:typing.Optional[typing.TextIO]=None
+
+    @staticmethod
+    def alarmRecord(alarm:Alarm)->typing.Dict[str,typing.Any]:
+        """
+        what to save for an alarm
+        """
+        record:typing.Dict[str,typing.Any]={
+            'fn':callableName(alarm._fn), # pylint: disable=protected-access
+            'args':list(alarm._args), # pylint: disable=protected-access
+            'kwargs':alarm._kwargs} # pylint: disable=protected-access
+        if type(alarm) is PeriodicAlarm: # noqa: E501 # pylint: disable=unidiomatic-typecheck,line-too-long
+            record['type']='periodic'
+            record['timeout']=alarm._timeout.total_seconds() # noqa: E501 # pylint: disable=protected-access,line-too-long
+            record['starting']=alarm.starting.timestamp()
+            if alarm.ending is not None:
+                record['ending']=alarm.ending.timestamp()
+            if alarm.catchUp!='skip':
+                record['catchUp']=alarm.catchUp
+            if alarm.time is not None:
+                record['next']=float(alarm)
+        elif type(alarm) is ScheduledAlarm: # noqa: E501 # pylint: disable=unidiomatic-typecheck,line-too-long
+            # a schedule can only be saved as its text (eg DateRanges)
+            text=getattr(alarm.schedule,'text',None)
+            if not isinstance(text,str):
+                raise Exception(f'Cannot journal a ScheduledAlarm following a {type(alarm.schedule).__name__}') # noqa: E501 # pylint: disable=line-too-long
+            record['type']='scheduled'
+            record['schedule']=text
+            if alarm.ending is not None:
+                record['ending']=alarm.ending.timestamp()
+        elif type(alarm) is Alarm: # pylint: disable=unidiomatic-typecheck
+            record['type']='alarm'
+            record['time']=float(alarm)
+        else:
+            raise Exception(f'Cannot journal a {type(alarm).__name__}')
+        return record
+
+    @staticmethod
+    def alarmFromRecord(record:typing.Dict[str,typing.Any])->Alarm:
+        """
+        re-create an alarm from alarmRecord()
+        """
+        fn=lookupCallable(record['fn'])
+        if record['type']=='periodic':
+            ending=record.get('ending')
+            if ending is not None:
+                ending=datetime.datetime.fromtimestamp(ending)
+            periodic=PeriodicAlarm(
+                datetime.timedelta(seconds=record['timeout']),
+                fn,record['args'],record['kwargs'],
+                datetime.datetime.fromtimestamp(record['starting']),
+                ending,record.get('catchUp','skip'))
+            nextTime=record.get('next')
+            if nextTime is not None:
+                # carry on from where it was, so that an occourance
+                # that already fired early does not fire again, and
+                # ones missed while nothing was running are caught up on
+                periodic.resumeFrom(datetime.datetime.fromtimestamp(nextTime))
+            return periodic
+        if record['type']=='scheduled':
+            # (occourances missed while nothing was running are skipped)
+            ending=record.get('ending')
+            if ending is not None:
+                ending=datetime.datetime.fromtimestamp(ending)
+            return ScheduledAlarm(record['schedule'],
+                fn,record['args'],record['kwargs'],ending)
+        return Alarm(datetime.datetime.fromtimestamp(record['time']),
+            fn,record['args'],record['kwargs'])
+
+    def _write(self,event:typing.Dict[str,typing.Any])->None:
+        """
+        append an event to the journal
+        """
+        if self._file is None:
+            self._file=open(self.filename,'a',encoding='utf-8') # noqa: E501 # pylint: disable=consider-using-with,line-too-long
+        self._file.write(json.dumps(event,separators=(',',':'))+'\n')
+        self._file.flush()
+        if self.sync:
+            os.fsync(self._file.fileno())
+
+    def recordAdd(self,
+        alarm:Alarm,
+        record:typing.Optional[typing.Dict[str,typing.Any]]=None
+        )->None:
+        """
+        record an alarm being added
+        (or replaced, if it was already added)
+
+        :record: its alarmRecord(), if that has already been made
+        """
+        event=self.alarmRecord(alarm) if record is None else record
+        alarmId=self._ids.get(id(alarm))
+        if alarmId is None:
+            alarmId=self._nextId
+            self._nextId+=1
+            self._ids[id(alarm)]=alarmId
+        event['op']='add'
+        event['id']=alarmId
+        self._write(event)
+
+    def recordCancel(self,alarm:Alarm)->None:
+        """
+        record an alarm being cancelled
+        """
+        alarmId=self._ids.pop(id(alarm),None)
+        if alarmId is not None:
+            self._write({'op':'cancel','id':alarmId})
+
+    def recordFire(self,alarm:Alarm,scheduled:float,done:bool)->None:
+        """
+        record an alarm firing
+
+        :done: the alarm will not fire again
+        """
+        if done:
+            alarmId=self._ids.pop(id(alarm),None)
+        else:
+            alarmId=self._ids.get(id(alarm))
+        if alarmId is not None:
+            event={'op':'fire','id':alarmId,'time':scheduled,'done':done}
+            if not done:
+                event['next']=float(alarm)
+            self._write(event)
+
+    def recover(self)->typing.List[Alarm]:
+        """
+        Load all the alarms still pending in the journal
+        """
+        pending:typing.Dict[int,typing.Dict[str,typing.Any]]={}
+        if os.path.exists(self.filename):
+            with open(self.filename,'r',encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        event=json.loads(line)
+                    except ValueError:
+                        # a partly-written last line
+                        continue
+                    op=event['op']
+                    if op=='add':
+                        pending[event['id']]=event
+                    elif op=='fire' and not event['done']:
+                        if event['id'] in pending:
+                            pending[event['id']]['next']=event['next']
+                    elif op=='cancel' or (op=='fire' and event['done']):
+                        pending.pop(event['id'],None)
+        alarms=[]
+        for alarmId,record in pending.items():
+            alarm=self.alarmFromRecord(record)
+            self._ids[id(alarm)]=alarmId
+            alarms.append(alarm)
+        self._nextId=max(pending,default=-1)+1
+        return alarms
+
+    def compact(self,alarms:typing.Iterable[Alarm])->None:
+        """
+        Rewrite the journal so that it only adds the given alarms
+        (normally the ones that are active)
+        """
+        self.close()
+        self._ids={}
+        self._nextId=0
+        tempname=self.filename+'.tmp'
+        self._file=open(tempname,'w',encoding='utf-8') # noqa: E501 # pylint: disable=consider-using-with,line-too-long
+        try:
+            for alarm in alarms:
+                self.recordAdd(alarm)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        finally:
+            self.close()
+        os.replace(tempname,self.filename)
+
+    def close(self)->None:
+        """
+        close the journal file (it is re-opened as needed)
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file=None
+
+
+class _ShardAlarmSet(AlarmSet):
+    """
+    The AlarmSet inside each ShardedAlarmSet worker, which keeps
+    track of the alarms it is finished with
+    """
+
+    def __init__(self,coalesceWindow:float=0.05):
+        AlarmSet.__init__(self,coalesceWindow=coalesceWindow)
+        # id(alarm) -> the id the ShardedAlarmSet gave it
+        self.ids:typing.Dict[int,int]={}
+        self.done:typing.List[int]=[]
+        # repr() of the most recent exceptions raised by callbacks
+        self.errors:typing.Deque[str]=collections.deque(
+            maxlen=SHARD_ERRORS_KEPT)
+
+    def _dispatchCall(self,
+        call:typing.Callable[[],typing.Any],
+        alarms:typing.List[typing.Tuple[Alarm,float]]
+        )->None:
+        """
+        make a call right here, keeping any exception it raises
+        rather than letting it take down the worker
+        """
+        dispatched=self._now()
+        start=time.perf_counter()
+        exception:typing.Optional[BaseException]=None
+        try:
+            call()
+        except Exception as e: # pylint: disable=broad-except
+            exception=e
+            self.errors.append(repr(e))
+        duration=(time.perf_counter()-start)/len(alarms)
+        for alarm,scheduled in alarms:
+            self._recordTiming(CallbackTiming(
+                alarm,scheduled,dispatched,duration,exception))
+
+    def _fired(self,entry:AlarmHeapEntry,alarm:Alarm)->None:
+        AlarmSet._fired(self,entry,alarm)
+        if id(alarm) not in self._entries:
+            alarmId=self.ids.pop(id(alarm),None)
+            if alarmId is not None:
+                self.done.append(alarmId)
+
+
+def _shardWorker(
+    conn:multiprocessing.connection.Connection,
+    coalesceWindow:float
+    )->None:
+    """
+    The loop run by each ShardedAlarmSet worker process
+
+    Waits on the pipe until the next alarm is due, handling any
+    requests that come in, then fires whatever is due.
+    """
+    aset=_ShardAlarmSet(coalesceWindow)
+    # the ShardedAlarmSet's id -> alarm
+    alarms:typing.Dict[int,Alarm]={}
+    while True:
+        entry=aset._nextEntry() # pylint: disable=protected-access
+        if entry is None:
+            timeout=None
+        else:
+            timeout=max(entry[0]-aset._now(),0) # noqa: E501 # pylint: disable=protected-access,line-too-long
+        if conn.poll(timeout):
+            op,payload=conn.recv()
+            if op=='add':
+                for alarmId,alarm in payload:
+                    alarms[alarmId]=alarm
+                    aset.ids[id(alarm)]=alarmId
+                aset.add([alarm for _,alarm in payload])
+                for alarmId,alarm in payload:
+                    if id(alarm) not in aset._entries: # noqa: E501 # pylint: disable=protected-access,line-too-long
+                        # it was already past
+                        del aset.ids[id(alarm)]
+                        aset.done.append(alarmId)
+            elif op=='cancel':
+                for alarmId in payload:
+                    alarm=alarms.pop(alarmId,None)
+                    if alarm is not None:
+                        aset.ids.pop(id(alarm),None)
+                        aset.cancel(alarm)
+            elif op=='stats':
+                ret=aset.stats()
+                ret['metrics']=aset._metrics # pylint: disable=protected-access
+                ret['errors']=list(aset.errors)
+                if payload:
+                    aset.errors.clear()
+                if payload and aset._metrics is not None: # noqa: E501 # pylint: disable=protected-access,line-too-long
+                    aset._metrics=AlarmMetrics() # noqa: E501 # pylint: disable=protected-access,line-too-long
+                conn.send(('reply',ret))
+            elif op=='enableMetrics':
+                aset.enableMetrics()
+            elif op=='disableMetrics':
+                aset.disableMetrics()
+            elif op=='stop':
+                break
+        aset._wokeUp() # pylint: disable=protected-access
+        aset._fireCurrentAlarms() # pylint: disable=protected-access
+        if aset.done:
+            for alarmId in aset.done:
+                alarms.pop(alarmId,None)
+            conn.send(('done',aset.done))
+            aset.done=[]
+    conn.close()
+
+
+# what a ShardedAlarmSet reader hands back once its worker is gone
+_WORKER_STOPPED=object()
+
+
+class ShardedAlarmSet:
+    """
+    Alarms spread across several worker processes, each running
+    its own AlarmSet, so that callbacks are not all held up by
+    one GIL.
+
+    Alarms go to a worker by the hash of their key (by default they
+    are simply dealt out in turn).  Adds and cancels are sent to the
+    workers in one message per worker, over pipes.
+
+    Alarms are pickled to go to their worker, so the callable and
+    its args must be picklable, and it is called inside the worker
+    (so anything it changes is changed in that process, not this one).
+    """
+
+    def __init__(self,
+        shards:typing.Optional[int]=None,
+        key:typing.Optional[typing.Callable[[Alarm],typing.Hashable]]=None,
+        coalesceWindow:float=0.05):
+        """
+        :shards: how many worker processes (default is one per cpu)
+        :key: get the key to shard an alarm by.  Alarms with the same
+            key always go to the same worker, and so fire in order
+            with each other.
+        :coalesceWindow: passed on to each worker's AlarmSet
+        """
+        if shards is None:
+            shards=os.cpu_count() or 1
+        self.key=key
+        self._nextId:int=0
+        # id(alarm) -> (alarm,shard,its id)
+        self._where:typing.Dict[int,typing.Tuple[Alarm,int,int]]={}
+        # its id -> id(alarm)
+        self._ids:typing.Dict[int,int]={}
+        self._whereLock=threading.Lock()
+        self._conns:typing.List[multiprocessing.connection.Connection]=[]
+        self._processes:typing.List[multiprocessing.Process]=[]
+        self._readers:typing.List[threading.Thread]=[]
+        self._replies:typing.List[queue.SimpleQueue]=[]
+        self._requestLock=threading.Lock()
+        for shard in range(shards):
+            conn,workerConn=multiprocessing.Pipe()
+            process=multiprocessing.Process(
+                target=_shardWorker,args=(workerConn,coalesceWindow),
+                daemon=True)
+            process.start()
+            workerConn.close()
+            replies:queue.SimpleQueue=queue.SimpleQueue()
+            reader=threading.Thread(
+                target=self._read,args=(conn,replies),daemon=True)
+            reader.start()
+            self._conns.append(conn)
+            self._processes.append(process)
+            self._replies.append(replies)
+            self._readers.append(reader)
+
+    @property
+    def shards(self)->int:
+        """
+        how many worker processes there are
+        """
+        return len(self._conns)
+
+    def _read(self,
+        conn:multiprocessing.connection.Connection,
+        replies:queue.SimpleQueue
+        )->None:
+        """
+        read everything a worker sends back (runs in its own thread
+        so a worker can never block on a full pipe)
+        """
+        while True:
+            try:
+                op,payload=conn.recv()
+            except (EOFError,OSError):
+                # the worker is gone, so don't leave a request waiting
+                replies.put(_WORKER_STOPPED)
+                break
+            if op=='done':
+                with self._whereLock:
+                    for alarmId in payload:
+                        k=self._ids.pop(alarmId,None)
+                        where=self._where.get(k) # type: ignore
+                        if where is not None and where[2]==alarmId:
+                            del self._where[k] # type: ignore
+            else:
+                replies.put(payload)
+
+    def _shardOf(self,alarm:Alarm,alarmId:int)->int:
+        """
+        which worker an alarm goes to
+        """
+        if self.key is None:
+            return alarmId%len(self._conns)
+        return hash(self.key(alarm))%len(self._conns)
+
+    def _send(self,shard:int,op:str,payload:typing.Any=None)->None:
+        """
+        send a message to a worker, raising an exception if it has stopped
+        """
+        try:
+            self._conns[shard].send((op,payload))
+        except OSError as e:
+            raise Exception(self._stoppedMessage(shard)) from e
+
+    def _stoppedMessage(self,shard:int)->str:
+        """
+        what to say about a worker that has stopped
+        """
+        exitcode=self._processes[shard].exitcode
+        return f'ShardedAlarmSet worker {shard} has stopped (exit code {exitcode})' # noqa: E501 # pylint: disable=line-too-long
+
+    def _request(self,op:str,payload:typing.Any=None)->typing.List[typing.Any]:
+        """
+        send a request to every worker and return their replies
+
+        Raises an exception if any worker has stopped, rather than
+        waiting forever for its reply.
+        """
+        with self._requestLock:
+            for shard in range(len(self._conns)):
+                self._send(shard,op,payload)
+            ret=[]
+            for shard,replies in enumerate(self._replies):
+                reply=replies.get()
+                if reply is _WORKER_STOPPED:
+                    replies.put(reply) # so later requests see it too
+                    raise Exception(self._stoppedMessage(shard))
+                ret.append(reply)
+            return ret
+
+    @typing.overload
+    def add(self,
+        timeOrAlarm:AlarmTimeoutCompatible,
+        fn:typing.Callable,
+        args:typing.Optional[typing.Iterable[typing.Any]]=None,
+        kwargs:typing.Optional[typing.Dict[str,typing.Any]]=None)->None:
+        ...
+    @typing.overload
+    def add(self,
+        timeOrAlarm:typing.Union[None,Alarm,typing.Iterable[Alarm]],
+        fn:None=None,
+        args:None=None,
+        kwargs:None=None)->None:
+        ...
+    def add(self,
+        timeOrAlarm:typing.Union[
+            None,Alarm,typing.Iterable[Alarm],AlarmTimeoutCompatible],
+        fn:typing.Optional[typing.Callable]=None,
+        args:typing.Optional[typing.Iterable[typing.Any]]=None,
+        kwargs:typing.Optional[typing.Dict[str,typing.Any]]=None)->None:
+        """
+        Add one or more alarms (the same as AlarmSet.add())
+
+        All the alarms for each worker are sent to it together.
+        """
+        if timeOrAlarm is None:
+            return
+        if isinstance(timeOrAlarm,Alarm):
+            alarms:typing.Iterable[Alarm]=(timeOrAlarm,)
+        elif isinstance(timeOrAlarm,(datetime.datetime,datetime.timedelta)):
+            alarms=(Alarm(
+                timeOrAlarm,typing.cast(typing.Callable,fn),args,kwargs),)
+        else:
+            alarms=timeOrAlarm
+        batches:typing.List[typing.List[typing.Tuple[int,Alarm]]]=\
+            [[] for _ in self._conns]
+        with self._whereLock:
+            for alarm in alarms:
+                alarmId=self._nextId
+                self._nextId+=1
+                shard=self._shardOf(alarm,alarmId)
+                self._where[id(alarm)]=(alarm,shard,alarmId)
+                self._ids[alarmId]=id(alarm)
+                batches[shard].append((alarmId,alarm))
+        for shard,batch in enumerate(batches):
+            if not batch:
+                continue
+            try:
+                self._send(shard,'add',batch)
+            except Exception:
+                with self._whereLock:
+                    for alarmId,alarm in batch:
+                        self._ids.pop(alarmId,None)
+                        self._where.pop(id(alarm),None)
+                raise
+    append=add
+
+    def cancel(self,alarm:Alarm)->bool:
+        """
+        cancel an alarm
+
+        returns False if it was not active
+        (as far as is known here, it may be just about to fire)
+        """
+        return self.cancelMany((alarm,))>0
+    remove=cancel
+
+    def cancelMany(self,alarms:typing.Iterable[Alarm])->int:
+        """
+        cancel a whole batch of alarms, with one message per worker
+
+        returns how many of them were active
+        """
+        batches:typing.List[typing.List[int]]=[[] for _ in self._conns]
+        count=0
+        with self._whereLock:
+            for alarm in alarms:
+                where=self._where.get(id(alarm))
+                if where is None or where[0] is not alarm:
+                    continue
+                del self._where[id(alarm)]
+                del self._ids[where[2]]
+                batches[where[1]].append(where[2])
+                count+=1
+        for shard,batch in enumerate(batches):
+            if batch:
+                self._send(shard,'cancel',batch)
+        return count
+
+    def __len__(self)->int:
+        """
+        how many alarms are active (as far as is known here)
+        """
+        return len(self._where)
+
+    def enableMetrics(self)->None:
+        """
+        Start keeping metrics in every worker (see AlarmSet.enableMetrics())
+        """
+        for shard in range(len(self._conns)):
+            self._send(shard,'enableMetrics')
+
+    def disableMetrics(self)->None:
+        """
+        Stop keeping metrics
+        """
+        for shard in range(len(self._conns)):
+            self._send(shard,'disableMetrics')
+
+    def stats(self,clear:bool=False)->typing.Dict[str,typing.Any]:
+        """
+        The stats of all the workers added together
+        (see AlarmSet.stats()), plus 'errors', the repr() of recent
+        exceptions raised by callbacks
+
+        :clear: start measuring again from scratch afterwards
+        """
+        ret:typing.Dict[str,typing.Any]={
+            'shards':self.shards,'active':0,'expired':0,'inFlight':0,
+            'errors':[]}
+        metrics:typing.Optional[AlarmMetrics]=None
+        for shardStats in self._request('stats',clear):
+            for k in ('active','expired','inFlight','errors'):
+                ret[k]+=shardStats[k]
+            if shardStats['metrics'] is not None:
+                if metrics is None:
+                    metrics=AlarmMetrics()
+                metrics.merge(shardStats['metrics'])
+        if metrics is not None:
+            ret.update(metrics.asDict())
+        return ret
+
+    def end(self)->None:
+        """
+        stop all the workers
+        """
+        for conn in self._conns:
+            try:
+                conn.send(('stop',None))
+            except OSError:
+                pass # already stopped
+        for process in self._processes:
+            process.join()
+        for conn in self._conns:
+            conn.close()
+        for reader in self._readers:
+            reader.join()
 
 
 Timer=Alarm
 PeriodicTimer=PeriodicAlarm
+ScheduledTimer=ScheduledAlarm
 TimerSet=AlarmSet
+TimingWheelTimerSet=TimingWheelAlarmSet
+AsyncTimerSet=AsyncAlarmSet
+ShardedTimerSet=ShardedAlarmSet
 
 
 def test_expired():
@@ -552,6 +2945,726 @@ def test_ordering():
         datetime.timedelta(seconds=4),print,("Alarm 4 fired.",)))
     print(aset)
 
+def test_heapOrdering():
+    """
+    Test that alarms, including periodic ones, fire in time order
+    and that cancelled alarms do not fire
+    """
+    aset=AlarmSet()
+    fired=[]
+    now=datetime.datetime.now()
+    for seconds in (7,2,5,3,9,1):
+        aset.add(now+datetime.timedelta(seconds=seconds),
+            fired.append,(f'once at {seconds}',))
+    cancelled=Alarm(now+datetime.timedelta(seconds=4),
+        fired.append,('cancelled',))
+    aset.add(cancelled)
+    aset.add(PeriodicAlarm(
+        datetime.timedelta(seconds=2),fired.append,('periodic',),
+        starting=now+datetime.timedelta(seconds=0.5),
+        ending=now+datetime.timedelta(seconds=8)))
+    assert aset.cancel(cancelled)
+    assert not aset.cancel(cancelled)
+    # fire everything due in the next minute, as if it were already due
+    aset._fireCurrentAlarms(lookahead=60) # pylint: disable=protected-access
+    # periodic fires at 2.5, 4.5, and 6.5
+    expected=['once at 1','once at 2','periodic','once at 3','periodic',
+        'once at 5','periodic','once at 7','once at 9']
+    assert fired==expected,fired
+    assert not aset.active
+    print('heap ordering ok')
+
+def test_timingWheel():
+    """
+    Test that a TimingWheelAlarmSet fires the same alarms in the same
+    order as an AlarmSet, even when alarms have to cascade down from
+    coarse wheels and the overflow
+    """
+    import random
+    now=datetime.datetime.now()+datetime.timedelta(seconds=1)
+    times=[now+datetime.timedelta(seconds=random.random()*20)
+        for _ in range(1000)]
+    results=[]
+    for aset in (AlarmSet(),
+        TimingWheelAlarmSet(tickResolution=0.01,slotsPerWheel=4,wheels=2)):
+        fired:typing.List[int]=[]
+        alarms=[Alarm(t,fired.append,(i,)) for i,t in enumerate(times)]
+        aset.add(alarms)
+        for alarm in alarms[::3]:
+            aset.cancel(alarm)
+        assert aset.nextAlarm() is min(
+            (a for i,a in enumerate(alarms) if i%3),key=float)
+        # fire everything due in the next minute, as if it were already due
+        aset._fireCurrentAlarms(lookahead=60) # noqa: E501 # pylint: disable=protected-access,line-too-long
+        results.append(fired)
+    assert results[0]==results[1]
+    assert len(results[0])==len(times)-len(times[::3])
+    print('timing wheel ok')
+
+def benchmark(
+    count:int=1000000,
+    alarmSetClass:typing.Type[AlarmSet]=AlarmSet
+    )->typing.Dict[str,float]:
+    """
+    Schedule and fire a large number of alarms
+
+    :alarmSetClass: AlarmSet or TimingWheelAlarmSet
+
+    returns alarms per second for each step
+    """
+    import random
+    import time
+    fired:typing.List[float]=[]
+    base=datetime.datetime.now()+datetime.timedelta(minutes=1)
+    times=[base+datetime.timedelta(seconds=random.random()*10)
+        for _ in range(count)]
+    alarms=[Alarm(t,fired.append,(t.timestamp(),)) for t in times]
+    ret:typing.Dict[str,float]={}
+    aset=alarmSetClass()
+    start=time.perf_counter()
+    for alarm in alarms:
+        aset.add(alarm)
+    ret['add one at a time']=count/(time.perf_counter()-start)
+    start=time.perf_counter()
+    for alarm in alarms[::10]:
+        aset.cancel(alarm)
+    ret['cancel']=len(alarms[::10])/(time.perf_counter()-start)
+    start=time.perf_counter()
+    # fire everything due in the next hour, as if it were already due
+    aset._fireCurrentAlarms(lookahead=3600) # pylint: disable=protected-access
+    ret['fire']=len(fired)/(time.perf_counter()-start)
+    if any(a>b for a,b in zip(fired,fired[1:])):
+        raise Exception('Alarms fired out of order')
+    aset=alarmSetClass()
+    start=time.perf_counter()
+    aset.add(alarms)
+    ret['add all at once']=count/(time.perf_counter()-start)
+    return ret
+
+def benchmarkProducers(
+    threadCounts:typing.Iterable[int]=(8,16,32),
+    alarmsPerThread:int=20000
+    )->typing.Dict[int,float]:
+    """
+    Have many threads add alarms one at a time to a running AlarmSet
+
+    returns alarms per second, from the first add until the running
+    thread has taken them all in, for each number of threads
+    """
+    ret:typing.Dict[int,float]={}
+    base=datetime.datetime.now()+datetime.timedelta(hours=1)
+    for threadCount in threadCounts:
+        aset=AlarmSet()
+        aset.start()
+        barrier=threading.Barrier(threadCount+1)
+        def produce(n:int)->None:
+            alarms=[Alarm(
+                base+datetime.timedelta(seconds=(i*threadCount+n)/1000),
+                print) for i in range(alarmsPerThread)]
+            barrier.wait()
+            for alarm in alarms:
+                aset.add(alarm)
+        threads=[threading.Thread(target=produce,args=(n,))
+            for n in range(threadCount)]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        start=time.perf_counter()
+        total=threadCount*alarmsPerThread
+        while len(aset)<total:
+            time.sleep(0.001)
+        ret[threadCount]=total/(time.perf_counter()-start)
+        for thread in threads:
+            thread.join()
+        aset.end()
+    return ret
+
+def test_async():
+    """
+    Test that an AsyncAlarmSet fires plain and coroutine callbacks
+    in order on the event loop
+    """
+    fired:typing.List[str]=[]
+    async def asyncAppend(s:str)->None:
+        await asyncio.sleep(0)
+        fired.append(s)
+    async def main()->None:
+        now=datetime.datetime.now()
+        aset=AsyncAlarmSet()
+        aset.add(now+datetime.timedelta(seconds=0.3),fired.append,('b',))
+        aset.add(now+datetime.timedelta(seconds=0.1),asyncAppend,('a',))
+        cancelled=Alarm(now+datetime.timedelta(seconds=0.2),
+            fired.append,('cancelled',))
+        aset.add(cancelled)
+        aset.add(PeriodicAlarm(datetime.timedelta(seconds=0.2),
+            asyncAppend,('p',),starting=now,
+            ending=now+datetime.timedelta(seconds=0.7)))
+        aset.cancel(cancelled)
+        await aset.run()
+    asyncio.run(main())
+    assert fired==['a','p','b','p','p'],fired
+    # a raising callback still gets its next occourance scheduled
+    calls:typing.List[int]=[]
+    def fail()->None:
+        calls.append(1)
+        raise ValueError('oops')
+    async def failing()->None:
+        now=datetime.datetime.now()
+        aset=AsyncAlarmSet()
+        aset.enableMetrics()
+        aset.add(PeriodicAlarm(datetime.timedelta(seconds=0.1),fail,
+            starting=now,ending=now+datetime.timedelta(seconds=0.35)))
+        asyncio.get_running_loop().set_exception_handler(
+            lambda loop,context:None)
+        await aset.run()
+        assert aset.stats()['failed']==len(calls)
+    asyncio.run(failing())
+    assert len(calls)==3,calls
+    # plain callbacks can go to an executor, and close ones coalesce
+    threads:typing.List[int]=[]
+    def where()->None:
+        threads.append(threading.get_ident())
+    async def executing()->None:
+        now=datetime.datetime.now()
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            aset=AsyncAlarmSet(executor=executor,coalesceWindow=0.1,
+                maxExpired=2)
+            for seconds in (0.1,0.15,0.19):
+                aset.add(now+datetime.timedelta(seconds=seconds),where)
+            await aset.run()
+            assert len(threads)==3 and threading.get_ident() not in threads
+            dispatched=[t.dispatched for t in aset.callbackTimings]
+            assert dispatched[-1]-dispatched[0]<0.02,dispatched
+            assert len(list(aset.expired))==2
+    asyncio.run(executing())
+    print('async ok')
+
+def test_executor():
+    """
+    Test that with an executor, a slow callback does not hold up
+    the alarms behind it, and maxInFlight is respected
+    """
+    running:typing.List[int]=[]
+    mostRunning:typing.List[int]=[0]
+    lock=threading.Lock()
+    def slow()->None:
+        with lock:
+            running.append(1)
+            mostRunning[0]=max(mostRunning[0],len(running))
+        time.sleep(0.3)
+        with lock:
+            running.pop()
+    fired:typing.List[str]=[]
+    now=datetime.datetime.now()
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        aset=AlarmSet(executor=executor,maxInFlight=2)
+        aset.add(now+datetime.timedelta(seconds=0.1),slow)
+        aset.add(now+datetime.timedelta(seconds=0.15),fired.append,('a',))
+        aset.add(now+datetime.timedelta(seconds=0.2),slow)
+        aset.add(now+datetime.timedelta(seconds=0.25),fired.append,('b',))
+        aset.add(now+datetime.timedelta(seconds=0.3),slow)
+        aset.run()
+        # waiting for a free slot did not hold up the set itself
+        assert datetime.datetime.now()<now+datetime.timedelta(seconds=0.45)
+        assert aset.waitForCallbacks(5)
+    assert fired==['a','b'],fired
+    assert mostRunning[0]==2,mostRunning
+    timings=aset.callbackTimings
+    assert len(timings)==5
+    # 'b' and the third slow one had to wait for a free slot
+    late=[t.alarm for t in timings if t.lateness>=0.1]
+    assert len(late)==2 and tuple(late[0]._args)==('b',) \
+        and late[1]._fn==slow,late
+    assert max(t.duration for t in timings)>=0.3
+    # an exception from a callback called right here is recorded too
+    aset=AlarmSet()
+    aset.add(datetime.timedelta(seconds=1),int,('x',))
+    try:
+        aset._fireCurrentAlarms(lookahead=2) # pylint: disable=protected-access
+    except ValueError:
+        pass
+    assert isinstance(list(aset.callbackTimings)[-1].exception,ValueError)
+    # and a periodic alarm that raises is still rescheduled
+    periodic=PeriodicAlarm(datetime.timedelta(seconds=0.5),int,('x',),
+        starting=datetime.datetime.now())
+    aset=AlarmSet()
+    aset.add(periodic)
+    try:
+        aset._fireCurrentAlarms(lookahead=1) # pylint: disable=protected-access
+    except ValueError:
+        pass
+    else:
+        assert False,'the ValueError should have been raised'
+    assert isinstance(list(aset.callbackTimings)[-1].exception,ValueError)
+    assert list(aset.active)==[periodic]
+    # as are alarms due alongside it that it kept from being called
+    fired:typing.List[str]=[]
+    wheel=TimingWheelAlarmSet()
+    due=datetime.datetime.now()+datetime.timedelta(seconds=0.01)
+    wheel.add(due,int,('x',))
+    wheel.add(due,fired.append,('after',))
+    try:
+        wheel._fireCurrentAlarms(lookahead=1) # noqa: E501 # pylint: disable=protected-access,line-too-long
+    except ValueError:
+        pass
+    wheel._fireCurrentAlarms(lookahead=1) # pylint: disable=protected-access
+    assert fired==['after'],fired
+    print('executor ok')
+
+def test_coalescing():
+    """
+    Test that alarms within the coalesce window fire in one wakeup,
+    and that a callback running past the next alarm is not a problem
+    """
+    now=datetime.datetime.now()
+    aset=AlarmSet(coalesceWindow=0.1)
+    for seconds in (0.1,0.15,0.19):
+        aset.add(now+datetime.timedelta(seconds=seconds),int)
+    aset.run()
+    dispatched=[t.dispatched for t in aset.callbackTimings]
+    assert dispatched[-1]-dispatched[0]<0.02,dispatched
+    aset=AlarmSet(coalesceWindow=0)
+    aset.add(now+datetime.timedelta(seconds=0.3),time.sleep,(0.2,))
+    aset.add(now+datetime.timedelta(seconds=0.35),int)
+    aset.run()
+    assert len(aset.expired)==2
+    print('coalescing ok')
+
+def test_metrics():
+    """
+    Test that metrics are recorded and dumped
+    """
+    dumps:typing.List[typing.Dict[str,typing.Any]]=[]
+    now=datetime.datetime.now()
+    aset=AlarmSet(coalesceWindow=0)
+    aset.enableMetrics(dumps.append,dumpInterval=0.1)
+    for i in range(10):
+        aset.add(now+datetime.timedelta(seconds=0.05*i+0.05),
+            time.sleep,(0.001,))
+    aset.run()
+    stats=aset.stats()
+    assert stats['fired']==10,stats
+    assert stats['wakeups']>=10,stats
+    assert stats['callbackDuration']['min']>=0.001,stats
+    assert stats['lateness']['p99']<0.05,stats
+    assert stats['queueDepth']['max']==10,stats
+    assert 3<=len(dumps)<=6,len(dumps)
+    # alarms coalesced into firing early are counted, not made negative
+    now=datetime.datetime.now()
+    aset=AlarmSet(coalesceWindow=0.1)
+    aset.enableMetrics()
+    for seconds in (0.1,0.15,0.19):
+        aset.add(now+datetime.timedelta(seconds=seconds),int)
+    aset.run()
+    stats=aset.stats()
+    assert stats['early']==2 and stats['lateness']['min']>=0,stats
+    # metrics are still dumped on time while there is nothing to do
+    dumps.clear()
+    aset=AlarmSet()
+    aset.enableMetrics(dumps.append,dumpInterval=0.1)
+    aset.start(False)
+    time.sleep(0.35)
+    aset.end()
+    assert 2<=len(dumps)<=4,len(dumps)
+    # callbacks finishing in the executor's threads all get counted
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        aset=AlarmSet(executor=executor)
+        aset.enableMetrics()
+        when=datetime.datetime.now()+datetime.timedelta(seconds=0.1)
+        aset.add([Alarm(when,int) for _ in range(2000)])
+        aset.run()
+        aset.waitForCallbacks()
+    stats=aset.stats()
+    assert stats['fired']==2000 and stats['lateness']['count']==2000,stats
+    hist=Histogram((1,2,5))
+    for value in (0.5,1.5,1.5,3,9):
+        hist.record(value)
+    assert hist.counts==[1,2,1,1]
+    assert hist.percentile(.5)==2 and hist.percentile(1)==9
+    print('metrics ok')
+
+def test_journal():
+    """
+    Test that alarms are recovered from a journal
+    """
+    import tempfile
+    import shutil
+    @registerCallable(name='test_journal.record')
+    def record(*args,**kwargs)->None:
+        fired.append((args,kwargs))
+    fired:typing.List[typing.Any]=[]
+    now=datetime.datetime.now()
+    with tempfile.TemporaryDirectory() as tempdir:
+        filename=os.path.join(tempdir,'alarms.journal')
+        aset=AlarmSet()
+        aset.attachJournal(filename)
+        aset.add(now+datetime.timedelta(seconds=0.1),record,(1,))
+        cancelled=Alarm(now+datetime.timedelta(seconds=10),record,(2,))
+        aset.add(cancelled)
+        aset.add(now+datetime.timedelta(seconds=30),record,(3,),{'x':'y'})
+        aset.add(PeriodicAlarm(datetime.timedelta(seconds=0.1),
+            record,('p',),starting=now,
+            ending=now+datetime.timedelta(minutes=1)))
+        aset.add(now+datetime.timedelta(seconds=40),print,('hi',))
+        aset.cancel(cancelled)
+        aset._fireCurrentAlarms(lookahead=0.15) # noqa: E501 # pylint: disable=protected-access,line-too-long
+        assert fired==[((1,),{}),(('p',),{})],fired
+        journal=typing.cast(AlarmJournal,aset.journal)
+        journal.close()
+        # "restart"
+        recovered=AlarmSet()
+        recovered.attachJournal(filename)
+        assert [alarm._args for alarm in recovered.active]==[ # noqa: E501 # pylint: disable=protected-access,line-too-long
+            ['p'],[3],['hi']]
+        assert recovered.nextAlarm().time==aset.nextAlarm().time
+        with open(filename,'r',encoding='utf-8') as f:
+            assert len(f.readlines())==3
+        # an alarm that cannot be journaled is refused before anything
+        # is changed (and does not break compaction later)
+        class EveryMinute:
+            """
+            a schedule with no text to save
+            """
+            def next(self,
+                fromTime:typing.Optional[datetime.datetime]=None
+                )->typing.Optional[datetime.datetime]:
+                """
+                a minute after fromTime
+                """
+                fromTime=typing.cast(datetime.datetime,fromTime)
+                return fromTime+datetime.timedelta(minutes=1)
+        try:
+            recovered.add([Alarm(now,record,(4,)),
+                ScheduledAlarm(EveryMinute(),record)])
+        except Exception: # pylint: disable=broad-except
+            pass
+        else:
+            assert False,'should not be able to journal that'
+        assert len(recovered)==3 and not list(recovered.expired)
+        typing.cast(AlarmJournal,recovered.journal).close()
+        recovered.attachJournal(filename,recover=False)
+        # one-off alarms missed while nothing was running
+        recovered.add(now+datetime.timedelta(seconds=0.05),record,(5,))
+        typing.cast(AlarmJournal,recovered.journal).close()
+        shutil.copy(filename,filename+'.copy')
+        time.sleep(0.1)
+        skipped=AlarmSet()
+        skipped.attachJournal(filename)
+        assert [alarm._args for alarm in skipped.expired]==[[5]] # noqa: E501 # pylint: disable=protected-access,line-too-long
+        typing.cast(AlarmJournal,skipped.journal).close()
+        fired.clear()
+        caughtUp=AlarmSet()
+        caughtUp.attachJournal(filename+'.copy',fireMissed=True)
+        assert not list(caughtUp.expired)
+        caughtUp._fireCurrentAlarms(lookahead=0) # noqa: E501 # pylint: disable=protected-access,line-too-long
+        assert ((5,),{}) in fired,fired
+        typing.cast(AlarmJournal,caughtUp.journal).close()
+    print('journal ok')
+
+def test_catchUp():
+    """
+    Test that PeriodicAlarm works out its next time directly,
+    and catches up on missed occourances according to its policy
+    """
+    now=datetime.datetime.now()
+    second=datetime.timedelta(seconds=1)
+    start=time.perf_counter()
+    alarm=PeriodicAlarm(second,print,starting=now-datetime.timedelta(days=30))
+    assert now<typing.cast(datetime.datetime,alarm.time)<=now+second*2
+    assert time.perf_counter()-start<0.01
+    # the default starting is when it was made, not when first asked
+    clock=VirtualClock(now)
+    alarm=PeriodicAlarm(second,print,clock=clock)
+    clock.advance(2.5)
+    assert alarm.starting==now and alarm.time==now+second*3
+    fired:typing.List[int]=[]
+    def record(value:int,count:int=1)->None:
+        fired.append(value*count)
+    for policy,expectFired in (('skip',[]),('once',[1]),('all',[10])):
+        fired.clear()
+        alarm=PeriodicAlarm(second,record,(1,),
+            starting=now-datetime.timedelta(days=30),
+            catchUp=typing.cast(CatchUpPolicy,policy))
+        alarm.resumeFrom(now-second*9.5) # was down for 10 occourances
+        if policy=='skip':
+            assert alarm.missed==0
+            assert typing.cast(datetime.datetime,alarm.time)>now
+        else:
+            assert alarm.missed==10,alarm.missed
+            assert typing.cast(datetime.datetime,alarm.time)<=now
+        aset=AlarmSet(alarm)
+        aset._fireCurrentAlarms() # pylint: disable=protected-access
+        assert fired==expectFired,(policy,fired)
+        assert alarm.missed==0
+        assert typing.cast(datetime.datetime,alarm.time)>now
+        assert list(aset.active)==[alarm]
+    # on time, a callback that knows nothing of count is called as usual
+    fired.clear()
+    alarm=PeriodicAlarm(second,fired.append,(2,),starting=now,
+        catchUp='all')
+    aset=AlarmSet(alarm)
+    aset._fireCurrentAlarms(lookahead=1.5) # pylint: disable=protected-access
+    assert fired==[2],fired
+    print('catch up ok')
+
+def test_scheduled():
+    """
+    Test that a ScheduledAlarm fires at each time its schedule gives
+    """
+    class EveryTenMinutes:
+        """
+        a schedule that occours on every tenth minute
+        """
+        def next(self,
+            fromTime:typing.Optional[datetime.datetime]=None
+            )->typing.Optional[datetime.datetime]:
+            """
+            the next tenth minute at or after fromTime
+            """
+            fromTime=typing.cast(datetime.datetime,fromTime)
+            ret=fromTime.replace(minute=fromTime.minute//10*10,
+                second=0,microsecond=0)
+            if ret<fromTime:
+                ret+=datetime.timedelta(minutes=10)
+            return ret
+    now=datetime.datetime.now()
+    alarm=ScheduledAlarm(EveryTenMinutes(),print)
+    first=typing.cast(datetime.datetime,alarm.time)
+    assert now<first<=now+datetime.timedelta(minutes=10)
+    assert first.minute%10==0 and first.second==0
+    aset=AlarmSet(alarm)
+    assert aset.nextAlarm().time==first
+    alarm=ScheduledAlarm(EveryTenMinutes(),print,
+        ending=first+datetime.timedelta(minutes=15))
+    assert alarm.time==first
+    second=typing.cast(Alarm,alarm.nextAlarm).time
+    assert second==first+datetime.timedelta(minutes=10)
+    assert alarm.nextAlarm is None
+    print('scheduled ok')
+
+def test_sharded():
+    """
+    Test that alarms are spread across worker processes and fire there
+    """
+    now=datetime.datetime.now()
+    aset=ShardedAlarmSet(3,key=lambda alarm:alarm._args[0]) # noqa: E501 # pylint: disable=protected-access,line-too-long
+    try:
+        aset.enableMetrics()
+        alarms=[Alarm(now+datetime.timedelta(seconds=0.2+i/1000),abs,(i%7,))
+            for i in range(300)]
+        aset.add(alarms)
+        aset.add(PeriodicAlarm(datetime.timedelta(seconds=0.1),abs,(-1,),
+            ending=now+datetime.timedelta(seconds=0.35)))
+        # a callback that raises does not stop its worker
+        aset.add(datetime.timedelta(seconds=0.3),int,('x',))
+        assert aset.cancelMany(alarms[::3])==100
+        assert not aset.cancel(alarms[0])
+        assert aset.stats()['active']==202
+        deadline=time.monotonic()+10
+        while aset.stats()['fired']<200+3+1 and time.monotonic()<deadline:
+            time.sleep(0.05)
+        stats=aset.stats()
+        assert stats['fired']==204 and stats['failed']==1,stats
+        assert stats['active']==0 and stats['expired']==202
+        assert stats['lateness']['count']==204
+        assert len(stats['errors'])==1 and 'ValueError' in stats['errors'][0]
+        assert len(aset)==0
+        # a worker that dies is reported, rather than waited on forever
+        aset._processes[1].terminate() # pylint: disable=protected-access
+        aset._processes[1].join() # pylint: disable=protected-access
+        try:
+            aset.stats()
+        except Exception as e: # pylint: disable=broad-except
+            assert 'worker 1 has stopped' in str(e),e
+        else:
+            assert False,'stats() should have raised'
+    finally:
+        aset.end()
+    print('sharded ok')
+
+def test_batched():
+    """
+    Test that co-due alarms sharing a callable are delivered in one call
+    """
+    single:typing.List[typing.Any]=[]
+    batches:typing.List[typing.List[typing.Tuple[typing.Any,...]]]=[]
+    other:typing.List[typing.Any]=[]
+    def record(*args,**kwargs)->None:
+        single.append(args or kwargs)
+    when=datetime.datetime.now()+datetime.timedelta(seconds=1)
+    aset=AlarmSet()
+    aset.addBatchHandler(record,batches.append)
+    aset.add([Alarm(when,record,(i,)) for i in range(500)])
+    aset.add(when,other.append,('x',))
+    aset.add(when,record,kwargs={'y':1}) # kwargs, so not batched
+    lonely=Alarm(when+datetime.timedelta(seconds=5),record,('z',))
+    aset.add(lonely)
+    aset._fireCurrentAlarms(lookahead=2) # pylint: disable=protected-access
+    assert len(batches)==1 and batches[0]==[(i,) for i in range(500)]
+    assert other==['x'] and single==[{'y':1}]
+    assert len(aset.callbackTimings)==502
+    assert list(aset.active)==[lonely]
+    aset._fireCurrentAlarms(lookahead=10) # pylint: disable=protected-access
+    # a lone alarm is called as usual
+    assert single==[{'y':1},('z',)] and len(batches)==1
+    # two callables sharing one batch handler are batched separately
+    def recordToo(*args)->None:
+        single.append(args)
+    aset.addBatchHandler(recordToo,batches.append)
+    aset.add([Alarm(when,record,(1,)),Alarm(when,recordToo,(2,)),
+        Alarm(when,record,(3,)),Alarm(when,recordToo,(4,))])
+    aset._fireCurrentAlarms(lookahead=10) # pylint: disable=protected-access
+    assert batches[1:]==[[(1,),(3,)],[(2,),(4,)]],batches[1:]
+    print('batched ok')
+
+def test_virtualClock():
+    """
+    Test that a year of alarms replays quickly, in order, on a VirtualClock
+    """
+    starting=datetime.datetime(2025,1,1)
+    ending=datetime.datetime(2026,1,1)
+    clock=VirtualClock(starting)
+    fired:typing.List[typing.Tuple[datetime.datetime,str]]=[]
+    def record(name:str)->None:
+        fired.append((clock.now(),name))
+    aset=AlarmSet(clock=clock,coalesceWindow=0)
+    aset.add(PeriodicAlarm(datetime.timedelta(minutes=10),record,('10m',),
+        starting=starting,ending=ending))
+    aset.add(PeriodicAlarm(datetime.timedelta(days=1),record,('day',),
+        starting=starting,ending=ending))
+    aset.add(datetime.datetime(2025,7,4,12,0,30),record,('once',))
+    aset.add(datetime.timedelta(days=100),record,('relative',))
+    # no clock or starting of its own, so it starts by the set's clock
+    aset.add(PeriodicAlarm(datetime.timedelta(days=60),record,('60d',),
+        ending=ending))
+    start=time.perf_counter()
+    aset.run()
+    assert time.perf_counter()-start<30
+    assert clock.now()>=datetime.datetime(2025,12,31,23,50)
+    assert sum(1 for _,name in fired if name=='10m')==365*24*6-1
+    assert sum(1 for _,name in fired if name=='day')==364
+    assert (datetime.datetime(2025,7,4,12,0,30),'once') in fired
+    assert (starting+datetime.timedelta(days=100),'relative') in fired
+    assert [t for t,name in fired if name=='60d']==[
+        starting+datetime.timedelta(days=60*i) for i in range(1,7)]
+    assert all(a[0]<=b[0] for a,b in zip(fired,fired[1:]))
+    # a timing wheel ticks by the clock it is given too
+    clock=VirtualClock(starting)
+    fired.clear()
+    wheel=TimingWheelAlarmSet(tickResolution=1,clock=clock,maxExpired=5)
+    wheel.add(PeriodicAlarm(datetime.timedelta(hours=1),record,('hour',),
+        starting=starting,ending=starting+datetime.timedelta(days=2)))
+    wheel.add(starting+datetime.timedelta(days=1,seconds=30),record,('once',))
+    wheel.add([Alarm(starting+datetime.timedelta(minutes=i),record,('m',))
+        for i in range(1,11)])
+    start=time.perf_counter()
+    wheel.run()
+    assert time.perf_counter()-start<30
+    assert [t for t,name in fired if name=='hour']==[
+        starting+datetime.timedelta(hours=i) for i in range(1,48)]
+    assert (starting+datetime.timedelta(days=1,seconds=30),'once') in fired
+    assert len(list(wheel.expired))==5
+    print('virtual clock ok')
+
+def test_expiredHistory():
+    """
+    Test that expired alarms are only remembered as long as asked,
+    and that alarms can be looked up by time
+    """
+    starting=datetime.datetime(2025,1,1)
+    minute=datetime.timedelta(minutes=1)
+    clock=VirtualClock(starting)
+    aset=AlarmSet(clock=clock,maxExpired=2000)
+    alarms=[Alarm(starting+minute*i,abs,(i,)) for i in range(1,5001)]
+    aset.add(alarms)
+    clock.advance(3600*24*4)
+    aset._fireCurrentAlarms(0) # pylint: disable=protected-access
+    assert list(aset.expired)==alarms[3000:]
+    assert aset.stats()['expired']==2000
+    assert len(aset._expired)<=2*2000 # pylint: disable=protected-access
+    assert list(aset.all)==alarms[3000:]
+    small=AlarmSet(clock=clock,maxExpired=10)
+    for i in range(100):
+        small.add(clock.now()-minute*(100-i),abs,(i,))
+    assert len(list(small.expired))==10 and len(list(small.all))==10
+    assert len(small._expired)<=20 # pylint: disable=protected-access
+    # queries over what is remembered, and the active ones
+    future=[Alarm(starting+minute*i,abs,(i,)) for i in range(6000,6010)]
+    aset.add(future)
+    between=aset.alarmsBetween(starting+minute*4990,starting+minute*6002)
+    assert between==alarms[4989:]+future[:2]
+    assert aset.nextAlarm(starting+minute*4999.5)==alarms[4999]
+    assert aset.nextAlarm(starting+minute*5000.5)==future[0]
+    assert aset.nextAlarm(starting+minute*7000) is None
+    assert aset.previousAlarm(starting+minute*6003.5)==future[3]
+    assert aset.previousAlarm(starting+minute*5500)==alarms[-1]
+    assert aset.previousAlarm(starting) is None
+    aset.cancel(future[3])
+    assert aset.previousAlarm(starting+minute*6003.5)==future[2]
+    # by age
+    aset=AlarmSet(clock=clock,maxExpiredAge=datetime.timedelta(minutes=10))
+    aset.add([Alarm(clock.now()-minute*i,abs,(i,)) for i in range(20)])
+    assert len(list(aset.expired))==10
+    print('expired history ok')
+
+def test_producers():
+    """
+    Test that many threads can add alarms while the set is running
+    """
+    fired:typing.List[float]=[]
+    base=datetime.datetime.now()+datetime.timedelta(seconds=0.3)
+    aset=AlarmSet()
+    aset.start()
+    def produce(n:int)->None:
+        for i in range(200):
+            t=base+datetime.timedelta(seconds=(i*8+n)/8000)
+            aset.add(t,fired.append,(t.timestamp(),))
+    threads=[threading.Thread(target=produce,args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    deadline=time.monotonic()+10
+    while len(fired)<1600 and time.monotonic()<deadline:
+        time.sleep(0.01)
+    aset.end()
+    assert len(fired)==1600,len(fired)
+    assert all(a<=b for a,b in zip(fired,fired[1:]))
+    # add then cancel from another thread while running
+    aset=AlarmSet()
+    aset.start()
+    cancelled=Alarm(datetime.timedelta(seconds=0.1),fired.append,(0,))
+    aset.add(cancelled)
+    assert aset.cancel(cancelled)
+    time.sleep(0.3)
+    aset.end()
+    assert len(fired)==1600
+    # a run that is over at once leaves adds going straight in
+    aset=AlarmSet()
+    aset.start(True)
+    if aset._thread is not None: # pylint: disable=protected-access
+        aset._thread.join() # pylint: disable=protected-access
+    aset.add(datetime.timedelta(hours=1),print)
+    assert len(aset)==1
+    # a run ended by a raising callback still hands adds back
+    def fail()->None:
+        raise ValueError('oops')
+    aset=AlarmSet()
+    aset.add(datetime.timedelta(seconds=0.05),fail)
+    try:
+        aset.run()
+    except ValueError:
+        pass
+    else:
+        assert False,'run() should have raised'
+    assert aset._runThreadId is None # pylint: disable=protected-access
+    thread=threading.Thread(target=aset.add,
+        args=(datetime.timedelta(hours=1),print))
+    thread.start()
+    thread.join()
+    assert len(aset)==1
+    print('producers ok')
+
 def test_running():
     """
     Test that the alarms run at the correct times
@@ -575,4 +3688,18 @@ def test():
     """
     test_ordering()
     test_expired()
+    test_heapOrdering()
+    test_timingWheel()
+    test_async()
+    test_executor()
+    test_coalescing()
+    test_metrics()
+    test_journal()
+    test_catchUp()
+    test_scheduled()
+    test_sharded()
+    test_batched()
+    test_virtualClock()
+    test_expiredHistory()
+    test_producers()
     test_running()
@@ -162,7 +162,7 @@ def weekRange(
     toWeek:typing.Union[int,None,datetime.datetime]=None)->DateRange:
     """
     Get a range representing the entire week(s) for the date(s)
-    That is, from Sunday 1:00:00AM - Saturday 12:59:59PM
+    That is, from Monday 12:00:00AM - Sunday 11:59:59PM
 
     :fromWeek: if not specified, use this month
     :toWeek: if not specified, use fromDay
@@ -308,3 +308,109 @@ def dayAfter(
     elif isinstance(when,DateRange):
         when=dayRange(when).toTime()
     return dayRange(when+datetime.timedelta(days=1))
+
+DateBounds=typing.Tuple[datetime.datetime,datetime.datetime]
+def _midnight(when:datetime.date)->datetime.datetime:
+    """
+    12:00AM at the start of the given day
+    """
+    return datetime.datetime(when.year,when.month,when.day)
+def _nextMonth(when:datetime.datetime)->datetime.datetime:
+    """
+    12:00AM on the first of the month after the given date
+    """
+    if when.month==12:
+        return datetime.datetime(when.year+1,1,1)
+    return datetime.datetime(when.year,when.month+1,1)
+def _iterateBounds(
+    first:datetime.datetime,
+    end:datetime.datetime,
+    nextStart:typing.Callable[[datetime.datetime],datetime.datetime]
+    )->typing.Generator[DateBounds,None,None]:
+    """
+    yield (start,end) from first until a bucket starts after end,
+    where each end is the start of the next one
+    """
+    start=first
+    while start<=end:
+        after=nextStart(start)
+        yield (start,after)
+        start=after
+
+def iterateDayBounds(
+    start:datetime.datetime,
+    end:datetime.datetime
+    )->typing.Generator[DateBounds,None,None]:
+    """
+    Like iterating dayRange() for every day from start to end, but yields
+    plain (start,end) tuples, where end is 12:00AM the next day
+    """
+    oneDay=datetime.timedelta(days=1)
+    return _iterateBounds(_midnight(start),end,lambda d:d+oneDay)
+def iterateWeekBounds(
+    start:datetime.datetime,
+    end:datetime.datetime
+    )->typing.Generator[DateBounds,None,None]:
+    """
+    Like iterating weekRange() for every week from start to end, but yields
+    plain (start,end) tuples, from Monday 12:00AM to the next Monday 12:00AM
+    """
+    first=_midnight(start)-datetime.timedelta(days=start.weekday())
+    return _iterateBounds(first,end,lambda d:d+oneWeek())
+def iterateMonthBounds(
+    start:datetime.datetime,
+    end:datetime.datetime
+    )->typing.Generator[DateBounds,None,None]:
+    """
+    Like iterating monthRange() for every month from start to end, but yields
+    plain (start,end) tuples, from the 1st to the 1st of the next month
+    """
+    first=datetime.datetime(start.year,start.month,1)
+    return _iterateBounds(first,end,_nextMonth)
+def iterateYearBounds(
+    start:datetime.datetime,
+    end:datetime.datetime
+    )->typing.Generator[DateBounds,None,None]:
+    """
+    Like iterating yearRange() for every year from start to end, but yields
+    plain (start,end) tuples, from jan 1 to jan 1 of the next year
+    """
+    first=datetime.datetime(start.year,1,1)
+    return _iterateBounds(first,end,
+        lambda d:datetime.datetime(d.year+1,1,1))
+
+def boundsArrays(
+    start:datetime.datetime,
+    end:datetime.datetime,
+    unit:str='day'
+    )->typing.Tuple[typing.Any,typing.Any]:
+    """
+    All of the bucket boundaries from start to end at once, as
+    two numpy datetime64[D] arrays of (starts,ends)
+
+    (requires numpy)
+
+    :unit: 'day', 'week', 'month', or 'year'
+        (very forgiving - anything starting with 'd','w','m','y')
+        Weeks start on Monday, like weekRange().
+    """
+    import numpy as np
+    unit=unit.lower()[0:1]
+    first=np.datetime64(start.date(),'D')
+    last=np.datetime64(end.date(),'D')
+    if unit=='d':
+        starts=np.arange(first,last+1)
+        return starts,starts+1
+    if unit=='w':
+        first-=start.weekday()
+        starts=np.arange(first,last+1,7)
+        return starts,starts+7
+    if unit=='m':
+        months=np.arange(first.astype('datetime64[M]'),
+            last.astype('datetime64[M]')+1)
+    elif unit=='y':
+        months=np.arange(first.astype('datetime64[Y]'),
+            last.astype('datetime64[Y]')+1)
+    else:
+        raise Exception(f'Unknown unit "{unit}"')
+    return months.astype('datetime64[D]'),(months+1).astype('datetime64[D]')
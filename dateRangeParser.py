@@ -0,0 +1,467 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+A hand-written tokenizer and recursive-descent parser for
+date range strings like "tue-sat from 1:00 to 5:00PM"
+
+This reads the same grammar as DateRange.DECODER, but in a single
+linear pass without the regex backtracking (or compiling it up front).
+
+The grammar is:
+    rangeString := ("each"|"every"|"from")* weekdays?
+                   ("in"|"from")* months?
+                   ("from"|"at")* times?
+    weekdays := WEEKDAY (RANGE WEEKDAY)?
+    months := MONTH monthDay? (RANGE? MONTH monthDay?)?
+    times := TIME? (RANGE? TIME)?
+    monthDay := (NUMBER|TENS "-"? UNIT|TENS|UNIT) MULTIPLIER* "and"?
+    RANGE := "-"|"to"|"till"|"until"|"through"
+
+Like the regex, anything left over that does not fit is ignored, and
+the RANGE between two months, or two times, can be left out (eg "dec jan"
+or "17:00 5:00PM").  Between two times, that is only when the first
+has no am/pm, because the regex only takes the space after a time
+when it is looking for an am/pm.
+"""
+import typing
+import datetime
+import dateTools.miscFunctions as miscFunctions
+from dateTools.calendarNames import WeekdayAbbrs,MonthAbbrs
+
+
+WORD='word'
+NUMBER='number'
+TIME='time'
+DASH='dash'
+OTHER='other'
+Token=typing.Tuple[str,str] # (kind,text)
+
+RANGE_WORDS=('to','till','until','through')
+ORDINAL_SUFFIXES=('st','nd','rd','th')
+DECADE_WORDS=frozenset(d for d in miscFunctions.decades if d is not None)
+# a number word on its own, with or without an ordinal suffix
+UNIT_WORDS=frozenset(miscFunctions.numerics) \
+    |frozenset(miscFunctions.numericPlaces) \
+    |frozenset(n+suffix
+        for n in miscFunctions.numerics for suffix in ORDINAL_SUFFIXES)
+MULTIPLIER_WORDS=frozenset(miscFunctions.numericFamilies)
+# what can follow "point" (eg "one point five")
+DECIMAL_WORDS=frozenset(miscFunctions.numerics[1:10])
+
+
+def tokenizeDateRange(rangestring:str)->typing.List[Token]:
+    """
+    Split a date range string into (kind,text) tokens, where kind is one of
+        WORD - a run of letters, eg "tuesday"
+        NUMBER - a run of digits (and any , or .) with optional
+            ordinal suffix, eg "23rd"
+        TIME - a time with optional am/pm, eg "5:00PM"
+        DASH - a "-" range indicator
+        OTHER - any other single character
+
+    Text is lowercased and whitespace is dropped.
+    """
+    text=rangestring.lower()
+    tokens:typing.List[Token]=[]
+    i=0
+    n=len(text)
+    while i<n:
+        c=text[i]
+        start=i
+        if c.isspace():
+            i+=1
+        elif 'a'<=c<='z':
+            while i<n and 'a'<=text[i]<='z':
+                i+=1
+            tokens.append((WORD,text[start:i]))
+        elif '0'<=c<='9':
+            while i<n and '0'<=text[i]<='9':
+                i+=1
+            isTime=i-start<=2 and text[i:i+1]==':' \
+                and text[i+1:i+3].isdigit() and len(text[i+1:i+3])==2
+            if isTime:
+                i+=3
+                ampm=i
+                while ampm<n and text[ampm].isspace():
+                    ampm+=1
+                if text[ampm:ampm+2] in ('am','pm'):
+                    i=ampm+2
+                tokens.append((TIME,text[start:i]))
+            else:
+                # like the regex, digits run on through , and .
+                while i<n and text[i] in '0123456789,.':
+                    i+=1
+                if text[i:i+2] in ORDINAL_SUFFIXES:
+                    i+=2
+                tokens.append((NUMBER,text[start:i]))
+        elif c=='-':
+            i+=1
+            tokens.append((DASH,c))
+        else:
+            i+=1
+            tokens.append((OTHER,c))
+    return tokens
+
+
+def timeTokenValue(text:str)->datetime.time:
+    """
+    Convert a TIME token like "5:00pm" or "17:00" into a time
+
+    (same results as miscFunctions.toTime() without going through strptime)
+    """
+    hour,minute=text[0:text.index(':')+3].split(':')
+    h=int(hour)
+    m=int(minute)
+    ampm=text[-2:]
+    if ampm in ('am','pm'):
+        if not 1<=h<=12:
+            raise ValueError(f'Hour "{hour}" is not valid for am/pm')
+        h=h%12
+        if ampm=='pm':
+            h+=12
+    return datetime.time(h,m)
+
+
+class DateRangeParser:
+    """
+    Recursive-descent parser for a single date range string
+
+    Produces the same fields as the DateRange.DECODER regex
+    (month, toMonth, monthDay, toMonthDay, weekday, toWeekday,
+    time, toTime), leaving out any that are not mentioned.
+
+    It differs from the regex on purpose in that:
+        * a time straight after a month ("dec 12:00AM") is read as a
+            time, where the regex reads it as day 12 and drops the time
+        * a tens word and a units word make one day of the month
+            ("twenty fifth" or "twenty-fifth" is 25), where the regex
+            stops after the tens word (20) unless there is a space
+            after the dash
+        * words are only recognised whole, where the regex can match
+            the start of a longer word and carry on from partway
+            through it (eg "sun tomorrow" is sunday to monday to the
+            regex, and "dec sixteenth 9:30" loses its time)
+    """
+
+    def __init__(self,rangestring:str):
+        """ """
+        self.tokens:typing.List[Token]=tokenizeDateRange(rangestring)
+        self.pos:int=0
+
+    def _peek(self)->typing.Optional[Token]:
+        """
+        the current token, or None at the end
+        """
+        if self.pos<len(self.tokens):
+            return self.tokens[self.pos]
+        return None
+
+    def _skipWords(self,words:typing.Iterable[str])->None:
+        """
+        skip over any filler words
+        """
+        while True:
+            token=self._peek()
+            if token is None or token[0]!=WORD or token[1] not in words:
+                return
+            self.pos+=1
+
+    def _rangeIndicator(self)->bool:
+        """
+        consume a "-","to","till","until", or "through"
+        """
+        token=self._peek()
+        if token is None:
+            return False
+        if token[0]==DASH or (token[0]==WORD and token[1] in RANGE_WORDS):
+            self.pos+=1
+            return True
+        return False
+
+    def _weekday(self)->typing.Optional[int]:
+        """
+        consume a weekday name (0=sunday)
+        """
+        token=self._peek()
+        if token is None or token[0]!=WORD:
+            return None
+        abbr=token[1][0:2]
+        if abbr not in WeekdayAbbrs:
+            return None
+        self.pos+=1
+        return WeekdayAbbrs.index(abbr)
+
+    def _month(self)->typing.Optional[int]:
+        """
+        consume a month name (1=january)
+        """
+        token=self._peek()
+        if token is None or token[0]!=WORD:
+            return None
+        abbr=token[1][0:3]
+        if abbr not in MonthAbbrs:
+            return None
+        self.pos+=1
+        return MonthAbbrs.index(abbr)+1
+
+    def _time(self)->typing.Optional[str]:
+        """
+        consume a time
+        """
+        token=self._peek()
+        if token is None or token[0]!=TIME:
+            return None
+        self.pos+=1
+        return token[1]
+
+    def _word(self,words:typing.Container[str])->typing.Optional[str]:
+        """
+        consume a word if it is one of the given words
+        """
+        token=self._peek()
+        if token is None or token[0]!=WORD or token[1] not in words:
+            return None
+        self.pos+=1
+        return token[1]
+
+    def _monthDay(self)->typing.Optional[int]:
+        """
+        consume a day of the month, either as digits ("25","25th")
+        or as words ("twenty fifth"), optionally followed by
+        multipliers and "and" just like the regex allows
+        """
+        words:typing.List[str]=[]
+        token=self._peek()
+        if token is not None and token[0]==NUMBER:
+            self.pos+=1
+            words.append(token[1])
+        else:
+            dashed=False
+            tens=self._word(DECADE_WORDS)
+            if tens is not None:
+                # (spelled the way numberdecode() reads as one number)
+                words.append(tens+'-')
+                token=self._peek()
+                after=self.tokens[self.pos+1:self.pos+2]
+                if token is not None and token[0]==DASH and after and (
+                    after[0][0]==NUMBER or after[0][1] in UNIT_WORDS):
+                    self.pos+=1 # eg "twenty-fifth"
+                    dashed=True
+            token=self._peek()
+            unit=None
+            if dashed and token is not None and token[0]==NUMBER:
+                self.pos+=1 # eg "twenty-5"
+                words.append(token[1])
+            else:
+                unit=self._word(UNIT_WORDS)
+            if unit is not None:
+                words.append(unit)
+                if unit in miscFunctions.numerics \
+                    and self.pos+1<len(self.tokens) \
+                    and self.tokens[self.pos][1]=='point' \
+                    and self.tokens[self.pos+1][1] in DECIMAL_WORDS:
+                    self.pos+=1 # eg "one point five"
+                    words.append('point')
+                    while True:
+                        decimal=self._word(DECIMAL_WORDS)
+                        if decimal is None:
+                            break
+                        words.append(decimal)
+        while True:
+            multiplier=self._word(MULTIPLIER_WORDS)
+            if multiplier is None:
+                break
+            words.append(multiplier)
+        if self._word(('and',)) is not None:
+            words.append('and')
+        if not words:
+            return None
+        return int(miscFunctions.numberdecode(' '.join(words)))
+
+    def _weekdays(self,fields:typing.Dict[str,typing.Any])->None:
+        """
+        weekdays := WEEKDAY (RANGE WEEKDAY)?
+        """
+        weekday=self._weekday()
+        if weekday is None:
+            return
+        fields['weekday']=weekday
+        fields['toWeekday']=weekday
+        mark=self.pos
+        if self._rangeIndicator():
+            toWeekday=self._weekday()
+            if toWeekday is None:
+                self.pos=mark
+            else:
+                fields['toWeekday']=toWeekday
+
+    def _months(self,fields:typing.Dict[str,typing.Any])->None:
+        """
+        months := MONTH monthDay? (RANGE? MONTH monthDay?)?
+        """
+        month=self._month()
+        if month is None:
+            return
+        fields['month']=month
+        fields['toMonth']=month
+        monthDay=self._monthDay()
+        if monthDay is not None:
+            fields['monthDay']=monthDay
+            fields['toMonthDay']=monthDay
+        mark=self.pos
+        if not self._rangeIndicator() and monthDay is not None \
+            and self.tokens[self.pos-1][1] in MULTIPLIER_WORDS|{'and'}:
+            # the regex does not take the space after these
+            return
+        toMonth=self._month()
+        if toMonth is None:
+            self.pos=mark
+        else:
+            fields['toMonth']=toMonth
+            toMonthDay=self._monthDay()
+            if toMonthDay is not None:
+                fields['toMonthDay']=toMonthDay
+
+    def _times(self,fields:typing.Dict[str,typing.Any])->None:
+        """
+        times := TIME? (RANGE? TIME)?
+
+        (just like the regex, a lone "to" time is ignored)
+        """
+        time=self._time()
+        if time is None:
+            return
+        fields['time']=timeTokenValue(time)
+        fields['toTime']=fields['time']
+        mark=self.pos
+        if not self._rangeIndicator() and time[-2:] in ('am','pm'):
+            return
+        toTime=self._time()
+        if toTime is None:
+            self.pos=mark
+        else:
+            fields['toTime']=timeTokenValue(toTime)
+
+    def parse(self)->typing.Dict[str,typing.Any]:
+        """
+        rangeString := ("each"|"every"|"from")* weekdays?
+                       ("in"|"from")* months?
+                       ("from"|"at")* times?
+
+        returns a dict of only the fields that were found
+        """
+        self.pos=0
+        fields:typing.Dict[str,typing.Any]={}
+        self._skipWords(('each','every','from'))
+        self._weekdays(fields)
+        self._skipWords(('in','from'))
+        self._months(fields)
+        self._skipWords(('from','at'))
+        self._times(fields)
+        return fields
+
+
+def parseDateRangeFields(rangestring:str)->typing.Dict[str,typing.Any]:
+    """
+    Parse a date range string into a dict of only the fields it mentions
+    """
+    return DateRangeParser(rangestring).parse()
+
+
+BENCHMARK_CORPUS=(
+    "mon 8:00-8:30AM",
+    "tue-sat 1:00-5:00PM",
+    "tue-sat from 1:00 to 5:00PM",
+    "1:00-5:00PM",
+    "tuesdays",
+    "every dec 25 at 12:00AM",
+    "mar 17",
+    "Oct 31",
+    "jan 5 - mar 10",
+    "every monday from 9:00AM to 5:00PM",
+    "sat-sun 10:00AM-4:00PM",
+    "fri 10:00PM-2:00AM",
+    "each wednesday at 12:30PM",
+    "mon through fri 8:00AM until 6:00PM",
+    "nov 1 - feb 28 from 7:00AM to 7:00PM",
+    "sunday",
+    "thu 17:00-23:59",
+    "this does not look like a schedule",
+    "",
+    )
+
+def benchmark(
+    corpus:typing.Iterable[str]=BENCHMARK_CORPUS,
+    repeat:int=2000
+    )->typing.Dict[str,float]:
+    """
+    Time the tokenizer against the DateRange.DECODER regex
+    on a corpus of schedule strings, bypassing the parse cache
+
+    returns seconds taken for each, including the one-time cost of
+    compiling the regex, and raises an exception if they ever disagree
+    """
+    import timeit
+    from dateTools.dateRanges import DateRange,DateRangeSpec,\
+        parseDateRangeStringRegex
+    corpus=list(corpus)
+    for rangestring in corpus:
+        fromRegex=parseDateRangeStringRegex(rangestring)
+        fromTokens=DateRangeSpec(**parseDateRangeFields(rangestring))
+        if fromRegex!=fromTokens:
+            msg=f'"{rangestring}" parsed as {fromTokens} not {fromRegex}'
+            raise Exception(msg)
+    DateRange.DECODER=None
+    compileTime=timeit.timeit(DateRange._CREATE_DECODER,number=1)
+    def runRegex():
+        for rangestring in corpus:
+            parseDateRangeStringRegex(rangestring)
+    def runTokens():
+        for rangestring in corpus:
+            parseDateRangeFields(rangestring)
+    return {
+        'regexCompile':compileTime,
+        'regex':timeit.timeit(runRegex,number=repeat),
+        'tokenizer':timeit.timeit(runTokens,number=repeat)}
+
+
+def cmdline(args:typing.Iterable[str])->int:
+    """
+    Run the command line
+
+    :param args: command line arguments (WITHOUT the filename)
+    """
+    printhelp=False
+    if not args:
+        printhelp=True
+    else:
+        for arg in args:
+            if arg.startswith('-'):
+                arg=[a.strip() for a in arg.split('=',1)]
+                if arg[0] in ['-h','--help']:
+                    printhelp=True
+                elif arg[0]=='--tokens':
+                    print(tokenizeDateRange(arg[1]))
+                elif arg[0]=='--parse':
+                    print(parseDateRangeFields(arg[1]))
+                elif arg[0]=='--benchmark':
+                    for k,v in benchmark().items():
+                        print(f'{k}: {v:.6f}s')
+                else:
+                    print('ERR: unknown argument "'+arg[0]+'"')
+            else:
+                print('ERR: unknown argument "'+arg+'"')
+    if printhelp:
+        print('Usage:')
+        print('  dateRangeParser.py [options]')
+        print('Options:')
+        print('   --tokens=rangestring .... show how a range string tokenizes')
+        print('   --parse=rangestring ..... parse a range string')
+        print('   --benchmark ............. time tokenizer against the regex')
+        return -1
+    return 0
+
+
+if __name__=='__main__':
+    import sys
+    sys.exit(cmdline(sys.argv[1:]))
@@ -5,20 +5,148 @@ This tool allows dates formatted like "mon 8:00-8:30AM,tue-sat 1:00-5:00PM"
 """
 import typing
 import datetime
+import calendar
+import bisect
+import functools
 import re
 from paths import URLCompatible
 from jsonSerializable import JsonSerializable
 from rangeTools import Range,Ranges
 import dateTools.miscFunctions as miscFunctions
 from dateTools.calendarNames import WeekdayAbbrs,MonthAbbrs
+from dateTools.dateRangeParser import parseDateRangeFields
 
 
 RangeIndicatorReText=r"""(\s*(-|to|till|until|through)\s*)"""
 
+MINUTES_PER_DAY=24*60
+MINUTES_PER_WEEK=7*MINUTES_PER_DAY
+# month lengths of a leap year, so that every (month,day) has a day-of-year
+LEAP_MONTH_LENGTHS=(31,29,31,30,31,30,31,31,30,31,30,31)
+LEAP_MONTH_STARTS=tuple(sum(LEAP_MONTH_LENGTHS[:i]) for i in range(12))
+DAYS_PER_LEAP_YEAR=sum(LEAP_MONTH_LENGTHS)
+
+
+def dayOfYearIndex(month:int,monthDay:int)->int:
+    """
+    Index of a (month,monthDay) within a leap year, starting with 0=jan 1
+
+    (uses a leap year so that feb 29 always has a slot, which means
+    an index always means the same calendar day no matter the year)
+    """
+    monthDay=max(1,min(monthDay,LEAP_MONTH_LENGTHS[month-1]))
+    return LEAP_MONTH_STARTS[month-1]+monthDay-1
+
+def dayOfYearIndexToDate(year:int,index:int)->datetime.date:
+    """
+    The date within the given year for a dayOfYearIndex()
+
+    If the index is past the end of the year, returns jan 1 of the next year.
+    If the day does not exist this year (feb 29), returns the day after.
+    """
+    if index>=DAYS_PER_LEAP_YEAR:
+        return datetime.date(year+1,1,1)
+    month=bisect.bisect_right(LEAP_MONTH_STARTS,index)
+    monthDay=index-LEAP_MONTH_STARTS[month-1]+1
+    if month==2 and monthDay==29 and not calendar.isleap(year):
+        return datetime.date(year,3,1)
+    return datetime.date(year,month,monthDay)
+
+def minuteOfWeek(when:datetime.datetime)->int:
+    """
+    How many minutes into the week (starting sunday 12:00AM) a time is
+    """
+    return ((when.weekday()+1)%7)*MINUTES_PER_DAY+when.hour*60+when.minute
+
+def startOfWeek(when:datetime.datetime)->datetime.datetime:
+    """
+    Sunday 12:00AM of the week containing the given time
+    """
+    day=when.date()-datetime.timedelta(days=(when.weekday()+1)%7)
+    return datetime.datetime.combine(day,datetime.time.min,when.tzinfo)
+
+def coalesceIntervals(
+    intervals:typing.Iterable[typing.Tuple[int,int]]
+    )->typing.List[typing.Tuple[int,int]]:
+    """
+    Sort a series of (start,end) intervals and merge any
+    that overlap or touch into a single interval
+    """
+    ret:typing.List[typing.Tuple[int,int]]=[]
+    for start,end in sorted(intervals):
+        if ret and start<=ret[-1][1]:
+            if end>ret[-1][1]:
+                ret[-1]=(ret[-1][0],end)
+        else:
+            ret.append((start,end))
+    return ret
+
+def combineIntervals(
+    a:typing.Sequence[typing.Tuple[int,int]],
+    b:typing.Sequence[typing.Tuple[int,int]],
+    op:typing.Callable[[bool,bool],bool]
+    )->typing.List[typing.Tuple[int,int]]:
+    """
+    Combine two sorted, coalesced lists of (start,end) intervals
+    in a single O(n+m) sweep
+
+    :op: given (inA,inB) for a point, whether the result includes it
+        eg for an intersection, lambda inA,inB: inA and inB
+        (must be False when a point is in neither)
+    """
+    aPoints=[point for interval in a for point in interval]
+    bPoints=[point for interval in b for point in interval]
+    ret:typing.List[typing.Tuple[int,int]]=[]
+    start=None
+    i=0
+    j=0
+    while i<len(aPoints) or j<len(bPoints):
+        if j>=len(bPoints) or (i<len(aPoints) and aPoints[i]<bPoints[j]):
+            point=aPoints[i]
+        else:
+            point=bPoints[j]
+        while i<len(aPoints) and aPoints[i]==point:
+            i+=1
+        while j<len(bPoints) and bPoints[j]==point:
+            j+=1
+        # an odd number of points passed means we are inside an interval
+        inside=op(i%2==1,j%2==1)
+        if inside and start is None:
+            start=point
+        elif not inside and start is not None:
+            ret.append((start,point))
+            start=None
+    return ret
+
 
 ComparableDatetimeCompatible=typing.Union[
     datetime.datetime,int,float,"ComparableDatetime"]
 ComparableDateTimeCompatible=ComparableDatetimeCompatible
+MICROS_PER_SECOND=1000000
+def datetimeToMicros(dt:datetime.datetime)->int:
+    """
+    Exact number of microseconds since the unix epoch for a datetime
+    (naive datetimes are taken as local time, same as datetime.timestamp())
+    """
+    seconds=int(dt.replace(microsecond=0).timestamp())
+    return seconds*MICROS_PER_SECOND+dt.microsecond
+def _microsOf(cdt:ComparableDatetimeCompatible)->int:
+    """
+    microseconds since the unix epoch of anything ComparableDatetime accepts
+    """
+    if isinstance(cdt,ComparableDatetime):
+        return cdt._micros
+    return ComparableDatetime(cdt)._micros
+def _comparableMicros(other:typing.Any)->typing.Optional[int]:
+    """
+    microseconds since the unix epoch of anything ComparableDatetime accepts,
+    or None if it is something unrelated
+    """
+    if isinstance(other,ComparableDatetime):
+        return other._micros
+    if isinstance(other,(datetime.datetime,int,float)):
+        return ComparableDatetime(other)._micros
+    return None
 def asComparableDatetime(
     cdt:ComparableDatetimeCompatible
     )->"ComparableDatetime":
@@ -34,47 +162,112 @@ asComparableDateTime=asComparableDatetime
 class ComparableDatetime:
     """
     Something that is comparable as a date/time
+
+    Stored as a whole number of microseconds since the unix epoch,
+    so comparing and sorting is just comparing ints.  The datetime
+    is only created when someone asks for it.
     """
+
+    __slots__=('_micros','_datetime')
+
     def __init__(self,cdt:ComparableDatetimeCompatible):
-        if isinstance(cdt,(int,float)):
-            cdt=datetime.datetime.fromtimestamp(cdt)
-        elif isinstance(cdt,ComparableDatetime):
-            cdt=cdt.datetime
-        self.datetime:datetime.datetime=cdt
+        self._datetime:typing.Optional[datetime.datetime]
+        if isinstance(cdt,ComparableDatetime):
+            self._micros:int=cdt._micros
+            self._datetime=cdt._datetime
+        elif isinstance(cdt,int):
+            self._micros=cdt*MICROS_PER_SECOND
+            self._datetime=None
+        elif isinstance(cdt,float):
+            self._micros=round(cdt*MICROS_PER_SECOND)
+            self._datetime=None
+        else:
+            self._micros=datetimeToMicros(cdt)
+            self._datetime=cdt
+
+    @classmethod
+    def fromMicros(cls,micros:int)->"ComparableDatetime":
+        """
+        Create directly from microseconds since the unix epoch
+        """
+        ret=cls.__new__(cls)
+        ret._micros=micros
+        ret._datetime=None
+        return ret
+
+    @property
+    def micros(self)->int:
+        """
+        microseconds since the unix epoch
+        """
+        return self._micros
+
+    @property
+    def datetime(self)->datetime.datetime:
+        """
+        this time as a datetime
+        """
+        if self._datetime is None:
+            seconds,micros=divmod(self._micros,MICROS_PER_SECOND)
+            self._datetime=datetime.datetime.fromtimestamp(seconds)\
+                .replace(microsecond=micros)
+        return self._datetime
+    @datetime.setter
+    def datetime(self,dt:"datetime.datetime"):
+        self._micros=datetimeToMicros(dt)
+        self._datetime=dt
 
     @property
     def timestamp(self)->float:
         """
         timestamp in unixtime (with float milliseconds)
         """
-        return datetime.datetime.timestamp(self.datetime)
+        return self._micros/MICROS_PER_SECOND
     @timestamp.setter
     def timestamp(self,timestamp:float):
-        self.datetime=datetime.datetime.fromtimestamp(timestamp)
+        self._micros=round(timestamp*MICROS_PER_SECOND)
+        self._datetime=None
 
     def __sub__(self,other:typing.Any)->"ComparableDatetime":
-        return ComparableDatetime(
-            self.timestamp-asComparableDatetime(other).timestamp)
+        return ComparableDatetime.fromMicros(self._micros-_microsOf(other))
     def __add__(self,other:typing.Any)->"ComparableDatetime":
-        return ComparableDatetime(
-            self.timestamp+asComparableDatetime(other).timestamp)
+        return ComparableDatetime.fromMicros(self._micros+_microsOf(other))
     def __mul__(self,other:typing.Any)->"ComparableDatetime":
-        return ComparableDatetime(
-            self.timestamp*asComparableDatetime(other).timestamp)
+        return ComparableDatetime.fromMicros(
+            self._micros*_microsOf(other)//MICROS_PER_SECOND)
     def __truediv__(self,other:typing.Any)->"ComparableDatetime":
-        return ComparableDatetime(
-            self.timestamp/asComparableDatetime(other).timestamp)
+        return ComparableDatetime.fromMicros(
+            round(self._micros/_microsOf(other)*MICROS_PER_SECOND))
     def __floordiv__(self,other:typing.Any)->"ComparableDatetime":
-        return ComparableDatetime(
-            self.timestamp//asComparableDatetime(other).timestamp)
+        return ComparableDatetime.fromMicros(
+            self._micros//_microsOf(other)*MICROS_PER_SECOND)
     def __lt__(self, other:typing.Any) -> bool:
-        return self.timestamp<asComparableDatetime(other).timestamp
+        micros=_comparableMicros(other)
+        if micros is None:
+            return NotImplemented
+        return self._micros<micros
     def __gt__(self, other:typing.Any) -> bool:
-        return self.timestamp>asComparableDatetime(other).timestamp
+        micros=_comparableMicros(other)
+        if micros is None:
+            return NotImplemented
+        return self._micros>micros
     def __le__(self, other:typing.Any) -> bool:
-        return self.timestamp<=asComparableDatetime(other).timestamp
+        micros=_comparableMicros(other)
+        if micros is None:
+            return NotImplemented
+        return self._micros<=micros
     def __ge__(self, other:typing.Any) -> bool:
-        return self.timestamp>=asComparableDatetime(other).timestamp
+        micros=_comparableMicros(other)
+        if micros is None:
+            return NotImplemented
+        return self._micros>=micros
+    def __eq__(self, other:typing.Any) -> bool:
+        micros=_comparableMicros(other)
+        if micros is None:
+            return NotImplemented
+        return self._micros==micros
+    def __hash__(self) -> int:
+        return hash(self._micros)
 
     def __repr__(self) -> str:
         return str(self.datetime)
@@ -140,7 +333,8 @@ class DateRange(
     """
 
     DECODER:typing.Optional[typing.Pattern]=None
-    def _CREATE_DECODER(self)->typing.Pattern:
+    @classmethod
+    def _CREATE_DECODER(cls)->typing.Pattern:
         weekdays='('+('|'.join(WeekdayAbbrs))+')[a-z]*'
         months='('+('|'.join(MonthAbbrs))+')[a-z]*'
         time=r'[0-9]{1,2}:[0-9]{2}\s*(am|pm)?'
@@ -166,8 +360,8 @@ class DateRange(
                 ("""+rangeIndicator+r"""(?P<toTime>"""+time+"""))?
             )?"""
         #print(regex)
-        self.DECODER=re.compile(regex.replace('\n','').replace(' ',''),re.IGNORECASE) # noqa: E501 # pylint: disable=line-too-long
-        return self.DECODER
+        cls.DECODER=re.compile(regex.replace('\n','').replace(' ',''),re.IGNORECASE) # noqa: E501 # pylint: disable=line-too-long
+        return cls.DECODER
 
     def __init__(self,
         dateRange:typing.Union[
@@ -178,8 +372,6 @@ class DateRange(
         filename:typing.Optional[URLCompatible]=None,
         jsonObj:typing.Union[str,typing.Dict,None]=None):
         """ """
-        if self.DECODER is None:
-            self._CREATE_DECODER()
         # these will be set to defaults by self.assign() caling self.reset()
         self.month=None
         self.toMonth=None
@@ -189,6 +381,9 @@ class DateRange(
         self.toWeekday=None
         self._time=None
         self._toTime=None
+        # the span this range was assigned, if it was given datetimes
+        self.fromTime:typing.Optional[datetime.datetime]=None
+        self.toDatetime:typing.Optional[datetime.datetime]=None
         self.timeFormat="%I:%M%p"
         JsonSerializable.__init__(self,filename,jsonObj)
         Range[datetime.datetime,typing.Union[str,datetime.datetime]]\
@@ -282,67 +477,58 @@ class DateRange(
             else:
                 raise Exception('unknown field "%s"'%k)
 
+    @property
+    def spec(self)->"DateRangeSpec":
+        """
+        the values of this date range as an immutable DateRangeSpec
+
+        (assigning one sets all of the values at once)
+        """
+        return DateRangeSpec(
+            self.month,self.toMonth,
+            self.monthDay,self.toMonthDay,
+            self.weekday,self.toWeekday,
+            self.time,self.toTime)
+    @spec.setter
+    def spec(self,spec:"DateRangeSpec"):
+        self.month=spec.month
+        self.toMonth=spec.toMonth
+        self.monthDay=spec.monthDay
+        self.toMonthDay=spec.toMonthDay
+        self.weekday=spec.weekday
+        self.toWeekday=spec.toWeekday
+        self.time=spec.time
+        self.toTime=spec.toTime
+
     def assign(self,
         dateRange:typing.Union[
-            None,str,"DateRange",
+            None,str,"DateRange","DateRangeSpec",
             datetime.datetime,
             typing.Tuple[datetime.datetime,datetime.datetime]]
         )->None:
         """
         assign the value of this date range
         """
+        self.fromTime=None
+        self.toDatetime=None
         if dateRange is None:
             self.reset()
             return
         if isinstance(dateRange,str):
             self._assignRangeString(dateRange)
             return
+        if isinstance(dateRange,DateRangeSpec):
+            self.spec=dateRange
+            return
         if isinstance(dateRange,datetime.datetime):
             dateRange=(dateRange,dateRange)
         self.reset()
         self.fromTime=dateRange[0]
         self.toTime=dateRange[1]
+        self.toDatetime=dateRange[1]
 
     def _assignRangeString(self,rangestring:str)->None:
-        self.reset()
-        m=self.DECODER.match(rangestring)
-        if m is None:
-            msg=f'ERR: unable to decode date range "{rangestring}"'
-            raise Exception(msg)
-        # decode months
-        month=m.group('month')
-        if month is not None:
-            self.month=MONTHLIST.index(month[0:3].lower())+1
-            monthDay=m.group('monthDay')
-            if monthDay is not None:
-                self.monthDay=int(miscFunctions.numberdecode(monthDay))
-                self.toMonthDay=self.monthDay
-            toMonth=m.group('toMonth')
-            if toMonth is None:
-                self.toMonth=self.month
-            else:
-                self.toMonth=MONTHLIST.index(toMonth[0:3].lower())
-                toMonthDay=m.group('toMonthDay')
-                if toMonthDay is not None:
-                    self.toMonthDay=int(miscFunctions.numberdecode(toMonthDay))
-        # decode days
-        weekday=m.group('weekday')
-        if weekday is not None:
-            self.weekday=WeekdayAbbrs.index(weekday[0:2].lower())
-            toWeekday=m.group('toWeekday')
-            if toWeekday is None:
-                self.toWeekday=self.weekday
-            else:
-                self.toWeekday=WeekdayAbbrs.index(toWeekday[0:2].lower())
-        # decode times
-        time=m.group('time')
-        if time is not None:
-            self.time=time
-            toTime=m.group('toTime')
-            if toTime is None:
-                self.toTime=time
-            else:
-                self.toTime=toTime
+        self.spec=parseDateRangeString(normalizeRangeString(rangestring))
 
     def iterateDays(self)->typing.Generator["DateRange",None,None]:
         """
@@ -389,6 +575,80 @@ class DateRange(
             d=yearAfter(d)
             yield d
 
+    def _bounds(self,
+        start:typing.Optional[datetime.datetime],
+        end:typing.Optional[datetime.datetime]
+        )->typing.Tuple[datetime.datetime,datetime.datetime]:
+        """
+        start and end for the iterate*Bounds() functions,
+        defaulting to the span this range was assigned
+        """
+        if start is None:
+            start=self.fromTime
+        if end is None:
+            end=self.toDatetime
+        if start is None or end is None:
+            raise Exception(
+                'This range was not assigned a span, so give a start and end')
+        return start,end
+    def iterateDayBounds(self,
+        start:typing.Optional[datetime.datetime]=None,
+        end:typing.Optional[datetime.datetime]=None
+        )->typing.Generator[
+            typing.Tuple[datetime.datetime,datetime.datetime],None,None]:
+        """
+        Same as iterateDays(), but yields lightweight (start,end) tuples
+        rather than creating a DateRange for every day
+        """
+        from dateTools.commonDateRanges import iterateDayBounds
+        return iterateDayBounds(*self._bounds(start,end))
+    def iterateWeekBounds(self,
+        start:typing.Optional[datetime.datetime]=None,
+        end:typing.Optional[datetime.datetime]=None
+        )->typing.Generator[
+            typing.Tuple[datetime.datetime,datetime.datetime],None,None]:
+        """
+        Same as iterateWeeks(), but yields lightweight (start,end) tuples
+        rather than creating a DateRange for every week
+        """
+        from dateTools.commonDateRanges import iterateWeekBounds
+        return iterateWeekBounds(*self._bounds(start,end))
+    def iterateMonthBounds(self,
+        start:typing.Optional[datetime.datetime]=None,
+        end:typing.Optional[datetime.datetime]=None
+        )->typing.Generator[
+            typing.Tuple[datetime.datetime,datetime.datetime],None,None]:
+        """
+        Same as iterateMonths(), but yields lightweight (start,end) tuples
+        rather than creating a DateRange for every month
+        """
+        from dateTools.commonDateRanges import iterateMonthBounds
+        return iterateMonthBounds(*self._bounds(start,end))
+    def iterateYearBounds(self,
+        start:typing.Optional[datetime.datetime]=None,
+        end:typing.Optional[datetime.datetime]=None
+        )->typing.Generator[
+            typing.Tuple[datetime.datetime,datetime.datetime],None,None]:
+        """
+        Same as iterateYears(), but yields lightweight (start,end) tuples
+        rather than creating a DateRange for every year
+        """
+        from dateTools.commonDateRanges import iterateYearBounds
+        return iterateYearBounds(*self._bounds(start,end))
+    def boundsArrays(self,
+        unit:str='day',
+        start:typing.Optional[datetime.datetime]=None,
+        end:typing.Optional[datetime.datetime]=None
+        )->typing.Tuple[typing.Any,typing.Any]:
+        """
+        All of the day/week/month/year boundaries in this range at once,
+        as two numpy datetime64 arrays of (starts,ends)
+
+        (requires numpy)
+        """
+        from dateTools.commonDateRanges import boundsArrays
+        return boundsArrays(*self._bounds(start,end),unit)
+
     def next(self,
         afterDate:typing.Optional[datetime.date]=None
         )->datetime.date:
@@ -447,6 +707,59 @@ class DateRange(
         howLong=nextInstance-fromDate
         return miscFunctions.timeDeltaInUnits(howLong,inUnits)
 
+    def weekIntervals(self)->typing.List[typing.Tuple[int,int]]:
+        """
+        The times of the week this range covers, as sorted
+        [start,end) minutes from sunday 12:00AM
+
+        A range whose toTime is before its time runs overnight
+        into the following day, and a single time (eg "at 12:00AM")
+        covers that one minute.
+        """
+        start=self.time.hour*60+self.time.minute
+        end=self.toTime.hour*60+self.toTime.minute
+        if self.toTime.second or self.toTime.microsecond:
+            end+=1 # round up so time.max covers the whole last minute
+        if end==start:
+            end+=1
+        elif end<start:
+            end+=MINUTES_PER_DAY
+        numDays=(self.toWeekday-self.weekday)%7+1
+        ret=[]
+        for day in range(self.weekday,self.weekday+numDays):
+            dayStart=(day%7)*MINUTES_PER_DAY
+            if dayStart+end>MINUTES_PER_WEEK:
+                # wrap past saturday night back around to sunday
+                ret.append((dayStart+start,MINUTES_PER_WEEK))
+                ret.append((0,dayStart+end-MINUTES_PER_WEEK))
+            else:
+                ret.append((dayStart+start,dayStart+end))
+        return coalesceIntervals(ret)
+
+    @property
+    def isAllYear(self)->bool:
+        """
+        Whether this range applies regardless of the month/day
+        """
+        return self.month<=1 and self.monthDay<=1 \
+            and self.toMonth>=12 and self.toMonthDay>=31
+
+    def dayOfYearWindows(self)->typing.List[typing.Tuple[int,int]]:
+        """
+        The days of the year this range covers, as sorted
+        [start,end) dayOfYearIndex() values
+
+        A range that ends before it starts (eg "nov-feb") wraps around
+        the end of the year.
+        """
+        if self.isAllYear:
+            return [(0,DAYS_PER_LEAP_YEAR)]
+        start=dayOfYearIndex(self.month,self.monthDay)
+        end=dayOfYearIndex(self.toMonth,self.toMonthDay)+1
+        if start<end:
+            return [(start,end)]
+        return [(0,end),(start,DAYS_PER_LEAP_YEAR)]
+
     @property
     def weekdayName(self)->str:
         """
@@ -465,13 +778,13 @@ class DateRange(
         """
         name of the from month
         """
-        return self.MONTHLIST[self.month-1]
+        return MonthAbbrs[self.month-1]
     @property
     def toMonthName(self)->str:
         """
         name of the to month
         """
-        return self.MONTHLIST[self.toMonth-1]
+        return MonthAbbrs[self.toMonth-1]
 
     @property
     def text(self)->str:
@@ -518,6 +831,548 @@ class DateRange(
         return self.text
 DatetimeRange=DateRange
 
+
+class DateRangeSpec(typing.NamedTuple):
+    """
+    The immutable result of parsing a DateRange string
+
+    (defaults are the same as DateRange.reset(), that is, every time)
+    """
+    month:int=1
+    toMonth:int=12
+    monthDay:int=1
+    toMonthDay:int=32
+    weekday:int=0
+    toWeekday:int=6
+    time:datetime.time=datetime.time.min
+    toTime:datetime.time=datetime.time.max
+
+
+DATE_RANGE_PARSE_CACHE_SIZE=4096
+
+def normalizeRangeString(rangestring:str)->str:
+    """
+    Tidy up a single range string so that equivalent strings
+    share the same parse cache entry
+    """
+    return ' '.join(rangestring.lower().split())
+
+@functools.lru_cache(maxsize=DATE_RANGE_PARSE_CACHE_SIZE)
+def parseDateRangeString(rangestring:str)->DateRangeSpec:
+    """
+    Parse a single range string like "tue-sat from 1:00 to 5:00PM"
+
+    Results are kept in a process-wide LRU cache shared by everything
+    that creates a DateRange from a string.  See
+    parseDateRangeString.cache_info() for hits/misses and
+    parseDateRangeString.cache_clear() to empty it.
+
+    (pass it through normalizeRangeString() first for better cache hits)
+    """
+    return DateRangeSpec(**parseDateRangeFields(rangestring))
+
+def parseDateRangeStringRegex(rangestring:str)->DateRangeSpec:
+    """
+    Parse a single range string using the DateRange.DECODER regex
+
+    This is the original (slower) way of doing parseDateRangeString()
+    and is kept around for comparison.  It is not cached.
+    """
+    decoder=DateRange.DECODER
+    if decoder is None:
+        decoder=DateRange._CREATE_DECODER()
+    m=decoder.match(rangestring)
+    if m is None:
+        msg=f'ERR: unable to decode date range "{rangestring}"'
+        raise Exception(msg)
+    fields:typing.Dict[str,typing.Any]={}
+    # decode months
+    month=m.group('month')
+    if month is not None:
+        fields['month']=MonthAbbrs.index(month[0:3].lower())+1
+        monthDay=m.group('monthDay')
+        if monthDay is not None and monthDay.strip():
+            fields['monthDay']=int(miscFunctions.numberdecode(monthDay))
+            fields['toMonthDay']=fields['monthDay']
+        toMonth=m.group('toMonth')
+        if toMonth is None:
+            fields['toMonth']=fields['month']
+        else:
+            fields['toMonth']=MonthAbbrs.index(toMonth[0:3].lower())+1
+            toMonthDay=m.group('toMonthDay')
+            if toMonthDay is not None and toMonthDay.strip():
+                fields['toMonthDay']=int(
+                    miscFunctions.numberdecode(toMonthDay))
+    # decode days
+    weekday=m.group('weekday')
+    if weekday is not None:
+        fields['weekday']=WeekdayAbbrs.index(weekday[0:2].lower())
+        toWeekday=m.group('toWeekday')
+        if toWeekday is None:
+            fields['toWeekday']=fields['weekday']
+        else:
+            fields['toWeekday']=WeekdayAbbrs.index(toWeekday[0:2].lower())
+    # decode times
+    time=m.group('time')
+    if time is not None:
+        fields['time']=miscFunctions.toTime(time)
+        toTime=m.group('toTime')
+        if toTime is None:
+            fields['toTime']=fields['time']
+        else:
+            fields['toTime']=miscFunctions.toTime(toTime)
+    return DateRangeSpec(**fields)
+
+def _minuteToTime(minute:int)->datetime.time:
+    """
+    minute of the day to a time, where the end of the day is time.max
+    """
+    if minute>=MINUTES_PER_DAY:
+        return datetime.time.max
+    return datetime.time(minute//60,minute%60)
+
+def _splitDays(
+    start:int,
+    end:int
+    )->typing.Generator[
+        typing.Tuple[int,int,datetime.time,datetime.time],None,None]:
+    """
+    Split a [start,end) minute-of-week interval into
+    (weekday,toWeekday,time,toTime) pieces that each fit within a day
+    """
+    firstDay=start//MINUTES_PER_DAY
+    lastDay=(end-1)//MINUTES_PER_DAY
+    startMinute=start-firstDay*MINUTES_PER_DAY
+    endMinute=end-lastDay*MINUTES_PER_DAY
+    if firstDay==lastDay:
+        yield (firstDay,firstDay,
+            _minuteToTime(startMinute),_minuteToTime(endMinute))
+        return
+    if startMinute>0:
+        yield (firstDay,firstDay,
+            _minuteToTime(startMinute),datetime.time.max)
+        firstDay+=1
+    if endMinute<MINUTES_PER_DAY:
+        lastPiece=(lastDay,lastDay,datetime.time.min,_minuteToTime(endMinute))
+        lastDay-=1
+    else:
+        lastPiece=None
+    if firstDay<=lastDay:
+        yield (firstDay,lastDay,datetime.time.min,datetime.time.max)
+    if lastPiece is not None:
+        yield lastPiece
+
+
+class CompiledDateRanges:
+    """
+    A set of DateRange objects compiled down to sorted, coalesced
+    [start,end) minute-of-week intervals, so that finding the next
+    occourance is a bisect rather than walking every range day-by-day.
+
+    The year is split into segments of days (by dayOfYearIndex())
+    and each segment has its own set of weekly intervals.
+    Ranges that apply all year round share a single segment.
+    """
+
+    def __init__(self,dateRanges:typing.Iterable[DateRange]=()):
+        """ """
+        self.dayBounds:typing.Tuple[int,...]=(0,)
+        self.starts:typing.Tuple[typing.Tuple[int,...],...]=((),)
+        self.ends:typing.Tuple[typing.Tuple[int,...],...]=((),)
+        self.assign(dateRanges)
+
+    def assign(self,dateRanges:typing.Iterable[DateRange])->None:
+        """
+        compile a series of DateRange objects
+        """
+        pieces=[(dr.dayOfYearWindows(),dr.weekIntervals())
+            for dr in dateRanges]
+        bounds={0}
+        for windows,_ in pieces:
+            for start,end in windows:
+                bounds.add(start)
+                bounds.add(end)
+        bounds.discard(DAYS_PER_LEAP_YEAR)
+        dayBounds=sorted(bounds)
+        segments=[]
+        for segmentStart in dayBounds:
+            intervals=[]
+            for windows,weekIntervals in pieces:
+                for start,end in windows:
+                    if start<=segmentStart<end:
+                        intervals.extend(weekIntervals)
+                        break
+            segments.append(coalesceIntervals(intervals))
+        self._assignSegments(dayBounds,segments)
+
+    def _assignSegments(self,
+        dayBounds:typing.Sequence[int],
+        segments:typing.Sequence[typing.Sequence[typing.Tuple[int,int]]]
+        )->None:
+        """
+        assign already-coalesced segments, merging neighbors that are the same
+        """
+        mergedBounds:typing.List[int]=[]
+        mergedSegments:typing.List[typing.Tuple[typing.Tuple[int,int],...]]=[]
+        for segmentStart,segment in zip(dayBounds,segments):
+            segment=tuple(segment)
+            if mergedSegments and mergedSegments[-1]==segment:
+                continue
+            mergedBounds.append(segmentStart)
+            mergedSegments.append(segment)
+        self.dayBounds=tuple(mergedBounds)
+        self.starts=tuple(tuple(s for s,_ in seg) for seg in mergedSegments)
+        self.ends=tuple(tuple(e for _,e in seg) for seg in mergedSegments)
+
+    @property
+    def empty(self)->bool:
+        """
+        True if this never occours at all
+        """
+        return not any(self.starts)
+
+    def _segment(self,when:datetime.datetime)->int:
+        """
+        index of the segment of the year containing the given time
+        """
+        index=dayOfYearIndex(when.month,when.day)
+        return bisect.bisect_right(self.dayBounds,index)-1
+
+    def _segmentEnd(self,
+        segment:int,
+        when:datetime.datetime
+        )->datetime.datetime:
+        """
+        12:00AM on the day after the given segment ends
+        (in the same year as the given time)
+        """
+        if segment+1<len(self.dayBounds):
+            index=self.dayBounds[segment+1]
+        else:
+            index=DAYS_PER_LEAP_YEAR
+        day=dayOfYearIndexToDate(when.year,index)
+        return datetime.datetime.combine(day,datetime.time.min,when.tzinfo)
+
+    def contains(self,when:datetime.datetime)->bool:
+        """
+        Determine whether the given time is within these ranges
+        """
+        segment=self._segment(when)
+        minute=minuteOfWeek(when)
+        i=bisect.bisect_right(self.starts[segment],minute)-1
+        return i>=0 and minute<self.ends[segment][i]
+    __contains__=contains
+
+    def mask(self,timestamps:typing.Any)->typing.Any:
+        """
+        Vectorized contains() for a whole array of times at once
+
+        (requires numpy)
+
+        :property timestamps: anything numpy can turn into a datetime64 array
+            (times are taken as-is, in whatever timezone they are in)
+
+        returns a boolean numpy array of the same shape, where NaT is False
+        """
+        import numpy as np
+        minutes=np.asarray(timestamps,dtype='datetime64[m]')
+        days=minutes.astype('datetime64[D]')
+        months=days.astype('datetime64[M]')
+        dayNumber=days.astype(np.int64)
+        # 1970-01-01 was a thursday (4 counting from sunday=0)
+        weekday=(dayNumber+4)%7
+        minuteOfDay=(minutes-days).astype(np.int64)
+        month=months.astype(np.int64)%12
+        monthDay=(days-months).astype(np.int64)
+        dayIndex=np.asarray(LEAP_MONTH_STARTS,dtype=np.int64)[month]+monthDay
+        weekMinute=weekday*MINUTES_PER_DAY+minuteOfDay
+        ret=np.zeros(minutes.shape,dtype=bool)
+        segments=np.searchsorted(self.dayBounds,dayIndex,side='right')-1
+        for segment,starts in enumerate(self.starts):
+            if not starts:
+                continue
+            if len(self.dayBounds)>1:
+                inSegment=segments==segment
+                segmentMinutes=weekMinute[inSegment]
+            else:
+                inSegment=Ellipsis
+                segmentMinutes=weekMinute
+            i=np.searchsorted(starts,segmentMinutes,side='right')-1
+            ends=np.asarray(self.ends[segment],dtype=np.int64)
+            ret[inSegment]=(i>=0)&(segmentMinutes<ends[np.maximum(i,0)])
+        ret&=~np.isnat(minutes)
+        return ret
+
+    def next(self,
+        fromDate:typing.Optional[datetime.datetime]=None
+        )->typing.Optional[datetime.datetime]:
+        """
+        next occourance from the given date
+
+        :property fromDate: if None, use now()
+
+        returns a datetime object or None if this never occours
+        """
+        if fromDate is None:
+            fromDate=datetime.datetime.now()
+        if self.empty:
+            return None
+        when=fromDate
+        # a segment may only match on certian weekdays, which can take
+        # up to one full 28 year cycle of the calendar to come around
+        for _ in range(29*(len(self.dayBounds)+1)):
+            segment=self._segment(when)
+            segmentEnd=self._segmentEnd(segment,when)
+            starts=self.starts[segment]
+            if starts:
+                minute=minuteOfWeek(when)
+                i=bisect.bisect_right(starts,minute)-1
+                if i>=0 and minute<self.ends[segment][i]:
+                    return when
+                if i+1<len(starts):
+                    offset=starts[i+1]
+                else:
+                    offset=starts[0]+MINUTES_PER_WEEK
+                found=startOfWeek(when)+datetime.timedelta(minutes=offset)
+                if found<segmentEnd:
+                    return found
+            when=segmentEnd
+        return None
+
+    def _intervalsBetween(self,
+        start:datetime.datetime,
+        end:datetime.datetime
+        )->typing.Generator[
+            typing.Tuple[datetime.datetime,datetime.datetime],None,None]:
+        """
+        every interval between start and end, clipped to them and in order,
+        but not merged where intervals meet at week or segment boundaries
+        """
+        when=start
+        while when<end:
+            segment=self._segment(when)
+            segmentEnd=min(self._segmentEnd(segment,when),end)
+            starts=self.starts[segment]
+            ends=self.ends[segment]
+            weekStart=startOfWeek(when)
+            # skip intervals of the first week that are already over
+            i=bisect.bisect_right(ends,minuteOfWeek(when))
+            while starts and weekStart<segmentEnd:
+                while i<len(starts):
+                    offset=datetime.timedelta(minutes=starts[i])
+                    intervalStart=weekStart+offset
+                    if intervalStart>=segmentEnd:
+                        break
+                    offset=datetime.timedelta(minutes=ends[i])
+                    intervalEnd=weekStart+offset
+                    yield (max(intervalStart,when),min(intervalEnd,segmentEnd))
+                    i+=1
+                weekStart+=datetime.timedelta(days=7)
+                i=0
+            when=segmentEnd
+
+    def occurrences(self,
+        start:typing.Optional[datetime.datetime],
+        end:datetime.datetime
+        )->typing.Generator[
+            typing.Tuple[datetime.datetime,datetime.datetime],None,None]:
+        """
+        Yield every (start,end) time that these ranges cover
+        between the given times, in order
+
+        Overlapping or touching intervals are merged as they go, so
+        eg "sat 10:00PM-2:00AM" comes out as one interval rather than
+        two split at midnight.  Only one interval is held at a time,
+        so this is fine to use on windows of many years.
+
+        :property start: if None, use now()
+            (an occourance already under way is clipped to start at this)
+        :property end: stop here (an occourance still going is clipped
+            to end at this)
+        """
+        if start is None:
+            start=datetime.datetime.now()
+        pending:typing.Optional[
+            typing.Tuple[datetime.datetime,datetime.datetime]]=None
+        for interval in self._intervalsBetween(start,end):
+            if pending is None:
+                pending=interval
+            elif interval[0]<=pending[1]:
+                if interval[1]>pending[1]:
+                    pending=(pending[0],interval[1])
+            else:
+                yield pending
+                pending=interval
+        if pending is not None:
+            yield pending
+
+    def nextMany(self,
+        fromDates:typing.Iterable[datetime.datetime]
+        )->typing.List[typing.Optional[datetime.datetime]]:
+        """
+        next() for each of a whole batch of times
+
+        The times are visited in sorted order with a single cursor moving
+        forward through occurrences(), so a batch costs about
+        O(n + intervals) rather than n separate next() lookups.
+        (If they are not already sorted, they are sorted first.)
+
+        :property fromDates: datetimes, or a numpy datetime64 array
+            (None or NaT entries are allowed)
+
+        returns a list of the next occourance for each time, in the
+        same order, where any that never occour, or are None or NaT,
+        are None
+        """
+        if hasattr(fromDates,'dtype'):
+            # (numpy NaT comes out as None)
+            fromDates=typing.cast(typing.Any,fromDates).astype(
+                'datetime64[us]').tolist()
+        fromDates=list(fromDates)
+        ret:typing.List[typing.Optional[datetime.datetime]]=\
+            [None]*len(fromDates)
+        if self.empty:
+            return ret
+        # leave out None and NaT (which is not even equal to itself,
+        # and cannot be compared or sorted)
+        order=[i for i,when in enumerate(fromDates)
+            if when is not None and when==when] # noqa: E501 # pylint: disable=comparison-with-itself,line-too-long
+        if not order:
+            return ret
+        if any(fromDates[order[i]]<fromDates[order[i-1]]
+            for i in range(1,len(order))):
+            order.sort(key=fromDates.__getitem__)
+        first=fromDates[order[0]]
+        last=fromDates[order[-1]]
+        # next() may have to look up to a 28 year calendar cycle ahead
+        try:
+            end=last+datetime.timedelta(days=366*29)
+        except OverflowError:
+            end=datetime.datetime.max.replace(year=9998,tzinfo=last.tzinfo)
+        occurrences=self.occurrences(first,end)
+        current=next(occurrences,None)
+        for i in order:
+            when=fromDates[i]
+            while current is not None and current[1]<=when:
+                current=next(occurrences,None)
+            if current is None:
+                break
+            ret[i]=max(current[0],when)
+        return ret
+
+    def segmentIntervals(self,
+        segment:int
+        )->typing.List[typing.Tuple[int,int]]:
+        """
+        the (start,end) minute-of-week intervals for a segment of the year
+        """
+        return list(zip(self.starts[segment],self.ends[segment]))
+
+    def combine(self,
+        other:"CompiledDateRanges",
+        op:typing.Callable[[bool,bool],bool]
+        )->"CompiledDateRanges":
+        """
+        Combine with another set of compiled ranges, segment by segment
+
+        :op: given (inSelf,inOther) for a time, whether the result includes it
+            (see combineIntervals())
+        """
+        dayBounds=sorted(set(self.dayBounds)|set(other.dayBounds))
+        segments=[]
+        for segmentStart in dayBounds:
+            a=bisect.bisect_right(self.dayBounds,segmentStart)-1
+            b=bisect.bisect_right(other.dayBounds,segmentStart)-1
+            segments.append(combineIntervals(
+                self.segmentIntervals(a),other.segmentIntervals(b),op))
+        ret=CompiledDateRanges()
+        ret._assignSegments(dayBounds,segments)
+        return ret
+
+    def union(self,other:"CompiledDateRanges")->"CompiledDateRanges":
+        """
+        times in either set of ranges
+        """
+        return self.combine(other,lambda inA,inB:inA or inB)
+
+    def intersection(self,other:"CompiledDateRanges")->"CompiledDateRanges":
+        """
+        times in both sets of ranges
+        """
+        return self.combine(other,lambda inA,inB:inA and inB)
+
+    def difference(self,other:"CompiledDateRanges")->"CompiledDateRanges":
+        """
+        times in this set of ranges, but not the other
+        """
+        return self.combine(other,lambda inA,inB:inA and not inB)
+
+    def complement(self)->"CompiledDateRanges":
+        """
+        every time not in this set of ranges
+        """
+        everything=CompiledDateRanges()
+        everything._assignSegments((0,),(((0,MINUTES_PER_WEEK),),))
+        return everything.difference(self)
+
+    def __eq__(self,other:typing.Any)->bool:
+        if not isinstance(other,CompiledDateRanges):
+            return False
+        return self.dayBounds==other.dayBounds \
+            and self.starts==other.starts and self.ends==other.ends
+
+    def toSpecs(self)->typing.List[DateRangeSpec]:
+        """
+        Turn these back into DateRangeSpec values that compile
+        to exactly the same thing
+
+        An interval that runs over more than one day is split at
+        midnight, with any whole days in the middle as one weekday range.
+        """
+        ret=[]
+        for i,segmentStart in enumerate(self.dayBounds):
+            if i+1<len(self.dayBounds):
+                segmentEnd=self.dayBounds[i+1]
+            else:
+                segmentEnd=DAYS_PER_LEAP_YEAR
+            if segmentStart==0 and segmentEnd==DAYS_PER_LEAP_YEAR:
+                calendarFields={}
+            else:
+                first=dayOfYearIndexToDate(2000,segmentStart) # a leap year
+                last=dayOfYearIndexToDate(2000,segmentEnd-1)
+                calendarFields={
+                    'month':first.month,'monthDay':first.day,
+                    'toMonth':last.month,'toMonthDay':last.day}
+            for start,end in self.segmentIntervals(i):
+                for weekday,toWeekday,time,toTime in _splitDays(start,end):
+                    ret.append(DateRangeSpec(
+                        weekday=weekday,toWeekday=toWeekday,
+                        time=time,toTime=toTime,**calendarFields))
+        return ret
+
+    def __repr__(self)->str:
+        ret=[]
+        for i,segmentStart in enumerate(self.dayBounds):
+            intervals=','.join(f'{s}-{e}'
+                for s,e in zip(self.starts[i],self.ends[i]))
+            ret.append(f'{segmentStart}:[{intervals}]')
+        return ' '.join(ret)
+
+
+DateRangesCompatible=typing.Union[
+    str,datetime.datetime,DateRange,"DateRanges",
+    typing.Iterable[typing.Union[str,datetime.datetime,DateRange]]]
+def asDateRanges(dateRanges:DateRangesCompatible)->"DateRanges":
+    """
+    Always return a DateRanges object. If it is one,
+    return as-is. If not, create one on-the-fly.
+    """
+    if isinstance(dateRanges,DateRanges):
+        return dateRanges
+    ret=DateRanges()
+    ret.assign(dateRanges)
+    return ret
+
 class DateRanges(JsonSerializable,Ranges):
     """
     A set of date range objects.
@@ -533,6 +1388,7 @@ class DateRanges(JsonSerializable,Ranges):
         jsonObj:typing.Union[None,str,typing.Dict[str,typing.Any]]=None):
         """ """
         self.dateRanges:typing.List[DateRange]=[]
+        self._compiled:typing.Optional[CompiledDateRanges]=None
         Ranges.__init__(self)
         JsonSerializable.__init__(self,filename,jsonObj)
         if rangestring:
@@ -553,6 +1409,36 @@ class DateRanges(JsonSerializable,Ranges):
         if isinstance(jsonObj,str):
             self.assign(jsonObj)
         self.dateRanges=[DateRange(jsonObj=o) for o in jsonObj] # type: ignore
+        self._compiled=None
+
+    @classmethod
+    def fromCompiled(cls,compiled:CompiledDateRanges)->"DateRanges":
+        """
+        Create a DateRanges from already-compiled ranges
+        """
+        ret=cls()
+        ret.dateRanges=[DateRange(spec) for spec in compiled.toSpecs()]
+        ret._compiled=compiled
+        return ret
+
+    @property
+    def compiled(self)->CompiledDateRanges:
+        """
+        these ranges compiled into minute-of-week intervals
+        (rebuilt automatically whenever the ranges change)
+        """
+        if self._compiled is None:
+            self._compiled=CompiledDateRanges(self.dateRanges)
+        return self._compiled
+
+    def compile(self)->CompiledDateRanges:
+        """
+        (re)compile these ranges into minute-of-week intervals
+
+        Call this if you change any of the self.dateRanges directly.
+        """
+        self._compiled=None
+        return self.compiled
 
     def assign(self,
         ranges:typing.Union[
@@ -565,6 +1451,7 @@ class DateRanges(JsonSerializable,Ranges):
         """
         self.dateRanges=[]
         self.append(ranges)
+        self.compile()
 
     def append(self, # type: ignore
         ranges:typing.Union[
@@ -576,12 +1463,19 @@ class DateRanges(JsonSerializable,Ranges):
         add more values of these date ranges
         """
         if isinstance(ranges,str):
-            self.dateRanges.extend([DateRange(dr) for dr in ranges.split(',')])
+            self.dateRanges.extend([
+                DateRange(parseDateRangeString(normalizeRangeString(dr)))
+                for dr in ranges.split(',')])
         elif isinstance(ranges,datetime.datetime):
             self.dateRanges.append(DateRange(ranges))
+        elif isinstance(ranges,DateRange):
+            self.dateRanges.append(ranges)
+        elif isinstance(ranges,DateRanges):
+            self.dateRanges.extend(ranges.dateRanges)
         else:
             for moreRanges in ranges:
                 self.append(moreRanges)
+        self._compiled=None
     add=append
     extend=append
 
@@ -616,14 +1510,93 @@ class DateRanges(JsonSerializable,Ranges):
 
         returns a datetime object or None
         """
-        if fromDate is None:
-            fromDate=datetime.datetime.now()
-        smallest=None
-        for dr in self.dateRanges:
-            nocc=dr.next(fromDate)
-            if smallest is None or nocc<smallest:
-                smallest=nocc
-        return smallest
+        return self.compiled.next(fromDate)
+
+    def contains(self,when:typing.Optional[datetime.datetime]=None)->bool:
+        """
+        Determine whether a time is within these date ranges
+
+        :property when: if None, use now()
+        """
+        if when is None:
+            when=datetime.datetime.now()
+        return self.compiled.contains(when)
+    __contains__=contains
+
+    def mask(self,timestamps:typing.Any)->typing.Any:
+        """
+        Determine whether each of a whole array of times is within
+        these date ranges, all at once
+
+        (requires numpy)
+
+        :property timestamps: anything numpy can turn into a datetime64 array
+
+        returns a boolean numpy array of the same shape
+        """
+        return self.compiled.mask(timestamps)
+
+    def nextMany(self,
+        fromDates:typing.Iterable[datetime.datetime]
+        )->typing.List[typing.Optional[datetime.datetime]]:
+        """
+        next occourance for each of a whole batch of times
+
+        This is much faster than calling next() for each one,
+        especially when they are in sorted order.
+
+        :property fromDates: datetimes, or a numpy datetime64 array
+
+        returns a list of datetime objects (or None), in the same order
+        """
+        return self.compiled.nextMany(fromDates)
+
+    def union(self,other:DateRangesCompatible)->"DateRanges":
+        """
+        a new DateRanges of times in either these or the other ranges
+        """
+        other=asDateRanges(other)
+        return DateRanges.fromCompiled(self.compiled.union(other.compiled))
+    __or__=union
+
+    def intersection(self,other:DateRangesCompatible)->"DateRanges":
+        """
+        a new DateRanges of times in both these and the other ranges
+        """
+        other=asDateRanges(other)
+        return DateRanges.fromCompiled(
+            self.compiled.intersection(other.compiled))
+    __and__=intersection
+
+    def difference(self,other:DateRangesCompatible)->"DateRanges":
+        """
+        a new DateRanges of times in these ranges but not the other ranges
+        """
+        other=asDateRanges(other)
+        return DateRanges.fromCompiled(
+            self.compiled.difference(other.compiled))
+    __sub__=difference
+
+    def complement(self)->"DateRanges":
+        """
+        a new DateRanges of every time not in these ranges
+        """
+        return DateRanges.fromCompiled(self.compiled.complement())
+    __invert__=complement
+
+    def occurrences(self,
+        start:typing.Optional[datetime.datetime],
+        end:datetime.datetime
+        )->typing.Generator[
+            typing.Tuple[datetime.datetime,datetime.datetime],None,None]:
+        """
+        Yield every (start,end) time that these date ranges cover
+        between the given times, in order, with overlaps merged
+
+        :property start: if None, use now()
+        :property end: stop here
+        """
+        return self.compiled.occurrences(start,end)
 
     @property
     def text(self)->str:
@@ -643,6 +1616,190 @@ class DateRanges(JsonSerializable,Ranges):
         return self.text
 
 
+def benchmarkComparableDatetime(count:int=100000)->typing.Dict[str,float]:
+    """
+    Micro-benchmark of ComparableDatetime comparison throughput
+
+    returns comparisons per second when sorting and bisecting
+    a list of count random times
+    """
+    import random
+    import timeit
+    items=[ComparableDatetime(random.uniform(0,2e9)) for _ in range(count)]
+    comparisons=0
+    class Counted(ComparableDatetime):
+        __slots__=()
+        def __lt__(self,other:typing.Any)->bool:
+            nonlocal comparisons
+            comparisons+=1
+            return ComparableDatetime.__lt__(self,other)
+    counted=[Counted(item) for item in items]
+    sorted(counted)
+    sortComparisons=comparisons
+    sortTime=timeit.timeit(lambda:sorted(items),number=1)
+    items.sort()
+    probes=[ComparableDatetime(random.uniform(0,2e9)) for _ in range(count)]
+    def bisectAll():
+        for probe in probes:
+            bisect.bisect_left(items,probe)
+    bisectComparisons=count*max(1,count.bit_length())
+    bisectTime=timeit.timeit(bisectAll,number=1)
+    return {
+        'sortComparisonsPerSecond':sortComparisons/sortTime,
+        'bisectComparisonsPerSecond':bisectComparisons/bisectTime}
+
+
+STREAM_BLOCK_LINES=65536
+STREAM_CHUNK_BYTES=16*1024*1024
+
+@functools.lru_cache(maxsize=1024)
+def _compiledForStream(rangestring:str)->CompiledDateRanges:
+    """
+    compiled ranges for each schedule seen while streaming
+    """
+    return DateRanges(rangestring).compiled
+
+def _parseStreamTimestamp(text:str)->datetime.datetime:
+    """
+    a timestamp in iso format, or as a unix time number
+    """
+    try:
+        return datetime.datetime.fromisoformat(text)
+    except ValueError:
+        return datetime.datetime.fromtimestamp(float(text))
+
+def _formatStreamResult(result:typing.Any)->str:
+    """
+    a stream result as output text
+    """
+    if isinstance(result,datetime.datetime):
+        return result.isoformat(sep=' ')
+    return str(result)
+
+def streamBlock(
+    lines:typing.Sequence[str],
+    rangestring:typing.Optional[str]=None,
+    op:str='next'
+    )->str:
+    """
+    Evaluate a block of input lines for streaming, and return the output
+    text for all of them
+
+    Each output line is the input line, a tab, and the result.
+
+    :lines: each line is a timestamp, or if rangestring is None,
+        a schedule and a timestamp separated by a tab
+    :op: 'next' for the next occourance or 'contains' for whether
+        the timestamp is within the schedule
+    """
+    results:typing.List[typing.Any]=[None]*len(lines)
+    lines=[line.rstrip('\r\n') for line in lines]
+    # (schedule,timezone aware) -> (line indices,times)
+    # (aware and naive times cannot be compared, so they are kept apart)
+    batch:typing.Dict[typing.Tuple[str,bool],typing.Tuple[typing.List[int],typing.List[datetime.datetime]]]={} # noqa: E501 # pylint: disable=line-too-long
+    for i,line in enumerate(lines):
+        try:
+            if rangestring is None:
+                schedule,timestamp=line.rsplit('\t',1)
+            else:
+                schedule,timestamp=rangestring,line
+            when=_parseStreamTimestamp(timestamp.strip())
+        except (ValueError,OverflowError,OSError) as e:
+            # (a unix time out of range is an OverflowError or OSError)
+            results[i]=f'ERR: {e}'
+            continue
+        indices,times=batch.setdefault(
+            (schedule,when.tzinfo is not None),([],[]))
+        indices.append(i)
+        times.append(when)
+    for (schedule,_),(indices,times) in batch.items():
+        compiled=_compiledForStream(schedule)
+        if op=='next':
+            found:typing.Iterable[typing.Any]=compiled.nextMany(times)
+        elif op=='contains':
+            found=[compiled.contains(when) for when in times]
+        else:
+            raise Exception(f'Unknown operation "{op}"')
+        for i,result in zip(indices,found):
+            results[i]=result
+    return ''.join(f'{line}\t{_formatStreamResult(result)}\n'
+        for line,result in zip(lines,results))
+
+def _streamFileChunk(
+    filename:str,
+    start:int,
+    end:int,
+    rangestring:typing.Optional[str],
+    op:str
+    )->str:
+    """
+    streamBlock() for the lines of a file that start between
+    byte offsets start and end (used by worker processes)
+    """
+    with open(filename,'rb') as f:
+        f.seek(start)
+        if start>0:
+            f.seek(start-1)
+            f.readline() # finish the line that started before this chunk
+        data=[]
+        while f.tell()<end:
+            line=f.readline()
+            if not line:
+                break
+            data.append(line.decode('utf-8'))
+    return streamBlock(data,rangestring,op)
+
+def streamDateRanges(
+    infile:typing.Union[str,typing.TextIO],
+    outfile:typing.TextIO,
+    rangestring:typing.Optional[str]=None,
+    op:str='next',
+    jobs:int=1
+    )->None:
+    """
+    Stream timestamps (or schedule/timestamp pairs) through date ranges
+    line by line, writing the results in large blocks
+
+    :infile: a filename, or an open text file (such as stdin)
+    :rangestring: the schedule to use for every line.  If None,
+        each line is a schedule and a timestamp separated by a tab.
+    :op: 'next' or 'contains'
+    :jobs: split a file across this many worker processes
+        (only applies when infile is a filename)
+    """
+    if isinstance(infile,str) and jobs>1:
+        import os
+        import concurrent.futures
+        size=os.path.getsize(infile)
+        offsets=list(range(0,size,STREAM_CHUNK_BYTES))+[size]
+        with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+            pending:typing.List[concurrent.futures.Future]=[]
+            for start,end in zip(offsets[:-1],offsets[1:]):
+                pending.append(pool.submit(
+                    _streamFileChunk,infile,start,end,rangestring,op))
+                if len(pending)>=2*jobs:
+                    outfile.write(pending.pop(0).result())
+                    outfile.flush()
+            for future in pending:
+                outfile.write(future.result())
+                outfile.flush()
+        return
+    if isinstance(infile,str):
+        with open(infile,'r',encoding='utf-8') as f:
+            streamDateRanges(f,outfile,rangestring,op)
+        return
+    block:typing.List[str]=[]
+    for line in infile:
+        block.append(line)
+        if len(block)>=STREAM_BLOCK_LINES:
+            outfile.write(streamBlock(block,rangestring,op))
+            outfile.flush()
+            block=[]
+    if block:
+        outfile.write(streamBlock(block,rangestring,op))
+        outfile.flush()
+
+
 def cmdline(args:typing.Iterable[str])->int:
     """
     Run the command line
@@ -654,24 +1811,58 @@ def cmdline(args:typing.Iterable[str])->int:
         printhelp=True
     else:
         dr=None
+        rangestring=None
+        stream=None
+        op='next'
+        jobs=1
         for arg in args:
             if arg.startswith('-'):
                 arg=[a.strip() for a in arg.split('=',1)]
                 if arg[0] in ['-h','--help']:
                     printhelp=True
+                elif arg[0]=='--stream':
+                    stream=arg[1] if len(arg)>1 else '-'
+                elif arg[0]=='--op':
+                    op=arg[1]
+                elif arg[0]=='--jobs':
+                    jobs=int(arg[1])
                 elif arg[0]=='--next':
                     print(dr.next())
                 elif arg[0]=='--json':
                     print(dr.json)
+                elif arg[0]=='--benchmark':
+                    for k,v in benchmarkComparableDatetime().items():
+                        print(f'{k}: {v:,.0f}')
                 else:
                     print('ERR: unknown argument "'+arg[0]+'"')
             else:
+                rangestring=arg
                 dr=DateRanges(arg)
+        if stream is not None:
+            import sys
+            if stream=='-':
+                if jobs!=1:
+                    # stdin can only be read by this one process
+                    print('ERR: --jobs needs a --stream file, not stdin')
+                else:
+                    streamDateRanges(sys.stdin,sys.stdout,rangestring,op)
+            else:
+                streamDateRanges(stream,sys.stdout,rangestring,op,jobs)
     if printhelp:
         print('Usage:')
-        print('  dateRanges.py dateranges [options]')
+        print('  dateRanges.py [dateranges] [options]')
         print('Options:')
         print('   --next ........... get next occourance of the date ranges')
+        print('   --json ........... print the date ranges as json')
+        print('   --benchmark ...... time ComparableDatetime comparisons')
+        print('   --stream[=file] .. read a timestamp per line from the file')
+        print('                      (or stdin) and write each with a result.')
+        print('                      Without dateranges, each line is instead')
+        print('                      dateranges<tab>timestamp')
+        print('   --op=next ........ stream the next occourance (default)')
+        print('   --op=contains .... stream whether it is in the date ranges')
+        print('   --jobs=N ......... split a --stream file across N processes')
+        print('                      (not allowed when streaming stdin)')
 
 
 if __name__=='__main__':
@@ -0,0 +1,339 @@
+#!/usr/bin/env
+# -*- coding: utf-8 -*-
+"""
+Index a large number of named DateRanges in order to quickly answer
+"which of them are active at this time?"
+"""
+import typing
+import datetime
+import calendar
+import bisect
+from dateTools.dateRanges import (
+    DateRangesCompatible,asDateRanges,CompiledDateRanges,
+    MINUTES_PER_DAY,MINUTES_PER_WEEK,DAYS_PER_LEAP_YEAR,dayOfYearIndex,
+    minuteOfWeek)
+
+
+DayWindows=typing.Tuple[typing.Tuple[int,int],...]
+Change=typing.Tuple[datetime.datetime,str,bool] # (when,name,isActive)
+
+ONE_MICROSECOND=datetime.timedelta(microseconds=1)
+# feb 29 of a leap year (see dayOfYearIndex())
+LEAP_DAY_INDEX=dayOfYearIndex(2,29)
+# the fewest changes between the full copies an _ActiveTable keeps
+MIN_CHECKPOINT_CHANGES=64
+
+
+class _ActiveTable:
+    """
+    Which names are active at each minute of the week, for names that
+    each have a set of [start,end) minute-of-week intervals
+
+    This keeps the names that start and stop at each boundary, plus a
+    full copy of the active names whenever at least that many changes
+    have gone by since the last copy.  So a lookup costs about the size
+    of its result, and the copies take no more room than the changes do.
+    """
+
+    def __init__(self,
+        intervals:typing.Iterable[
+            typing.Tuple[str,typing.Sequence[typing.Tuple[int,int]]]]):
+        """ """
+        starting:typing.Dict[int,typing.List[str]]={}
+        stopping:typing.Dict[int,typing.List[str]]={}
+        for name,pairs in intervals:
+            for start,end in pairs:
+                starting.setdefault(start,[]).append(name)
+                stopping.setdefault(end,[]).append(name)
+        self.minutes:typing.List[int]=sorted(set(starting)|set(stopping))
+        self.starting=[tuple(starting.get(m,())) for m in self.minutes]
+        self.stopping=[tuple(stopping.get(m,())) for m in self.minutes]
+        # boundary index -> the names active from it
+        self.checkpoints:typing.List[int]=[]
+        self.checkpointNames:typing.List[typing.FrozenSet[str]]=[]
+        active:typing.Set[str]=set()
+        changes=0
+        for i in range(len(self.minutes)):
+            active.difference_update(self.stopping[i])
+            active.update(self.starting[i])
+            changes+=len(self.starting[i])+len(self.stopping[i])
+            if i==0 or changes>=max(len(active),MIN_CHECKPOINT_CHANGES):
+                self.checkpoints.append(i)
+                self.checkpointNames.append(frozenset(active))
+                changes=0
+
+    def activeAt(self,minute:int)->typing.Set[str]:
+        """
+        the names active at a minute of the week
+        """
+        i=bisect.bisect_right(self.minutes,minute)-1
+        if i<0:
+            return set()
+        checkpoint=bisect.bisect_right(self.checkpoints,i)-1
+        active=set(self.checkpointNames[checkpoint])
+        for j in range(self.checkpoints[checkpoint]+1,i+1):
+            active.difference_update(self.stopping[j])
+            active.update(self.starting[j])
+        return active
+
+
+class DateRangesIndex:
+    """
+    Index a large number of named DateRanges in order to quickly answer
+    "which of them are active at this time?"
+
+    Every place where any schedule may start or stop is indexed by
+    minute-of-week, and every place where one changes over from one part
+    of the year to another is indexed by day-of-year.  That way, looking
+    for changes only ever has to visit the schedules that actually change.
+
+    activeAt() looks the time up in a table of which schedules are
+    active at each minute of the week, with one table for the schedules
+    that are the same all year, and one for each part of the year of the
+    rest.  These are built the first time they are needed, which costs
+    about as much as checking every schedule once.  After that, a lookup
+    costs about the size of its result.  Lookups do not change the
+    index, so several threads can look things up at once (but not while
+    schedules are being added or removed).
+    """
+
+    def __init__(self,
+        schedules:typing.Union[
+            None,typing.Dict[str,DateRangesCompatible],
+            typing.Iterable[typing.Tuple[str,DateRangesCompatible]]]=None):
+        """ """
+        self._schedules:typing.Dict[str,CompiledDateRanges]={}
+        # minute of week -> {name:day windows where it changes then}
+        self._minuteEvents:typing.Dict[int,typing.Dict[str,DayWindows]]={}
+        self._eventMinutes:typing.List[int]=[]
+        # day of year index -> names that change over to a new part of year
+        self._dayEvents:typing.Dict[int,typing.Set[str]]={}
+        # activeAt() tables (built when first needed) for the schedules
+        # that are the same all year, and for each part of the year of
+        # the ones that are not
+        self._yearRoundTable:typing.Optional[_ActiveTable]=None
+        self._seasonalBounds:typing.List[int]=[0]
+        self._seasonalTables:typing.Dict[int,_ActiveTable]={}
+        if schedules is not None:
+            if isinstance(schedules,dict):
+                schedules=schedules.items()
+            for name,dateRanges in schedules:
+                self.add(name,dateRanges)
+
+    def __len__(self)->int:
+        return len(self._schedules)
+
+    def __contains__(self,name:str)->bool:
+        return name in self._schedules
+
+    def __getitem__(self,name:str)->CompiledDateRanges:
+        return self._schedules[name]
+
+    @property
+    def names(self)->typing.Iterable[str]:
+        """
+        the names of all schedules in the index
+        """
+        return self._schedules.keys()
+
+    def add(self,name:str,dateRanges:DateRangesCompatible)->None:
+        """
+        Add a schedule to the index
+        (if there is already one by that name, it is replaced)
+        """
+        if name in self._schedules:
+            self.remove(name)
+        if isinstance(dateRanges,CompiledDateRanges):
+            compiled=dateRanges
+        else:
+            compiled=asDateRanges(dateRanges).compiled
+        self._schedules[name]=compiled
+        for minute,windows in self._scheduleMinutes(compiled).items():
+            events=self._minuteEvents.get(minute)
+            if events is None:
+                events={}
+                self._minuteEvents[minute]=events
+                bisect.insort(self._eventMinutes,minute)
+            events[name]=windows
+        if len(compiled.dayBounds)>1:
+            for dayIndex in compiled.dayBounds:
+                self._dayEvents.setdefault(dayIndex,set()).add(name)
+        self._changed(compiled)
+    append=add
+
+    def remove(self,name:str)->None:
+        """
+        Remove a schedule from the index
+        """
+        compiled=self._schedules.pop(name)
+        for minute in self._scheduleMinutes(compiled):
+            events=self._minuteEvents[minute]
+            del events[name]
+            if not events:
+                del self._minuteEvents[minute]
+                del self._eventMinutes[
+                    bisect.bisect_left(self._eventMinutes,minute)]
+        if len(compiled.dayBounds)>1:
+            for dayIndex in compiled.dayBounds:
+                names=self._dayEvents[dayIndex]
+                names.discard(name)
+                if not names:
+                    del self._dayEvents[dayIndex]
+        self._changed(compiled)
+    __delitem__=remove
+
+    def _changed(self,compiled:CompiledDateRanges)->None:
+        """
+        throw away the activeAt() tables a schedule was in
+        """
+        if len(compiled.dayBounds)>1:
+            self._seasonalBounds=sorted({0}|set(self._dayEvents))
+            self._seasonalTables={}
+        else:
+            self._yearRoundTable=None
+
+    @staticmethod
+    def _scheduleMinutes(
+        compiled:CompiledDateRanges
+        )->typing.Dict[int,DayWindows]:
+        """
+        every minute of the week where a schedule may start or stop,
+        along with the days of the year where that is so
+        """
+        ret:typing.Dict[int,typing.List[typing.Tuple[int,int]]]={}
+        bounds=list(compiled.dayBounds)+[DAYS_PER_LEAP_YEAR]
+        for i,(starts,ends) in enumerate(zip(compiled.starts,compiled.ends)):
+            window=(bounds[i],bounds[i+1])
+            for minute in starts+ends:
+                ret.setdefault(minute%MINUTES_PER_WEEK,[]).append(window)
+        return {minute:tuple(windows) for minute,windows in ret.items()}
+
+    @staticmethod
+    def _dayIndices(day:datetime.date)->typing.Tuple[int,...]:
+        """
+        the dayOfYearIndex() values that land on a given day
+        (mar 1 also stands in for feb 29 when it is not a leap year)
+        """
+        index=dayOfYearIndex(day.month,day.day)
+        if index==LEAP_DAY_INDEX+1 and not calendar.isleap(day.year):
+            return (LEAP_DAY_INDEX,index)
+        return (index,)
+
+    def _changeTimes(self,
+        start:datetime.datetime,
+        end:datetime.datetime
+        )->typing.Generator[
+            typing.Tuple[datetime.datetime,typing.Set[str]],None,None]:
+        """
+        yield (when,names) for every time after start and up to and
+        including end where the named schedules may change
+        """
+        day=datetime.datetime.combine(start.date(),
+            datetime.time.min,start.tzinfo)
+        dayMinute=((start.weekday()+1)%7)*MINUTES_PER_DAY
+        while day<=end:
+            weekStart=day-datetime.timedelta(minutes=dayMinute)
+            dayIndices=self._dayIndices(day)
+            touched:typing.Set[str]=set()
+            if start<day:
+                for dayIndex in dayIndices:
+                    touched.update(self._dayEvents.get(dayIndex,()))
+            first=bisect.bisect_left(self._eventMinutes,dayMinute)
+            last=bisect.bisect_left(self._eventMinutes,
+                dayMinute+MINUTES_PER_DAY)
+            for minute in self._eventMinutes[first:last]:
+                when=weekStart+datetime.timedelta(minutes=minute)
+                if when<=start:
+                    continue
+                if when>end:
+                    if touched:
+                        yield day,touched
+                    return
+                if when!=day and touched:
+                    yield day,touched
+                    touched=set()
+                for name,windows in self._minuteEvents[minute].items():
+                    for dayIndex in dayIndices:
+                        if any(s<=dayIndex<e for s,e in windows):
+                            touched.add(name)
+                            break
+                if when!=day and touched:
+                    yield when,touched
+                    touched=set()
+            if touched:
+                yield day,touched
+            day+=datetime.timedelta(days=1)
+            dayMinute=(dayMinute+MINUTES_PER_DAY)%MINUTES_PER_WEEK
+
+    def changesBetween(self,
+        start:datetime.datetime,
+        end:datetime.datetime
+        )->typing.Generator[Change,None,None]:
+        """
+        Yield (when,name,isActive) for every time after start, and up to and
+        including end, where one of the schedules starts or stops
+
+        Changes are in time order.  This only visits the schedules that
+        actually have something happening, so the cost is proportional
+        to the number of changes (plus the number of days covered).
+        """
+        for when,names in self._changeTimes(start,end):
+            before=when-ONE_MICROSECOND
+            for name in names:
+                compiled=self._schedules[name]
+                isActive=compiled.contains(when)
+                if isActive!=compiled.contains(before):
+                    yield (when,name,isActive)
+
+    def _yearRound(self)->_ActiveTable:
+        """
+        the activeAt() table of the schedules that are the same all year
+        """
+        table=self._yearRoundTable
+        if table is None:
+            table=_ActiveTable(
+                (name,tuple(zip(compiled.starts[0],compiled.ends[0])))
+                for name,compiled in self._schedules.items()
+                if len(compiled.dayBounds)==1)
+            self._yearRoundTable=table
+        return table
+
+    def _seasonal(self,dayIndex:int)->_ActiveTable:
+        """
+        the activeAt() table of the rest of the schedules,
+        for the part of the year containing a dayOfYearIndex()
+        """
+        bounds=self._seasonalBounds
+        segmentStart=bounds[bisect.bisect_right(bounds,dayIndex)-1]
+        table=self._seasonalTables.get(segmentStart)
+        if table is None:
+            intervals=[]
+            for name,compiled in self._schedules.items():
+                if len(compiled.dayBounds)>1:
+                    segment=bisect.bisect_right(
+                        compiled.dayBounds,segmentStart)-1
+                    intervals.append((name,tuple(zip(
+                        compiled.starts[segment],compiled.ends[segment]))))
+            table=_ActiveTable(intervals)
+            self._seasonalTables[segmentStart]=table
+        return table
+
+    def activeAt(self,
+        when:typing.Optional[datetime.datetime]=None
+        )->typing.Set[str]:
+        """
+        The names of all schedules that are active at a given time
+
+        :property when: if None, use now()
+        """
+        if when is None:
+            when=datetime.datetime.now()
+        minute=minuteOfWeek(when)
+        ret=self._yearRound().activeAt(minute)
+        if len(self._seasonalBounds)>1:
+            ret.update(self._seasonal(
+                dayOfYearIndex(when.month,when.day)).activeAt(minute))
+        return ret
+
+    def __repr__(self)->str:
+        return f'DateRangesIndex of {len(self)} schedules'
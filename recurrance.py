@@ -4,7 +4,7 @@ A general-purpose time recurrance
 """
 import typing
 import datetime
-from dateTools import TimeUnitValueTypes,TimeUnit,Month
+from dateTools import TimeUnitValueTypes,TimeUnit,Day,Week,Month,Year
 
 
 class Recurrance:
@@ -96,6 +96,93 @@ class Recurrance:
             fromTime=datetime.datetime.now()
         return float(self.next().value)
 
+    def _unit(self)->type:
+        """
+        the TimeUnit class this recurrs every one of
+        """
+        unit=self.timeUnit
+        if not isinstance(unit,type):
+            unit=type(unit)
+        return unit
+
+    def _periodStart(self,when:datetime.datetime)->datetime.datetime:
+        """
+        the start of the timeUnit that a time is in
+        """
+        unit=self._unit()
+        day=datetime.datetime(when.year,when.month,when.day,
+            tzinfo=when.tzinfo)
+        if issubclass(unit,Day):
+            return day
+        if issubclass(unit,Week):
+            return day-datetime.timedelta(days=when.weekday())
+        if issubclass(unit,Month):
+            return day.replace(day=1)
+        if issubclass(unit,Year):
+            return day.replace(month=1,day=1)
+        raise Exception(f'Recurrance cannot recurr every {unit.__name__}')
+
+    def _periodAfter(self,periodStart:datetime.datetime)->datetime.datetime:
+        """
+        the start of the timeUnit after the one starting at periodStart
+        """
+        unit=self._unit()
+        if issubclass(unit,Day):
+            return periodStart+datetime.timedelta(days=1)
+        if issubclass(unit,Week):
+            return periodStart+datetime.timedelta(days=7)
+        if issubclass(unit,Month):
+            if periodStart.month==12:
+                return periodStart.replace(year=periodStart.year+1,month=1)
+            return periodStart.replace(month=periodStart.month+1)
+        return periodStart.replace(year=periodStart.year+1)
+
+    def _occourances(self,
+        periodStart:datetime.datetime
+        )->typing.List[datetime.datetime]:
+        """
+        all the times this recurrs within the timeUnit starting
+        at periodStart, in order
+
+        The indices are of the next lesser unit:
+            Day - hour of the day (from 0)
+            Week - day of the week (from 0=Monday)
+            Month - day of the month (from 1)
+            Year - month of the year (from 1)
+        Negative indices count back from the end (eg, -1 is the last day
+        of the month), fractions go part way into the lesser unit, and
+        anything out of bounds is clamped (eg, the 31st of February is
+        the 28th or 29th).
+        """
+        unit=self._unit()
+        periodEnd=self._periodAfter(periodStart)
+        firstIndex=0
+        if issubclass(unit,Year):
+            bounds=[periodStart.replace(month=month) for month in range(1,13)]
+            bounds.append(periodEnd)
+            firstIndex=1
+        else:
+            if issubclass(unit,Day):
+                step=datetime.timedelta(hours=1)
+            else:
+                step=datetime.timedelta(days=1)
+                if issubclass(unit,Month):
+                    firstIndex=1
+            bounds=[periodStart]
+            while bounds[-1]<periodEnd:
+                bounds.append(bounds[-1]+step)
+        count=len(bounds)-1
+        ret=set()
+        for index in self.indices:
+            if index<0:
+                index+=count
+            else:
+                index-=firstIndex
+            whole=min(max(int(index//1),0),count-1)
+            fraction=index-index//1
+            ret.add(bounds[whole]+(bounds[whole+1]-bounds[whole])*fraction)
+        return sorted(ret)
+
     def next(self,
         fromTime:typing.Optional[datetime.datetime]=None
         )->typing.Optional[datetime.datetime]:
@@ -107,16 +194,29 @@ class Recurrance:
         :param fromTime: time to start with, defaults to now
         :type fromTime: typing.Optional[datetime.datetime], optional
         :return: The instance found or None
-        :rtype: TimeUnit
+        :rtype: datetime.datetime
         """
         if fromTime is None:
             fromTime=datetime.datetime.now()
-        # TODO: Next is not written
-        return None
+        if not self.indices:
+            return None
+        when=fromTime
+        if self.starting is not None and self.starting>when:
+            when=self.starting
+        periodStart=self._periodStart(when)
+        while True:
+            for instance in self._occourances(periodStart):
+                if instance<=fromTime or \
+                    (self.starting is not None and instance<self.starting):
+                    continue
+                if self.ending is not None and instance>=self.ending:
+                    return None
+                return instance
+            periodStart=self._periodAfter(periodStart)
 
     def previous(self,
-        fromTime:typing.Optional[datetime.datetime]
-        )->typing.Optional[TimeUnit]:
+        fromTime:typing.Optional[datetime.datetime]=None
+        )->typing.Optional[datetime.datetime]:
         """
         Get the previous instance from a certain time(or from now)
 
@@ -125,9 +225,23 @@ class Recurrance:
         :param fromTime: time to start with, defaults to now
         :type fromTime: typing.Optional[datetime.datetime], optional
         :return: The instance found or None
-        :rtype: TimeUnit
+        :rtype: datetime.datetime
         """
         if fromTime is None:
             fromTime=datetime.datetime.now()
-        # TODO: Previous is not written
-        return None
+        if not self.indices:
+            return None
+        when=fromTime
+        if self.ending is not None and self.ending<when:
+            when=self.ending
+        periodStart=self._periodStart(when)
+        while True:
+            for instance in reversed(self._occourances(periodStart)):
+                if instance>=fromTime or \
+                    (self.ending is not None and instance>=self.ending):
+                    continue
+                if self.starting is not None and instance<self.starting:
+                    return None
+                return instance
+            periodStart=self._periodStart(
+                periodStart-datetime.timedelta(days=1))
@@ -47,6 +47,154 @@ class Test(unittest.TestCase):
             f=importutils.import(f)
             f.cmdline(['--help'])
 
+    def testCompiledNext(self):
+        import datetime
+        dr=DateRanges("mon 8:00-8:30AM,tue-sat 1:00-5:00PM")
+        friday=datetime.datetime(2026,10,16,12,0)
+        assert dr.next(friday)==friday
+        assert friday in dr
+        saturdayNight=datetime.datetime(2026,10,17,18,0)
+        assert dr.next(saturdayNight)==datetime.datetime(2026,10,19,8,0)
+        assert saturdayNight not in dr
+        overnight=DateRanges("sat 10:00PM-2:00AM")
+        sundayMorning=datetime.datetime(2026,10,18,1,0)
+        assert overnight.next(sundayMorning)==sundayMorning
+
+    def testOccurrences(self):
+        import datetime
+        dr=DateRanges("mon 8:00-8:30AM,tue-sat 1:00-5:00PM")
+        fridayAfternoon=datetime.datetime(2026,10,16,14,0)
+        tuesdayAfternoon=datetime.datetime(2026,10,20,15,0)
+        assert list(dr.occurrences(fridayAfternoon,tuesdayAfternoon))==[
+            (fridayAfternoon,datetime.datetime(2026,10,16,17,0)),
+            (datetime.datetime(2026,10,17,1,0),
+                datetime.datetime(2026,10,17,17,0)),
+            (datetime.datetime(2026,10,19,8,0),
+                datetime.datetime(2026,10,19,8,30)),
+            (datetime.datetime(2026,10,20,1,0),tuesdayAfternoon)]
+        # an interval across the end of the week comes out as one
+        overnight=DateRanges("sat 10:00PM-2:00AM")
+        assert list(overnight.occurrences(
+            datetime.datetime(2026,10,17,0,0),
+            datetime.datetime(2026,10,19,0,0)))==[
+            (datetime.datetime(2026,10,17,22,0),
+                datetime.datetime(2026,10,18,2,0))]
+
+    def testWeekBounds(self):
+        import datetime
+        wednesday=datetime.datetime(2026,10,14,15,0)
+        week=weekRange(wednesday)
+        bounds=list(iterateWeekBounds(wednesday,wednesday))
+        assert bounds==[(week.fromTime,
+            week.toDatetime+datetime.timedelta(microseconds=1))]
+        with self.assertRaises(Exception):
+            DateRange("mon-fri").iterateDayBounds()
+
+    def testComparableDatetimeUnrelated(self):
+        cdt=ComparableDatetime(5)
+        assert cdt==5 and cdt!=None and cdt!='5'
+        assert cdt in [None,'x',5]
+        with self.assertRaises(TypeError):
+            cdt<'5'
+
+    def testMask(self):
+        try:
+            import numpy as np
+        except ImportError:
+            self.skipTest("requires numpy")
+        dr=DateRanges("mon 8:00-8:30AM,tue-sat 1:00-5:00PM")
+        times=np.array([
+            '2026-10-16T12:00','2026-10-17T18:00','2026-10-19T08:15','NaT'],
+            dtype='datetime64[m]')
+        assert dr.mask(times).tolist()==[True,False,True,False]
+
+    def testSetAlgebra(self):
+        import datetime
+        storeHours=DateRanges("mon-sat 9:00AM-6:00PM")
+        staff=DateRanges("tue-sun 12:00PM-8:00PM")
+        tuesdayEvening=datetime.datetime(2026,10,20,19,0)
+        tuesdayNoon=datetime.datetime(2026,10,20,12,0)
+        assert tuesdayEvening in (storeHours|staff)
+        assert tuesdayEvening not in (storeHours&staff)
+        assert tuesdayNoon in (storeHours&staff)
+        assert tuesdayNoon not in (storeHours-staff)
+        assert tuesdayEvening in ~storeHours
+        assert (~~storeHours).compiled==storeHours.compiled
+        assert (storeHours&staff).next(tuesdayEvening)==\
+            datetime.datetime(2026,10,21,12,0)
+
+    def testDateRangesIndex(self):
+        import datetime
+        index=DateRangesIndex({
+            'early':"mon-fri 7:00AM-3:00PM",
+            'late':"mon-fri 11:00AM-7:00PM",
+            'weekend':"sat-sun 10:00AM-4:00PM"})
+        monday=datetime.datetime(2026,10,19,12,0)
+        assert index.activeAt(monday)=={'early','late'}
+        later=monday+datetime.timedelta(hours=4)
+        assert index.activeAt(later)=={'late'}
+        changes=list(index.changesBetween(monday,later))
+        assert changes==[(datetime.datetime(2026,10,19,15,0),'early',False)]
+        index.remove('late')
+        assert index.activeAt(later)==set()
+        index.add('summer',"jun-aug mon-fri 9:00AM-5:00PM")
+        assert index.activeAt(monday)=={'early'}
+        july=datetime.datetime(2026,7,20,16,0)
+        assert index.activeAt(july)=={'summer'}
+        assert index.activeAt(july-datetime.timedelta(hours=4))==\
+            {'early','summer'}
+
+    def testScheduledAlarm(self):
+        import datetime
+        from dateTools.alarmSet import ScheduledAlarm
+        alarm=ScheduledAlarm("tue-sat 1:00PM",print)
+        friday=datetime.datetime(2026,10,16,12,0)
+        fridayAtOne=datetime.datetime(2026,10,16,13,0)
+        assert alarm._nextTime(friday)==fridayAtOne
+        assert alarm._nextTime(fridayAtOne)==\
+            datetime.datetime(2026,10,17,13,0)
+        assert alarm._nextTime(datetime.datetime(2026,10,17,13,0))==\
+            datetime.datetime(2026,10,20,13,0)
+        hours=ScheduledAlarm(DateRanges("mon 8:00-8:30AM"),print)
+        assert hours._nextTime(datetime.datetime(2026,10,19,8,10))==\
+            datetime.datetime(2026,10,26,8,0)
+        payday=ScheduledAlarm(Recurrance(Month,[15,-1]),print)
+        assert payday._nextTime(friday)==datetime.datetime(2026,10,31,0,0)
+
+    def testRecurrance(self):
+        import datetime
+        payday=Recurrance(Month,[15,-1])
+        friday=datetime.datetime(2026,10,16,12,0)
+        assert payday.next(friday)==datetime.datetime(2026,10,31,0,0)
+        assert payday.previous(friday)==datetime.datetime(2026,10,15,0,0)
+        assert Recurrance(Month,31).next(datetime.datetime(2027,2,1))==\
+            datetime.datetime(2027,2,28,0,0)
+        mondays=Recurrance(Week,0,ending=datetime.datetime(2026,11,1))
+        assert list(mondays.between(friday,datetime.datetime(2027,1,1)))==\
+            [datetime.datetime(2026,10,19,0,0),
+            datetime.datetime(2026,10,26,0,0)]
+
+    def testTokenizerMatchesRegex(self):
+        from dateTools.dateRangeParser import BENCHMARK_CORPUS
+        unusual=("dec jan","jan 1 feb 1","17:00 12:00 am","5:00pm 6:00pm",
+            "feb first first","dec twenty- fifth","jan one hundred",
+            "may hundred february","jan 1,5","mon tue")
+        for rangestring in BENCHMARK_CORPUS+unusual:
+            assert parseDateRangeString(rangestring)==\
+                parseDateRangeStringRegex(rangestring),rangestring
+
+    def testTokenizerDiffersFromRegex(self):
+        # the differences documented in DateRangeParser
+        import datetime
+        spec=parseDateRangeString("dec 12:00AM")
+        assert spec.monthDay==1 and spec.time==datetime.time(0,0)
+        assert parseDateRangeStringRegex("dec 12:00AM").monthDay==12
+        for rangestring in ("dec twenty fifth","dec twenty-fifth"):
+            assert parseDateRangeString(rangestring).monthDay==25
+            assert parseDateRangeStringRegex(rangestring).monthDay==20
+        assert parseDateRangeString("sun tomorrow").toWeekday==0
+        assert parseDateRangeStringRegex("sun tomorrow").toWeekday==1
+
 
 def testSuite():
     """
@@ -55,6 +203,17 @@ def testSuite():
     testSuite = unittest.TestSuite()
     testSuite.addTest(Test("testDecoder"))
     testSuite.addTest(Test("testCommandLineHelp"))
+    testSuite.addTest(Test("testCompiledNext"))
+    testSuite.addTest(Test("testOccurrences"))
+    testSuite.addTest(Test("testWeekBounds"))
+    testSuite.addTest(Test("testMask"))
+    testSuite.addTest(Test("testComparableDatetimeUnrelated"))
+    testSuite.addTest(Test("testTokenizerMatchesRegex"))
+    testSuite.addTest(Test("testTokenizerDiffersFromRegex"))
+    testSuite.addTest(Test("testSetAlgebra"))
+    testSuite.addTest(Test("testDateRangesIndex"))
+    testSuite.addTest(Test("testScheduledAlarm"))
+    testSuite.addTest(Test("testRecurrance"))
     return testSuite
 
 